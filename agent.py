@@ -0,0 +1,319 @@
+import os
+import sys
+import copy
+import json
+import time
+import socket
+import threading
+import contextlib
+import errors
+from errors import BackendError
+
+# the client side only needs the standard library, so that CLI calls served
+# by the agent skip importing requests and jwt altogether
+ENCODING = 'utf-8'
+# seconds a running agent may take to answer the ping, a stalled agent is
+# skipped and the backend is contacted directly
+PING_TIMEOUT = 1
+# seconds a forwarded request may take, including the retries of the agent
+REQUEST_TIMEOUT = 120
+
+
+class AgentClient:
+    """
+    Forwards requests to a running agent over its Unix socket. It offers the
+    interface of SecureHandler, so the CLI can use both interchangeably. GET
+    results are cached for the lifetime of the client like in SecureHandler.
+    """
+    def __init__(self, socket_location, private_key_location, connection,
+                 exit_on_error=True):
+        """
+        :param socket_location: path of the agent socket
+        :param private_key_location: key file location
+        :param connection: http://<ip/domain>:port
+        :param exit_on_error: shut down the program on errors, otherwise a
+        BackendError is raised
+        """
+        self.socket_location = socket_location
+        self.private_key_location = private_key_location
+        self.connection = connection
+        self.exit_on_error = exit_on_error
+        self._thread_local = threading.local()
+        self.cache = {}
+        self.requests_issued = 0
+        self.requests_avoided = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def connect(cls, socket_location, private_key_location, connection,
+                exit_on_error=True):
+        """
+        Creates a client if an agent is listening on the socket.
+
+        :returns: AgentClient or None if no agent is running
+        """
+        if not os.path.exists(socket_location):
+            return None
+        client = cls(socket_location, private_key_location, connection,
+                     exit_on_error)
+        try:
+            client._call({'method': 'ping'}, PING_TIMEOUT)
+        except (OSError, ValueError):
+            # not listening, stalled (socket.timeout is an OSError) or not an
+            # agent
+            return None
+        return client
+
+    def _call(self, message, timeout=REQUEST_TIMEOUT):
+        """
+        Sends a single message and waits for the reply. Every call uses its
+        own connection, so the client can be used by several threads.
+
+        :param message: dict
+        :param timeout: seconds to wait for the connection and for the reply
+        :returns: reply dict
+        """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(self.socket_location)
+            with sock.makefile('rwb') as stream:
+                stream.write(json.dumps(message).encode(ENCODING) + b'\n')
+                stream.flush()
+                line = stream.readline()
+        if not line:
+            raise ConnectionError('The agent closed the connection.')
+        return json.loads(line.decode(ENCODING))
+
+    def _fail(self, message, error=BackendError):
+        """
+        Prints the error message and shuts down the program, or raises a
+        BackendError containing the message if `exit_on_error` is disabled.
+
+        :param error: BackendError subclass to be raised
+        """
+        if not self.exit_on_error or getattr(self._thread_local, 'raising',
+                                             False):
+            raise error(message)
+        print(message)
+        sys.exit(1)
+
+    @contextlib.contextmanager
+    def raising(self):
+        """
+        Raises BackendErrors for the requests of the calling thread, see
+        SecureHandler.raising.
+        """
+        previous = getattr(self._thread_local, 'raising', False)
+        self._thread_local.raising = True
+        try:
+            yield self
+        finally:
+            self._thread_local.raising = previous
+
+    def _forward(self, method, resource, data=None):
+        """
+        Lets the agent execute a request.
+
+        :param method: 'get', 'put', 'patch', 'safe_put' or 'safe_patch'
+        :param resource: JSON resource
+        :param data: dict for writes
+        :returns: json dict
+        """
+        try:
+            reply = self._call({'method': method, 'resource': resource,
+                                'data': data, 'connection': self.connection,
+                                'key': self.private_key_location})
+        except socket.timeout:
+            self._count(1, 0)
+            self._fail('The agent did not answer within {}s.'
+                       .format(REQUEST_TIMEOUT))
+        except (OSError, ValueError):
+            self._count(1, 0)
+            self._fail('Connection to the agent was lost.')
+        # the requests the agent sent to the backend, eg GET and PATCH of a
+        # safe_patch without a known state
+        self._count(reply.get('requests', 1), reply.get('avoided', 0))
+        if 'error' in reply:
+            # the class tells eg an open circuit breaker from its cause
+            error = getattr(errors, reply.get('error_type', ''), BackendError)
+            if not (isinstance(error, type) and
+                    issubclass(error, BackendError)):
+                error = BackendError
+            self._fail(reply['error'], error)
+        return reply['body']
+
+    def _count(self, issued, avoided):
+        with self._lock:
+            self.requests_issued += issued
+            self.requests_avoided += avoided
+
+    def clear_cache(self):
+        with self._lock:
+            self.cache.clear()
+
+    def get(self, resource, fresh=False):
+        """
+        GETs the resource through the agent, see SecureHandler.get.
+
+        :param resource: JSON resource to be consumed
+        :param fresh: bypass the cache and fetch the current state
+        :returns: json dict
+        """
+        with self._lock:
+            cached = self.cache.get(resource)
+            if cached is not None and not fresh:
+                self.requests_avoided += 1
+                return copy.deepcopy(cached)
+        resp = self._forward('get', resource)
+        with self._lock:
+            self.cache[resource] = copy.deepcopy(resp)
+        return resp
+
+    def _update_cache(self, resource, data):
+        with self._lock:
+            if resource in self.cache:
+                self.cache[resource].update(copy.deepcopy(data))
+            elif '?' in resource:
+                path = resource.split('?')[0]
+                for cached in list(self.cache):
+                    if cached.split('?')[0] in (path, '/cfg'):
+                        del self.cache[cached]
+
+    def put(self, resource, data):
+        resp = self._forward('put', resource, data)
+        self._update_cache(resource, data)
+        return resp
+
+    def patch(self, resource, data):
+        resp = self._forward('patch', resource, data)
+        self._update_cache(resource, data)
+        return resp
+
+    def safe_put(self, resource, data):
+        # the handler of the agent merges the data into the state it knows
+        resp = self._forward('safe_put', resource, data)
+        self._update_cache(resource, data)
+        return resp
+
+    def safe_patch(self, resource, data):
+        resp = self._forward('safe_patch', resource, data)
+        self._update_cache(resource, data)
+        return resp
+
+
+class Agent:
+    """
+    Keeps one SecureHandler per key file and backend alive and executes the
+    requests forwarded by AgentClient objects with them. Handlers are created
+    without cache, so every forwarded GET returns the current state, and are
+    replaced (reusing their session) once their token lifetime has passed.
+    """
+    def __init__(self, token_lifetime, policy=None):
+        """
+        :param token_lifetime: seconds an access token is used
+        :param policy: ConnectionPolicy of the handlers
+        """
+        self.token_lifetime = token_lifetime
+        self.policy = policy
+        self.handlers = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def _handler(self, private_key_location, connection):
+        """
+        :returns: live SecureHandler of the key file/backend combination
+        """
+        from secure_handler import SecureHandler
+
+        key = (private_key_location, connection)
+        with self._lock:
+            handler, created = self.handlers.get(key, (None, 0))
+            if handler is None or \
+                    time.monotonic() - created >= self.token_lifetime:
+                handler = SecureHandler(private_key_location, connection,
+                                        session=handler and handler.session,
+                                        policy=self.policy,
+                                        exit_on_error=False, cache=False)
+                self.handlers[key] = (handler, time.monotonic())
+            return handler
+
+    def execute(self, message):
+        """
+        Executes a forwarded request.
+
+        :param message: request dict sent by AgentClient
+        :returns: reply dict with either `body` or `error`
+        """
+        method = message.get('method')
+        if method == 'ping':
+            return {'body': None}
+        if method not in ('get', 'put', 'patch', 'safe_put', 'safe_patch'):
+            return {'error': 'Unknown agent request {}.'.format(method)}
+        with self._lock:
+            self.requests += 1
+        handler = None
+        try:
+            handler = self._handler(message['key'], message['connection'])
+            counts = handler.thread_counts()
+            if method == 'get':
+                reply = {'body': handler.get(message['resource'])}
+            else:
+                reply = {'body': getattr(handler, method)(message['resource'],
+                                                          message['data'])}
+        except BackendError as err:
+            reply = {'error': str(err), 'error_type': type(err).__name__}
+        if handler is not None:
+            # every forwarded request is executed on its own thread
+            issued, avoided = handler.thread_counts()
+            reply['requests'] = issued - counts[0]
+            reply['avoided'] = avoided - counts[1]
+        return reply
+
+
+def serve(socket_location, agent):
+    """
+    Listens on the Unix socket until the process is interrupted. The socket
+    is only accessible by the owner, as it allows to send signed requests.
+
+    :param socket_location: path of the socket
+    :param agent: Agent executing the requests
+    """
+    import signal
+    import socketserver
+
+    class RequestHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                try:
+                    reply = agent.execute(json.loads(line.decode(ENCODING)))
+                except (ValueError, KeyError, AttributeError):
+                    reply = {'error': 'Invalid agent request.'}
+                self.wfile.write(json.dumps(reply).encode(ENCODING) + b'\n')
+                self.wfile.flush()
+
+    if os.path.exists(socket_location):
+        if AgentClient.connect(socket_location, None, None) is not None:
+            print('An agent is already listening on {}.'
+                  .format(socket_location))
+            sys.exit(1)
+        # left behind by an agent which was killed
+        os.remove(socket_location)
+
+    umask = os.umask(0o177)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(socket_location,
+                                                        RequestHandler)
+    finally:
+        os.umask(umask)
+    server.daemon_threads = True
+    # stop cleanly if terminated by a service manager
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print('Agent listening on {}'.format(socket_location), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_location)
+        print('Agent stopped after {} requests'.format(agent.requests))
@@ -0,0 +1,214 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+import statistics
+import simulator
+
+SCALES = (10, 100, 1000, 10000)
+REPEAT = 5
+TOLERANCE = 0.25
+# mode name, CLI arguments; {last} is replaced by the highest miner ID
+MODES = (('info', ['-i']),
+         ('all', ['-a']),
+         ('summary', ['-s']),
+         ('miners', ['-m']),
+         ('query', ['-q', '0-{last}']),
+         ('fleet', ['--fleet', 'all', '-t', '-s']),
+         ('set', ['set', '--target', '25', '--threshold', '800']),
+         ('set-miners', ['set', '--miner', '0-9', 'on']),
+         ('commit', ['-c']),
+         ('watch', ['watch', '-n', '0.01', '--count', '3']))
+REPO = os.path.dirname(os.path.abspath(__file__))
+
+
+def _create_key_pair(folder):
+    """
+    Writes a new RSA key pair for signing and verifying the access tokens.
+
+    :param folder: target directory
+    :returns: (private key path, public key path)
+    """
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048,
+                                   backend=default_backend())
+    private_location = os.path.join(folder, 'jwtRS256.key')
+    public_location = private_location + '.pub'
+    with open(private_location, 'wb') as file:
+        file.write(key.private_bytes(serialization.Encoding.PEM,
+                                     serialization.PrivateFormat.PKCS8,
+                                     serialization.NoEncryption()))
+    with open(public_location, 'wb') as file:
+        file.write(key.public_key().public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo))
+    return private_location, public_location
+
+
+def _run_cli(home, args):
+    """
+    Runs the CLI of this working tree as a separate process.
+
+    :param home: HOME directory containing the .minerctl config
+    :param args: CLI arguments
+    :returns: (returncode, wall time in seconds)
+    """
+    env = dict(os.environ, HOME=home, PYTHONPATH=REPO)
+    env.pop('MINERCTL_METRICS', None)
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c',
+                             'import sys, cli; sys.exit(cli.main())', *args],
+                            cwd=home, env=env, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+    return result.returncode, time.perf_counter() - start
+
+
+def run_scale(miners, modes, repeat, latency, failure_rate):
+    """
+    Benchmarks every mode against a fresh simulated backend.
+
+    :param miners: number of simulated miners
+    :param modes: list of (mode name, CLI arguments)
+    :param repeat: measured runs per mode
+    :param latency: seconds the simulator adds to every request
+    :param failure_rate: share of requests the simulator fails
+    :returns: dict with mode: result dict
+    """
+    with tempfile.TemporaryDirectory() as home:
+        private_key, public_key = _create_key_pair(home)
+        random.seed(miners)
+        server = simulator.serve(public_key, port=0, miners=miners,
+                                 latency=latency, failure_rate=failure_rate)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        address = '127.0.0.1:{}'.format(server.server_address[1])
+        _run_cli(home, ['-b', address, '-k', private_key])
+        _run_cli(home, ['--add-backend', 'sim', address])
+
+        results = {}
+        try:
+            for name, args in modes:
+                args = [arg.format(last=miners - 1) for arg in args]
+                # warm up, eg to fill the token cache
+                _run_cli(home, args)
+                durations, requests, failures = [], [], 0
+                for _ in range(repeat):
+                    before = server.state.requests
+                    returncode, duration = _run_cli(home, args)
+                    requests.append(server.state.requests - before)
+                    durations.append(duration)
+                    failures += returncode != 0
+                latency_median = statistics.median(durations)
+                results[name] = {
+                    'latency': latency_median,
+                    'latency_min': min(durations),
+                    'requests': statistics.median(requests),
+                    'throughput': statistics.median(requests) / latency_median,
+                    'failures': failures}
+        finally:
+            server.shutdown()
+            server.server_close()
+        return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares the results with a stored baseline.
+
+    :param results: dict with 'mode@miners': result dict
+    :param baseline: dict of the same structure
+    :param tolerance: allowed relative latency increase, eg 0.25
+    :returns: dict with 'mode@miners': list of regression descriptions
+    """
+    regressions = {}
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        found = []
+        if result['latency'] > base['latency'] * (1 + tolerance):
+            found.append('latency +{:.0f}%'.format(
+                (result['latency'] / base['latency'] - 1) * 100))
+        if result['requests'] > base['requests']:
+            found.append('requests {} -> {}'.format(base['requests'],
+                                                    result['requests']))
+        if result['failures'] > base['failures']:
+            found.append('failures {} -> {}'.format(base['failures'],
+                                                    result['failures']))
+        if found:
+            regressions[key] = found
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the minerctl '
+                                     'modes against a simulated backend')
+    parser.add_argument('--scales', help='comma separated miner counts '
+                        '(default: {})'.format(','.join(map(str, SCALES))),
+                        default=','.join(map(str, SCALES)), metavar='<list>')
+    parser.add_argument('--modes', help='comma separated subset of: {}'
+                        .format(', '.join(name for name, _ in MODES)),
+                        metavar='<list>')
+    parser.add_argument('--repeat', help='measured runs per mode (default: '
+                        '{})'.format(REPEAT), type=int, default=REPEAT)
+    parser.add_argument('--latency', help='seconds the backend adds to every '
+                        'request', type=float, default=0.0)
+    parser.add_argument('--failure-rate', help='share of requests the backend '
+                        'fails, eg 0.1', type=float, default=0.0)
+    parser.add_argument('--baseline', help='flag regressions against this '
+                        'results file', metavar='<path>')
+    parser.add_argument('--tolerance', help='allowed relative latency '
+                        'increase (default: {})'.format(TOLERANCE), type=float,
+                        default=TOLERANCE)
+    parser.add_argument('--save', help='write the results to this file, eg to '
+                        'create a new baseline', metavar='<path>')
+    args = parser.parse_args()
+
+    modes = MODES
+    if args.modes:
+        names = args.modes.split(',')
+        unknown = set(names) - {name for name, _ in MODES}
+        if unknown:
+            print('Unknown modes: {}'.format(', '.join(sorted(unknown))))
+            sys.exit(1)
+        modes = [mode for mode in MODES if mode[0] in names]
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+
+    results = {}
+    print('{:<12}{:>8}{:>12}{:>12}{:>10}{:>12}{:>10}  {}'
+          .format('mode', 'miners', 'latency', 'min', 'requests', 'req/s',
+                  'failures', 'regression'))
+    for miners in (int(scale) for scale in args.scales.split(',')):
+        for name, result in run_scale(miners, modes, args.repeat,
+                                      args.latency, args.failure_rate).items():
+            key = '{}@{}'.format(name, miners)
+            results[key] = result
+            regression = compare({key: result}, baseline, args.tolerance)
+            print('{:<12}{:>8}{:>10.1f}ms{:>10.1f}ms{:>10g}{:>12.1f}{:>10}  {}'
+                  .format(name, miners, result['latency'] * 1000,
+                          result['latency_min'] * 1000, result['requests'],
+                          result['throughput'], result['failures'],
+                          ', '.join(regression.get(key, ()))))
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print('{} regressions against {}'.format(len(regressions),
+                                                 args.baseline))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,74 @@
+import time
+STARTUP_PROCESS_TIME = time.process_time()
+_IMPORT_START = time.perf_counter()
 import os
+import atexit
 import sys
 import argparse
 import configparser
-from collections import Counter
 from pathlib import Path
-import pkg_resources
-from secure_handler import SecureHandler
+from token_cache import TokenCache
+import fleet
+import miner_states
+from miner_states import (MinerStates, format_ranges, parse_ranges,
+                          state_name)
+# heavy modules (requests, jwt, concurrent.futures, importlib.metadata) are
+# only imported on the code paths which need them, see `--startup-profile`
 
 HOME = str(Path.home())
 CONFIG_FILE_LOCATION = HOME + '/' + '.minerctl'
 CONFIG_FILE_NAME = 'config.ini'
 CONFIG_FILE = CONFIG_FILE_LOCATION + '/' + CONFIG_FILE_NAME
+TOKEN_CACHE_FILE = CONFIG_FILE_LOCATION + '/' + 'tokens.json'
+TELEMETRY_FILE = CONFIG_FILE_LOCATION + '/' + 'telemetry.ring'
+AGENT_SOCKET = CONFIG_FILE_LOCATION + '/' + 'agent.sock'
+RESPONSE_CACHE_FILE = CONFIG_FILE_LOCATION + '/' + 'responses.sqlite'
 PARSER = argparse.ArgumentParser()
 SUBPARSERS = PARSER.add_subparsers(dest='set_mode', metavar='modes')
 SET_PARSER = SUBPARSERS.add_parser('set',
                                    help='SET mode for remote configuration')
+WATCH_PARSER = SUBPARSERS.add_parser('watch', help='continuously poll '
+                                     'resources and show changed values')
+RECORD_PARSER = SUBPARSERS.add_parser('record', help='record telemetry '
+                                      'samples into a local ring buffer')
+STATS_PARSER = SUBPARSERS.add_parser('stats', help='show statistics of the '
+                                     'recorded telemetry')
+EXPORT_PARSER = SUBPARSERS.add_parser('export', help='serve the telemetry '
+                                      'as Prometheus metrics')
+SHELL_PARSER = SUBPARSERS.add_parser('shell', help='interactive shell '
+                                     'running commands over one session')
+AGENT_PARSER = SUBPARSERS.add_parser('agent', help='keep backend sessions '
+                                     'and tokens warm for subsequent calls')
+PLAN_PARSER = SUBPARSERS.add_parser('plan', help='show the changes needed '
+                                    'to reach a desired state')
+APPLY_PARSER = SUBPARSERS.add_parser('apply', help='make the changes needed '
+                                     'to reach a desired state and commit')
+FETCH_WORKERS = 8
+FLEET_WORKERS = 16
+FLEET_TIMEOUT = 10
+ROLLOUT_CANARY = 1
+ROLLOUT_GROWTH = 2
+TOKEN_LIFETIME = 600
+MINER_WORKERS = 8
+QUERY_CFG_THRESHOLD = 8
+WATCH_INTERVAL = 5
+WATCH_RESOURCES = {'temp': '/temp', 'filter': '/filter', 'fans': '/fans',
+                   'mode': '/mode', 'pid': '/pid', 'miners': '/cfg'}
+RECORD_INTERVAL = 60
+# adaptive polling backs off up to this multiple of the interval
+ADAPTIVE_BACKOFF_LIMIT = 16
+# requests per minute and backend
+POLL_BUDGET = 60
+EXPORT_INTERVAL = 15
+# modes which keep polling the backend until they are interrupted
+POLLING_MODES = ('watch', 'record', 'export')
+# options which only make sense for a single invocation
+SHELL_EXCLUDED = ('key', 'backend', 'token_lifetime', 'add_backend',
+                  'add_group', 'fleet', 'startup_profile', 'timings', 'profile',
+                  'no_agent', 'no_cache', 'max_age')
+STARTUP_TIMINGS = [('start', _IMPORT_START)]
+# set to `json` to write the request timings to stderr, eg for cron jobs
+METRICS_ENV = 'MINERCTL_METRICS'
 
 def _prepare_folder():
     """
@@ -43,13 +97,105 @@ def _load_config(section, attr):
         sys.exit(1)
     return None
 
+def _load_optional_config(section, attr, default):
+    """
+    Loads an optional config value.
+
+    :param section: .ini section, eg [Setup]
+    :param attr: .ini variable name
+    :param default: returned if the value is not set
+    :returns: the requested value as str or the default
+    """
+    config = configparser.ConfigParser()
+    config.read(CONFIG_FILE)
+    return config.get(section, attr, fallback=default)
+
+def _token_cache():
+    """
+    Creates the on-disk token cache with the configured lifetime.
+
+    :returns: TokenCache or None if caching is disabled (lifetime 0)
+    """
+    lifetime = _load_optional_config('PKI', 'token_lifetime', TOKEN_LIFETIME)
+    try:
+        lifetime = int(lifetime)
+    except ValueError:
+        print('token_lifetime has to be an integer!')
+        sys.exit(1)
+    if lifetime <= 0:
+        return None
+    return TokenCache(TOKEN_CACHE_FILE, lifetime)
+
+def _response_cache(args):
+    """
+    Creates the persistent response cache. The TTLs of the cached resources
+    can be changed in the optional [Cache] section (eg `pid = 60`, 0 disables
+    caching of the resource), `max_entries` limits its size.
+
+    :param args: argparse parser result
+    :returns: ResponseCache or None if disabled with `--no-cache`
+    """
+    if args.no_cache:
+        return None
+    from response_cache import (ResponseCache, DEFAULT_TTLS,
+                                DEFAULT_MAX_ENTRIES)
+
+    ttls = {}
+    for resource, default in DEFAULT_TTLS.items():
+        ttl = _int(_load_optional_config('Cache', resource.lstrip('/'),
+                                         default),
+                   '{} TTL'.format(resource), PARSER)
+        if ttl > 0:
+            ttls[resource] = ttl
+    max_entries = _int(_load_optional_config('Cache', 'max_entries',
+                                             DEFAULT_MAX_ENTRIES),
+                       'max_entries', PARSER)
+    return ResponseCache(RESPONSE_CACHE_FILE, ttls, args.max_age, max_entries)
+
+def _connection_policy(deadline=None, long_running=False):
+    """
+    Creates the connection policy from the optional [Connection] settings
+    connect_timeout, read_timeout, retries, backoff, deadline,
+    breaker_threshold, breaker_cooldown and pool_maxsize and the optional
+    [TLS] settings ca_file and fingerprint.
+
+    :param deadline: overrides the configured deadline in seconds
+    :param long_running: disables the deadline, eg for the watch mode
+    :returns: ConnectionPolicy
+    """
+    from secure_handler import ConnectionPolicy
+
+    policy = ConnectionPolicy()
+    config = configparser.ConfigParser()
+    config.read(CONFIG_FILE)
+    for attr, cast in (('connect_timeout', float), ('read_timeout', float),
+                       ('retries', int), ('backoff', float),
+                       ('deadline', float), ('breaker_threshold', int),
+                       ('breaker_cooldown', float), ('pool_maxsize', int)):
+        if config.has_option('Connection', attr):
+            try:
+                setattr(policy, attr, cast(config['Connection'][attr]))
+            except ValueError:
+                print('{} has to be a number!'.format(attr))
+                sys.exit(1)
+    if config.has_option('TLS', 'ca_file'):
+        policy.ca_file = os.path.expanduser(config['TLS']['ca_file'])
+    if config.has_option('TLS', 'fingerprint'):
+        policy.fingerprint = config['TLS']['fingerprint'].replace(':', '')
+    if deadline:
+        policy.deadline = deadline
+    if long_running:
+        policy.deadline = None
+    return policy
+
 def _parse_url(url):
     """
     Appends the protocol to the URI, if necessary (for requests package).
+    https:// addresses are kept, plain ones default to http://.
 
     :returns: uri str
     """
-    if not url.startswith('http://'):
+    if not url.startswith(('http://', 'https://')):
         url = 'http://' + url
     return url
 
@@ -66,10 +212,9 @@ def _create_config(section, attr, val):
     for sec in config.sections():
         for (existing_key, existing_val) in config.items(sec):
             config[sec][existing_key] = existing_val
-    if config.has_option(section, attr):
-        config[section][attr] = val
-    else:
-        config[section] = {attr: val}
+    if not config.has_section(section):
+        config.add_section(section)
+    config[section][attr] = val
     with open(CONFIG_FILE, 'w') as file:
         config.write(file)
 
@@ -119,23 +264,1181 @@ def _error_exit(parser):
     parser.print_help()
     sys.exit(1)
 
-def _int(var, msg):
+def _int(var, msg, parser=SET_PARSER):
     """
     Attempts to cast a (str) value/object into an integer and exits the program
     in case an unparsable value is present.
 
     :param var: eg "5"
     :msg: will be inserted into '{} has to be an integer!' error message
+    :param parser: argparse parser whose help is printed on errors
     :returns: casted int
     """
     try:
         integer = int(var)
     except ValueError:
         print('{} has to be an integer!'.format(msg))
-        _error_exit(SET_PARSER)
+        _error_exit(parser)
     return integer
 
-def _setup_arguments():
+def _positive_int(value):
+    """
+    argparse type of counts which have to be at least 1, eg of workers.
+
+    :param value: eg "5"
+    :returns: casted int
+    """
+    try:
+        integer = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('{} is not an integer'.format(value))
+    if integer < 1:
+        raise argparse.ArgumentTypeError('{} is not a positive integer'
+                                         .format(value))
+    return integer
+
+def _parse_ids(spec, msg, parser=SET_PARSER):
+    """
+    Parses a list of IDs and ID ranges, eg "0-63,70,80-99". Duplicates are
+    removed, the order is kept.
+
+    :param spec: comma separated IDs or ranges
+    :param msg: will be inserted into the error messages
+    :param parser: argparse parser whose help is printed on errors
+    :returns: list of int
+    """
+    try:
+        ranges = parse_ranges(spec, msg)
+    except ValueError as err:
+        print(err)
+        _error_exit(parser)
+    return list(dict.fromkeys(miner_id for start, stop in ranges
+                              for miner_id in range(start, stop)))
+
+def _query_from_cfg(args, ids):
+    """
+    Decides how the miners passed to `--query` are looked up. Few IDs are
+    fetched in parallel from `/miner`, larger lists are answered from a single
+    `/cfg` snapshot, as is every list if `/cfg` is needed anyway.
+
+    :param args: argparse parser result
+    :param ids: list of the queried miner IDs
+    :returns: True if `/cfg` should be used
+    """
+    return (len(ids) > QUERY_CFG_THRESHOLD or args.all or args.miners
+            or args.summary)
+
+
+def _send_miner_actions(sec_handler, actions, workers, stagger=0):
+    """
+    Sends miner actions with bounded concurrency. The action endpoint does not
+    take any data, so the requests are sent without reading the miner state
+    first.
+
+    :param sec_handler: SecureHandler object
+    :param actions: list of (miner ID, action) tuples
+    :param workers: maximum number of requests in flight
+    :param stagger: delay in seconds between the start of two requests
+    :returns: (list with an error str or None per action, elapsed seconds)
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from errors import BackendError
+
+    def send(index, action):
+        delay = start + index * stagger - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        # collect the failures per miner instead of stopping at the first one
+        try:
+            with sec_handler.raising():
+                sec_handler.patch('/miner?id={}&action={}'.format(*action),
+                                  {})
+        except BackendError as err:
+            return str(err)
+        return None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=min(workers, len(actions))) as pool:
+        errors = list(pool.map(send, range(len(actions)), actions))
+    return errors, time.perf_counter() - start
+
+def _dispatch_miner_actions(sec_handler, miner_ids, action, workers,
+                            stagger=0):
+    """
+    Sends the action to all the passed miners and prints a report per ID,
+    see `_send_miner_actions`.
+
+    :param sec_handler: SecureHandler object
+    :param miner_ids: list of miner IDs
+    :param action: on, off, register or deregister
+    :param workers: maximum number of requests in flight
+    :param stagger: delay in seconds between the start of two requests
+    :returns: True if the action succeeded for every miner
+    """
+    errors, elapsed = _send_miner_actions(
+        sec_handler, [(miner_id, action) for miner_id in miner_ids], workers,
+        stagger)
+    for miner_id, error in zip(miner_ids, errors):
+        print('Miner #{}: {}'.format(miner_id,
+                                     'failed ({})'.format(error) if error
+                                     else action))
+    failed = sum(1 for error in errors if error)
+    print('Sent {} to {} miners in {:.3f}s ({:.1f} requests/s), {} failed'
+          .format(action, len(miner_ids), elapsed,
+                  len(miner_ids) / elapsed if elapsed else 0, failed))
+    return not failed
+
+def _collect_set_changes(args):
+    """
+    Groups all the values passed to the SET mode by resource, so that every
+    resource is updated with a single read-modify-write cycle. All the values
+    are validated before anything is sent to the backend.
+
+    :param args: argparse parser result
+    :returns: dict with resource: (method, data dict) in the order of the
+    options
+    """
+    options = (('/temp', 'patch', 'target', args.set_target,
+                'Target temperature'),
+               ('/temp', 'patch', 'sensor_id', args.set_sensor_id,
+                'Sensor ID'),
+               ('/temp', 'patch', 'external', args.set_external,
+                'External temperature'),
+               ('/filter', 'patch', 'threshold', args.set_threshold,
+                'Threshold'),
+               ('/fans', 'patch', 'min_rpm', args.set_min_rpm, 'Minimum RPM'),
+               ('/fans', 'patch', 'max_rpm', args.set_max_rpm, 'Maximum RPM'),
+               ('/pid', 'put', 'proportional', args.set_proportional,
+                'PID Proportional'),
+               ('/pid', 'put', 'derivative', args.set_derivative,
+                'PID derivative'),
+               ('/pid', 'put', 'integral', args.set_integral, 'PID integral'),
+               ('/pid', 'put', 'bias', args.set_bias, 'PID bias'))
+    changes = {}
+    for resource, method, attr, value, msg in options:
+        if value:
+            _, data = changes.setdefault(resource, (method, {}))
+            data[attr] = _int(value, msg)
+    return changes
+
+def _version():
+    """
+    Looks up the installed version of the CLI tool. `importlib.metadata` is
+    preferred as `pkg_resources` scans all installed distributions on import.
+
+    :returns: version str
+    """
+    try:
+        from importlib.metadata import version
+    except ImportError:
+        import pkg_resources
+        return pkg_resources.require('minerctl_cli')[0].version
+    return version('minerctl_cli')
+
+def _mark(label):
+    """
+    Records the end of a startup phase for `--startup-profile`. Only the
+    first end of a phase is kept, eg of the requests of the first command
+    in the shell.
+
+    :param label: phase description
+    """
+    if any(recorded == label for recorded, _ in STARTUP_TIMINGS):
+        return
+    STARTUP_TIMINGS.append((label, time.perf_counter()))
+
+def _print_startup_profile(budget):
+    """
+    Prints the duration of every recorded startup phase. Registered as exit
+    handler, so that it is also shown if the program is exited early.
+
+    :param budget: startup budget in milliseconds, 0 if none
+    """
+    _mark('exit')
+    print('Startup profile:')
+    print('  {:<30} {:>8.1f}ms'.format('interpreter startup (cpu)',
+                                       STARTUP_PROCESS_TIME * 1000))
+    for (_, previous), (label, timestamp) in zip(STARTUP_TIMINGS,
+                                                  STARTUP_TIMINGS[1:]):
+        print('  {:<30} {:>8.1f}ms'.format(label,
+                                           (timestamp - previous) * 1000))
+    total = (STARTUP_TIMINGS[-1][1] - STARTUP_TIMINGS[0][1]) * 1000
+    print('  {:<30} {:>8.1f}ms'.format('total (since cli import)', total))
+    if budget and total > budget:
+        print('Startup budget of {}ms exceeded by {:.1f}ms'
+              .format(budget, total - budget))
+
+def _instrumentation(args):
+    """
+    Enables the request timings if `--timings` was passed or the metrics
+    environment variable is set to `json`, the results are reported at exit.
+    Starts the profiler if `--profile` was passed.
+
+    :param args: argparse parser result
+    :returns: instrumentation.Timings or None if the timings are disabled
+    """
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        atexit.register(_dump_profile, profiler, args.profile)
+        profiler.enable()
+
+    metrics_json = os.environ.get(METRICS_ENV, '').lower() == 'json'
+    if not args.timings and not metrics_json:
+        return None
+    from instrumentation import Timings
+    timings = Timings()
+    if args.timings:
+        atexit.register(timings.print_summary)
+    if metrics_json:
+        atexit.register(lambda: print(timings.as_json(), file=sys.stderr))
+    return timings
+
+def _dump_profile(profiler, location):
+    """
+    Stops the profiler and writes its stats, which can be inspected with the
+    pstats module or tools like snakeviz.
+
+    :param profiler: cProfile.Profile
+    :param location: stats file path
+    """
+    profiler.disable()
+    profiler.dump_stats(location)
+
+def _run_agent():
+    """
+    Runs the agent in the foreground until it is interrupted. Subsequent CLI
+    calls forward their requests to it over a Unix socket.
+    """
+    import agent
+
+    token_cache = _token_cache()
+    agent.serve(AGENT_SOCKET,
+                agent.Agent(token_cache.lifetime if token_cache
+                            else TOKEN_LIFETIME,
+                            _connection_policy(long_running=True)))
+
+def _requested_resources(args):
+    """
+    Collects the resources which have to be fetched for the passed read
+    options, without duplicates and in the order they are printed.
+
+    :param args: argparse parser result
+    :returns: list of resource paths, eg ['/temp', '/cfg']
+    """
+    options = ((args.info, '/info'),
+               (args.temp, '/temp'),
+               (args.filter, '/filter'),
+               (args.ventilation, '/fans'),
+               (args.operation, '/mode'),
+               (args.pid, '/pid'),
+               (args.miners or args.summary, '/cfg'))
+    resources = [resource for given, resource in options if given or args.all]
+    if args.query:
+        ids = _parse_ids(args.query, 'Miner ID', PARSER)
+        if not _query_from_cfg(args, ids):
+            resources.extend('/miner?id={}'.format(i) for i in ids)
+        elif '/cfg' not in resources:
+            resources.append('/cfg')
+    return resources
+
+def _fetch_resources(sec_handler, resources, workers=FETCH_WORKERS,
+                     fresh=False, callback=None, raise_errors=False):
+    """
+    GETs the passed resources concurrently on a bounded thread pool. The
+    first failure is reported once by the calling thread, as the handler
+    would do for a single request: the program is shut down, or the
+    BackendError is raised if `exit_on_error` is disabled.
+
+    :param sec_handler: SecureHandler object
+    :param resources: list of resource paths
+    :param workers: maximum number of requests in flight
+    :param fresh: bypass the cache of the handler
+    :param callback: called with (resource, json dict) as soon as a resource
+    has been fetched
+    :param raise_errors: raise the BackendError even if the handler would
+    shut down the program
+    :returns: tuple of (dict with resource: json dict in the order of
+    `resources`, summed duration of the single requests in seconds)
+    """
+    def timed_get(resource):
+        start = time.perf_counter()
+        # the workers raise instead of each printing the error and exiting
+        with sec_handler.raising():
+            resp = sec_handler.get(resource, fresh=fresh)
+        return resp, time.perf_counter() - start
+
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    from errors import BackendError, CircuitOpenError
+
+    errors = []
+    with ThreadPoolExecutor(max_workers=min(workers, len(resources))) as pool:
+        futures = {pool.submit(timed_get, resource): resource
+                   for resource in resources}
+        results = {}
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            try:
+                results[futures[future]] = future.result()
+            except BackendError as err:
+                errors.append(err)
+                for pending in futures:
+                    pending.cancel()
+                continue
+            if not errors and callback is not None:
+                callback(futures[future], results[futures[future]][0])
+    if errors:
+        # the failures which opened the circuit breaker describe the cause
+        error = next((err for err in errors
+                      if not isinstance(err, CircuitOpenError)), errors[0])
+        if raise_errors or not sec_handler.exit_on_error:
+            raise error
+        print(error)
+        sys.exit(1)
+    data = {resource: results[resource][0] for resource in resources}
+    return data, sum(duration for _, duration in results.values())
+
+def _print_resources(args, data):
+    """
+    Prints the human readable representation of the fetched resources.
+
+    :param args: argparse parser result
+    :param data: dict with resource: json dict, see `_fetch_resources`
+    """
+    if args.info or args.all:
+        info = data['/info']
+        version = _version()
+        print('Firmware version of microcontroller: {}, '
+              'Version of minerctl_cli: {}'
+              .format(info['firmware_version'], version))
+    if args.temp or args.all:
+        temp = data['/temp']
+        temps = ', '.join([f'Sensor #{key}: {value}°C' \
+                           for key, value in temp['measurements'].items()])
+        print('Measurements: {}'.format(temps))
+        print('Target temperature: {}°C'.format(temp['target']))
+        print('Main sensor id: #{}'.format(temp['sensor_id']))
+        print('External reference temperature: {}°C'.format(temp['external']))
+    if args.filter or args.all:
+        filter = data['/filter']
+        print('Differential pressure: {}mBar'.format(filter['pressure_diff']))
+        print('Differential pressure threshold: {}mBar'
+              .format(filter['threshold']))
+        print('Filter needs cleaning: {}'.format(str(filter['status_ok'])))
+    if args.ventilation or args.all:
+        vent = data['/fans']
+        print('Minimum RPM: {}%, Maximum RPM: {}%, Current RPM: {}%'
+              .format(vent['min_rpm'], vent['max_rpm'], vent['rpm']))
+    if args.operation or args.all:
+        operation = dict(data['/mode'])
+        mode = operation.pop('active_mode', None)
+        mode_settings = ', '.join([f'{key}: {value}ms' \
+                           for key, value in operation.items()])
+        print('Active mode: {}, {}'.format(mode, mode_settings))
+    if args.pid or args.all:
+        pid = data['/pid']
+        pid_settings = ', '.join([f'{key}: {value}' \
+                           for key, value in pid.items()])
+        print('PID: {}'.format(pid_settings))
+    if args.miners or args.all:
+        summary = MinerStates.from_list(data['/cfg']['miners']).summary()
+        summary_text = ', '.join([f'{key}: {value}'\
+                                    for key, value in summary.items()])
+        print('Miner states: {}'.format(summary_text))
+    if args.query:
+        ids = _parse_ids(args.query, 'Miner ID', PARSER)
+        if _query_from_cfg(args, ids):
+            states = data['/cfg']['miners']
+            for miner_id in ids:
+                msg = (state_name(states[miner_id])
+                       if 0 <= miner_id < len(states) else 'unknown')
+                print('Miner #{} state: {}'.format(miner_id, msg))
+        else:
+            for miner_id in ids:
+                state = data['/miner?id={}'.format(miner_id)]['running']
+                print('Miner #{} state: {}'
+                      .format(miner_id, state_name(state)))
+    if args.summary:
+        states = MinerStates.from_list(data['/cfg']['miners'])
+        print('Miners turned on: {}'.format(states.format(True)))
+        print('Miners turned off: {}'.format(states.format(False)))
+        print('Disabled miners: {}'.format(states.format(None)))
+
+def _run_fleet(args, key_location, timings=None):
+    """
+    Fans the read options, plan or apply out to every backend of the
+    requested group and prints the results grouped per backend, followed by
+    an aggregate line. SET mode values and commits are rolled out in waves.
+
+    :param args: argparse parser result
+    :param key_location: private key file location
+    :param timings: instrumentation.Timings or None
+    """
+    if args.set_mode not in (None, 'set', 'plan', 'apply'):
+        print('Fleet mode only supports the read options, set, --commit, plan '
+              'and apply.')
+        _error_exit(PARSER)
+    backends = fleet.load_group(CONFIG_FILE, args.fleet)
+    if not backends:
+        print('Could not find group {} or one of its backends in the '
+              'inventory. View the help (-h) for more information'
+              .format(args.fleet))
+        sys.exit(1)
+    if args.set_mode == 'set' or args.commit and not args.set_mode:
+        _run_fleet_rollout(args, backends, key_location, timings)
+        return
+    if args.set_mode:
+        _run_fleet_desired_state(args, backends, key_location, timings)
+        return
+    resources = _requested_resources(args)
+    if not resources:
+        _error_exit(PARSER)
+
+    writer = None
+    if args.output in ('json', 'ndjson'):
+        from output import RecordWriter
+        writer = RecordWriter(args.output)
+
+    def fetch(handler):
+        callback = None
+        if writer is not None:
+            callback = lambda resource, data: writer.write(handler.connection,
+                                                           resource, data)
+        return _fetch_resources(handler, resources, callback=callback)[0]
+
+    start = time.perf_counter()
+    results = fleet.run([(name, _parse_url(addr)) for name, addr in backends],
+                        key_location,
+                        _token_cache(),
+                        fetch,
+                        _connection_policy(
+                            deadline=args.fleet_timeout or FLEET_TIMEOUT),
+                        workers=args.fleet_workers or FLEET_WORKERS,
+                        timings=timings)
+    elapsed = time.perf_counter() - start
+    failed = sum(1 for result in results if result.error)
+    if writer is not None:
+        for result in results:
+            if result.error:
+                writer.write(result.connection, None, error=result.error)
+        writer.close()
+        if failed:
+            sys.exit(1)
+        return
+    printing = time.perf_counter()
+
+    snapshots = []
+    for result in results:
+        print('== {} ({}) =='.format(result.name, result.connection))
+        if result.error:
+            print('Error: {}'.format(result.error))
+            continue
+        _print_resources(args, result.data)
+        if '/cfg' in result.data:
+            snapshots.append(
+                MinerStates.from_list(result.data['/cfg']['miners']))
+
+    aggregate = 'Fleet {}: {} backends, {} ok, {} failed in {:.3f}s'.format(
+        args.fleet, len(results), len(results) - failed, failed, elapsed)
+    if '/cfg' in resources:
+        aggregate += ('; miners on: {on}, off: {off}, disabled: {disabled}, '
+                      'total: {total}'
+                      .format(**miner_states.aggregate(snapshots)))
+    print(aggregate)
+    if timings is not None:
+        timings.phase('printing', time.perf_counter() - printing)
+    if failed:
+        sys.exit(1)
+
+def _run_fleet_rollout(args, backends, key_location, timings=None):
+    """
+    Rolls the values passed to the SET mode and/or a commit out to the fleet
+    in waves of increasing size, starting with a canary. The backends of a
+    wave are updated concurrently, every write is verified by reading the
+    resource back and the rollout stops after a wave in which the share of
+    failed backends exceeded the threshold.
+
+    :param args: argparse parser result
+    :param backends: list of (name, ip:port) tuples
+    :param key_location: private key file location
+    :param timings: instrumentation.Timings or None
+    """
+    from errors import BackendError
+    from rollout import Rollout
+
+    changes = {}
+    if args.set_mode == 'set':
+        if args.set_miner:
+            print('Miner actions cannot be rolled out to a fleet.')
+            _error_exit(SET_PARSER)
+        changes = _collect_set_changes(args)
+        if not changes and not args.commit:
+            _error_exit(SET_PARSER)
+
+    def execute(handler):
+        start = time.perf_counter()
+        for resource, (method, data) in changes.items():
+            if method == 'put':
+                handler.safe_put(resource, data)
+            else:
+                handler.safe_patch(resource, data)
+        if args.commit:
+            handler.put('/commit', {'commit': True})
+        latency = time.perf_counter() - start
+        # read back what the backend actually stored
+        handler.clear_cache()
+        for resource, (_, data) in changes.items():
+            current = handler.get(resource, fresh=True)
+            wrong = ['{} is {} instead of {}'.format(key, current.get(key),
+                                                     value)
+                     for key, value in data.items()
+                     if current.get(key) != value]
+            if wrong:
+                raise BackendError('Verification of {} failed: {}'
+                                   .format(resource, ', '.join(wrong)))
+        return latency
+
+    workers = args.fleet_workers or FLEET_WORKERS
+    policy = _connection_policy(deadline=args.fleet_timeout)
+    session = fleet.create_session(len(backends), workers,
+                                   timed=timings is not None, policy=policy)
+    # snapshots of previous writes make every write a single round trip
+    response_cache = _response_cache(args)
+    rollout = Rollout([(name, _parse_url(addr)) for name, addr in backends],
+                      args.canary or ROLLOUT_CANARY,
+                      args.wave_growth or ROLLOUT_GROWTH,
+                      (args.max_failures or 0) / 100)
+    start = time.perf_counter()
+    for number, wave in enumerate(rollout.waves(), 1):
+        print('Wave {}{}: {} backends'.format(
+            number, ' (canary)' if number == 1 else '', len(wave)))
+        results = fleet.run(wave, key_location, _token_cache(), execute,
+                            policy, workers=workers, timings=timings,
+                            session=session, response_cache=response_cache)
+        for result in results:
+            print('  {} ({}): {}'.format(
+                result.name, result.connection,
+                'failed ({})'.format(result.error) if result.error else
+                'ok, write {:.1f}ms, verified'.format(result.data * 1000)))
+        if not rollout.record(results):
+            print('Rollout stopped: {} of {} backends failed, more than {:g}% '
+                  .format(rollout.failed, len(rollout.results),
+                          args.max_failures or 0) +
+                  '({} backends not contacted)'.format(rollout.skipped))
+    latencies = sorted(result.data * 1000 for result in rollout.results
+                       if not result.error)
+    summary = 'Rollout to {}: {} updated, {} failed, {} skipped in {:.3f}s'\
+        .format(args.fleet, len(latencies), rollout.failed, rollout.skipped,
+                time.perf_counter() - start)
+    if latencies:
+        summary += '; write latency min {:.1f}ms, median {:.1f}ms, max ' \
+            '{:.1f}ms'.format(latencies[0], latencies[len(latencies) // 2],
+                              latencies[-1])
+    print(summary)
+    if rollout.failed or rollout.stopped:
+        sys.exit(1)
+
+def _load_desired_state(args):
+    """
+    :param args: argparse parser result
+    :returns: desired_state.DesiredState of the passed file
+    """
+    import desired_state
+
+    try:
+        return desired_state.load(args.state_file)
+    except (OSError, ValueError) as err:
+        print('Could not load the desired state from {}: {}'
+              .format(args.state_file, err))
+        sys.exit(1)
+
+def _plan(sec_handler, desired):
+    """
+    Reads the resources covered by the desired state once, in parallel, and
+    compares them with it. The reads bypass the caches, their ETags protect
+    the writes of `_apply_plan` against changes made in the meantime.
+
+    :param sec_handler: SecureHandler object
+    :param desired: desired_state.DesiredState
+    :returns: desired_state.Plan
+    :raises ValueError: if the desired state does not fit the backend
+    """
+    import desired_state
+
+    current, _ = _fetch_resources(sec_handler, desired.resources, fresh=True)
+    return desired_state.plan(desired, current)
+
+def _apply_plan(sec_handler, plan, workers):
+    """
+    Sends a single write per changed resource, the miner actions and one
+    commit at the end.
+
+    :param sec_handler: SecureHandler object
+    :param plan: desired_state.Plan which is not empty
+    :param workers: maximum number of miner requests in flight
+    :returns: list of the IDs of the miners whose action failed
+    """
+    for resource, (method, data) in plan.writes().items():
+        if method == 'put':
+            sec_handler.safe_put(resource, data)
+        else:
+            sec_handler.safe_patch(resource, data)
+    failed = []
+    actions = plan.miner_actions()
+    if actions:
+        errors, _ = _send_miner_actions(sec_handler, actions, workers)
+        failed = [miner_id for (miner_id, _), error in zip(actions, errors)
+                  if error]
+    sec_handler.put('/commit', {'commit': True})
+    return failed
+
+def _desired_state(args, sec_handler):
+    """
+    Prints the changes needed to reach the desired state of the passed file
+    and, in apply mode, makes them.
+
+    :param args: argparse parser result
+    :param sec_handler: SecureHandler object
+    """
+    desired = _load_desired_state(args)
+    issued = sec_handler.requests_issued
+    start = time.perf_counter()
+    try:
+        plan = _plan(sec_handler, desired)
+    except ValueError as err:
+        print(err)
+        sys.exit(1)
+    for line in plan.describe():
+        print(line)
+    print(plan.summary())
+    if args.set_mode != 'apply' or not plan:
+        return
+    failed = _apply_plan(sec_handler, plan, MINER_WORKERS)
+    print('Applied in {} requests, {:.3f}s'
+          .format(sec_handler.requests_issued - issued,
+                  time.perf_counter() - start))
+    if failed:
+        print('Miner actions failed for {}'
+              .format(format_ranges(miner_states.id_ranges(failed))))
+        sys.exit(1)
+
+def _run_fleet_desired_state(args, backends, key_location, timings=None):
+    """
+    Plans or applies the desired state on every backend of the fleet.
+
+    :param args: argparse parser result
+    :param backends: list of (name, ip:port) tuples
+    :param key_location: private key file location
+    :param timings: instrumentation.Timings or None
+    """
+    from errors import BackendError
+
+    desired = _load_desired_state(args)
+    apply = args.set_mode == 'apply'
+
+    def execute(handler):
+        try:
+            plan = _plan(handler, desired)
+        except ValueError as err:
+            raise BackendError(str(err))
+        failed = _apply_plan(handler, plan, MINER_WORKERS) if (
+            apply and plan) else []
+        return plan, failed
+
+    # applying many miner actions may take longer than a read
+    deadline = args.fleet_timeout or (None if apply else FLEET_TIMEOUT)
+    start = time.perf_counter()
+    results = fleet.run([(name, _parse_url(addr)) for name, addr in backends],
+                        key_location,
+                        _token_cache(),
+                        execute,
+                        _connection_policy(deadline=deadline),
+                        workers=args.fleet_workers or FLEET_WORKERS,
+                        timings=timings)
+    elapsed = time.perf_counter() - start
+
+    changed = failed = 0
+    for result in results:
+        print('== {} ({}) =='.format(result.name, result.connection))
+        if result.error:
+            failed += 1
+            print('Error: {}'.format(result.error))
+            continue
+        plan, failed_miners = result.data
+        changed += bool(plan)
+        for line in plan.describe():
+            print(line)
+        print(plan.summary())
+        if failed_miners:
+            failed += 1
+            print('Miner actions failed for {}'.format(
+                format_ranges(miner_states.id_ranges(failed_miners))))
+    print('Fleet {}: {} backends, {} {}, {} failed in {:.3f}s'.format(
+        args.fleet, len(results), changed, 'changed' if apply else
+        'to change', failed, elapsed))
+    if failed:
+        sys.exit(1)
+
+def _flatten_resource(resource, data):
+    """
+    Splits a resource into single labelled values, which can be compared
+    between two polls.
+
+    :param resource: resource path
+    :param data: json dict of the resource
+    :returns: list of (label, value str) tuples
+    """
+    if resource == '/temp':
+        values = [('Sensor #{}'.format(key), '{}°C'.format(value))
+                  for key, value in data['measurements'].items()]
+        return values + [('Target temperature', '{}°C'.format(data['target'])),
+                         ('Main sensor id', '#{}'.format(data['sensor_id'])),
+                         ('External reference temperature',
+                          '{}°C'.format(data['external']))]
+    if resource == '/filter':
+        return [('Differential pressure',
+                 '{}mBar'.format(data['pressure_diff'])),
+                ('Differential pressure threshold',
+                 '{}mBar'.format(data['threshold'])),
+                ('Filter needs cleaning', str(data['status_ok']))]
+    if resource == '/fans':
+        return [('Minimum RPM', '{}%'.format(data['min_rpm'])),
+                ('Maximum RPM', '{}%'.format(data['max_rpm'])),
+                ('Current RPM', '{}%'.format(data['rpm']))]
+    if resource == '/mode':
+        return [('Active mode' if key == 'active_mode' else key,
+                 str(value) if key == 'active_mode' else '{}ms'.format(value))
+                for key, value in data.items()]
+    if resource == '/pid':
+        return [('PID {}'.format(key), str(value))
+                for key, value in data.items()]
+    summary = MinerStates.from_list(data['miners']).summary()
+    return [('Miners on', str(summary['on'])),
+            ('Miners off', str(summary['off'])),
+            ('Miners disabled', str(summary['disabled']))]
+
+def _poll_loop(interval, count, poll, schedule=None):
+    """
+    Calls `poll(number)` every `interval` seconds until `count` polls have
+    been done or the user interrupts.
+
+    :param interval: seconds between the start of two polls
+    :param count: number of polls, None or 0 polls forever
+    :param poll: callable taking the number of the poll (starting at 1)
+    :param schedule: scheduler.Scheduler, if passed the loop waits until its
+    next resource is due instead of `interval`
+    """
+    number = 0
+    try:
+        while not count or number < count:
+            if schedule is not None:
+                # sleeping may end early, a poll without due resources would
+                # send no request but still count
+                delay = schedule.delay()
+                while delay > 0:
+                    time.sleep(delay)
+                    delay = schedule.delay()
+            number += 1
+            start = time.perf_counter()
+            poll(number)
+            sys.stdout.flush()
+            if schedule is None and (not count or number < count):
+                time.sleep(max(interval - (time.perf_counter() - start), 0))
+    except KeyboardInterrupt:
+        pass
+
+def _create_schedule(args, interval, resources):
+    """
+    :param args: argparse parser result
+    :param interval: shortest seconds between two polls of a resource
+    :param resources: list of resource paths
+    :returns: scheduler.Scheduler if adaptive polling was requested, else None
+    """
+    if not args.adaptive:
+        return None
+    import scheduler
+
+    budget = POLL_BUDGET if args.poll_budget is None else args.poll_budget
+    return scheduler.Scheduler(resources, interval,
+                               interval * ADAPTIVE_BACKOFF_LIMIT,
+                               budget / 60 if budget > 0 else None)
+
+def _print_schedule(schedule):
+    """
+    Prints the effective request rate and the current intervals of an
+    adaptive poll loop.
+
+    :param schedule: scheduler.Scheduler
+    """
+    rate = schedule.rate()
+    fixed = schedule.fixed_requests()
+    print('Effective request rate: {} ({} requests{}{})'.format(
+        '{:.1f} requests/min'.format(rate * 60) if rate is not None
+        else 'n/a', schedule.requests,
+        ', {} at a fixed interval'.format(fixed) if fixed is not None else '',
+        ', budget {:g}/min'.format(schedule.budget * 60) if schedule.budget
+        else ''))
+    print('Intervals: {}'.format(', '.join(
+        '{} {:.1f}s'.format(resource, interval)
+        for resource, interval in schedule.intervals().items())))
+
+def _watch(args, sec_handler):
+    """
+    Polls the requested resources over the session of the handler until the
+    requested number of polls is reached or the user interrupts. Only values
+    which changed since the previous poll are printed. Just the latest values
+    are kept, so the memory footprint does not grow over time.
+
+    :param args: argparse parser result
+    :param sec_handler: SecureHandler object
+    """
+    from errors import BackendError
+
+    names = args.watch_resources or ('temp', 'filter', 'fans')
+    # validated here, argparse rejects an empty list of positional choices
+    # on Python < 3.12
+    for name in names:
+        if name not in WATCH_RESOURCES:
+            print('Invalid resource {}, choose from: {}'
+                  .format(name, ', '.join(WATCH_RESOURCES)))
+            _error_exit(WATCH_PARSER)
+    resources = [WATCH_RESOURCES[name] for name in names]
+    interval = args.watch_interval or WATCH_INTERVAL
+    schedule = _create_schedule(args, interval, resources)
+    previous = {}
+    snapshot = []
+
+    def poll(number):
+        start = time.perf_counter()
+        timestamp = time.strftime('%H:%M:%S')
+        polled = schedule.due() if schedule is not None else resources
+        try:
+            data, _ = _fetch_resources(sec_handler, polled, fresh=True)
+        except BackendError as err:
+            print('[{}] poll #{} failed: {}'.format(timestamp, number, err))
+            return
+        latency = (time.perf_counter() - start) * 1000
+        if schedule is not None:
+            for resource in polled:
+                schedule.update(resource, data[resource])
+        current = dict(value for resource in polled
+                       for value in _flatten_resource(resource,
+                                                      data[resource]))
+        changed = [(label, value) for label, value in current.items()
+                   if previous.get(label) != value]
+        print('[{}] poll #{}{}: {:.1f}ms, {}'
+              .format(timestamp, number,
+                      ' ({})'.format(', '.join(polled))
+                      if schedule is not None else '', latency,
+                      '{} changed'.format(len(changed)) if changed
+                      else 'no changes'))
+        for label, value in changed:
+            print('  {}: {}'.format(label, value))
+        # the labels of the resources are fixed, so this does not grow
+        previous.update(current)
+        if '/cfg' in data:
+            # only the changed ranges are shown, not every miner ID
+            states = MinerStates.from_list(data['/cfg']['miners'])
+            if snapshot:
+                for start, stop, before, after in snapshot[0].diff(states):
+                    print('  Miners {}: {} -> {}'.format(
+                        format_ranges([(start, stop)]), state_name(before),
+                        state_name(after)))
+            snapshot[:] = [states]
+
+    _poll_loop(interval, args.watch_count, poll, schedule)
+    if schedule is not None:
+        _print_schedule(schedule)
+
+def _record(args, sec_handler):
+    """
+    Appends a telemetry sample of the temperatures, filter, fans and miner
+    states to the ring buffer file on every poll.
+
+    :param args: argparse parser result
+    :param sec_handler: SecureHandler object
+    """
+    from errors import BackendError
+    import telemetry
+
+    try:
+        ring = telemetry.RingBuffer(args.ring_file or TELEMETRY_FILE,
+                                    args.record_capacity, writable=True)
+    except telemetry.RingBufferError as err:
+        print(err)
+        sys.exit(1)
+    resources = ['/temp', '/filter', '/fans', '/cfg']
+    interval = args.record_interval or RECORD_INTERVAL
+    schedule = _create_schedule(args, interval, resources)
+    # resources which were not due are sampled with their latest values
+    latest = {}
+
+    def poll(number):
+        start = time.perf_counter()
+        timestamp = time.strftime('%H:%M:%S')
+        polled = schedule.due() if schedule is not None else resources
+        try:
+            data, _ = _fetch_resources(sec_handler, polled, fresh=True)
+        except BackendError as err:
+            print('[{}] sample #{} failed: {}'.format(timestamp, number, err))
+            return
+        latest.update(data)
+        if schedule is not None:
+            for resource in polled:
+                schedule.update(resource, data[resource])
+        if len(latest) < len(resources):
+            # a previous poll of the missing resources failed
+            print('[{}] sample #{} skipped, not all resources fetched yet'
+                  .format(timestamp, number))
+            return
+        ring.append(telemetry.sample_from_resources(
+            *(latest[resource] for resource in resources), time.time()))
+        print('[{}] sample #{} recorded in {:.1f}ms ({}/{} samples stored)'
+              .format(timestamp, number, (time.perf_counter() - start) * 1000,
+                      len(ring), ring.capacity))
+
+    with ring:
+        _poll_loop(interval, args.record_count, poll, schedule)
+    if schedule is not None:
+        _print_schedule(schedule)
+
+def _export(args, sec_handler):
+    """
+    Serves the telemetry in the Prometheus text format. A background thread
+    polls the backend every interval, scrapes are answered from its results.
+
+    :param args: argparse parser result
+    :param sec_handler: SecureHandler object
+    """
+    import exporter
+
+    address, _, port = args.export_listen.rpartition(':')
+    port = _int(port, 'Port', EXPORT_PARSER)
+    try:
+        exporter.serve(exporter.Exporter(
+            lambda: _fetch_resources(sec_handler, exporter.RESOURCES,
+                                     fresh=True)[0],
+            args.export_interval or EXPORT_INTERVAL), address, port)
+    except OSError as err:
+        print('Could not listen on {}: {}'.format(args.export_listen,
+                                                  err.strerror))
+        sys.exit(1)
+
+def _parse_duration(spec, parser):
+    """
+    Parses a duration such as 90, 30s, 15m, 1h or 2d.
+
+    :param spec: duration str
+    :param parser: argparse parser whose help is printed on errors
+    :returns: seconds as float
+    """
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    factor = units.get(spec[-1:], None)
+    try:
+        return float(spec[:-1] if factor else spec) * (factor or 1)
+    except ValueError:
+        print('{} is not a valid duration (eg 30s, 15m, 1h, 2d)!'.format(spec))
+        _error_exit(parser)
+
+def _stats(args):
+    """
+    Prints min, max, mean and percentiles of the recorded telemetry fields,
+    computed directly on the memory-mapped ring buffer.
+
+    :param args: argparse parser result
+    """
+    import telemetry
+
+    fields = [name for name, _ in telemetry.FIELDS if name != 'time']
+    if args.stats_fields:
+        requested = args.stats_fields.split(',')
+        unknown = [name for name in requested if name not in fields]
+        if unknown:
+            print('Unknown fields: {}. Available fields: {}'
+                  .format(', '.join(unknown), ', '.join(fields)))
+            _error_exit(STATS_PARSER)
+        fields = requested
+    since = None
+    if args.stats_window:
+        since = time.time() - _parse_duration(args.stats_window, STATS_PARSER)
+
+    try:
+        ring = telemetry.RingBuffer(args.ring_file or TELEMETRY_FILE)
+    except telemetry.RingBufferError as err:
+        print(err)
+        sys.exit(1)
+    with ring:
+        print('{} of {} samples stored, window: {}'
+              .format(len(ring), ring.capacity, args.stats_window or 'all'))
+        print('{:<16}{:>9}{:>10}{:>10}{:>10}{:>10}{:>10}{:>10}'
+              .format('field', 'count', 'min', 'max', 'mean', 'p50', 'p90',
+                      'p99'))
+        for name in fields:
+            result = ring.stats(name, since)
+            if result is None:
+                if args.stats_fields:
+                    print('{:<16}{:>9}'.format(name, 0))
+                continue
+            print('{:<16}{:>9}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}'
+                  '{:>10.2f}'.format(name, result['count'], result['min'],
+                                     result['max'], result['mean'],
+                                     result['p50'], result['p90'],
+                                     result['p99']))
+
+def _run_commands(args, argv, sec_handler, timings=None):
+    """
+    Executes the read options, the commit and the set subcommand.
+
+    :param args: argparse parser result
+    :param argv: arguments which have been parsed, without the program name
+    :param sec_handler: SecureHandler object
+    :param timings: instrumentation.Timings or None
+    """
+    resources = _requested_resources(args)
+    if resources and args.output in ('json', 'ndjson'):
+        from output import RecordWriter
+        from errors import BackendError
+        writer = RecordWriter(args.output)
+        try:
+            _fetch_resources(sec_handler, resources,
+                             callback=lambda resource, data: writer.write(
+                                 sec_handler.connection, resource, data),
+                             raise_errors=True)
+        except BackendError as err:
+            # reported as error record like in fleet mode, the document stays
+            # valid for consumers of stdout
+            writer.write(sec_handler.connection, None, error=str(err))
+            writer.close()
+            print(err, file=sys.stderr)
+            sys.exit(1)
+        writer.close()
+        _mark('requests')
+    elif resources:
+        start = time.perf_counter()
+        data, sequential = _fetch_resources(sec_handler, resources)
+        elapsed = time.perf_counter() - start
+        _mark('requests')
+        printing = time.perf_counter()
+        _print_resources(args, data)
+        if timings is not None:
+            timings.phase('printing', time.perf_counter() - printing)
+        if args.time_saved:
+            print('Fetched {} resources in {:.3f}s instead of {:.3f}s '
+                  'sequentially ({:.3f}s saved)'
+                  .format(len(resources), elapsed, sequential,
+                          max(sequential - elapsed, 0)))
+    if args.commit:
+        # the commit resource has no state which could be preserved
+        sec_handler.put('/commit', {'commit': True})
+
+    if args.set_mode == 'set':
+        # exit if only `minerctl set` has been entered
+        if len(argv) == 1:
+            _error_exit(SET_PARSER)
+
+        changes = _collect_set_changes(args)
+        if args.set_miner:
+            miner_ids = _parse_ids(args.set_miner[0], 'Miner ID')
+            if args.set_miner[1] not in('on', 'off', 'register', 'deregister'):
+                print('Invalid miner action!')
+                _error_exit(SET_PARSER)
+
+        issued = sec_handler.requests_issued
+        for resource, (method, data) in changes.items():
+            if method == 'put':
+                sec_handler.safe_put(resource, data)
+            else:
+                sec_handler.safe_patch(resource, data)
+        if changes:
+            print('Updated {} in {} round trips'
+                  .format(', '.join(changes),
+                          sec_handler.requests_issued - issued))
+        if args.set_miner:
+            if not _dispatch_miner_actions(sec_handler, miner_ids,
+                                           args.set_miner[1],
+                                           args.set_workers or MINER_WORKERS,
+                                           (args.set_stagger or 0) / 1000):
+                sys.exit(1)
+
+    if args.set_mode in ('plan', 'apply'):
+        _desired_state(args, sec_handler)
+
+    if args.debug:
+        print('Requests issued: {}, requests avoided: {}'
+              .format(sec_handler.requests_issued,
+                      sec_handler.requests_avoided))
+
+def _shell(sec_handler):
+    """
+    Reads commands with the syntax of the CLI (eg `-t -f` or `set --target
+    25`) and runs them over the session of the handler until `exit` or EOF.
+    Read results are cached between the commands, `refresh` drops them.
+    Errors end the command, but not the shell.
+
+    :param sec_handler: SecureHandler object
+    """
+    import shlex
+    try:
+        # line editing and history, not available on every platform
+        import readline
+    except ImportError:
+        pass
+
+    print('Type CLI options (eg `-t -f` or `set --target 25`), `refresh` to '
+          'drop cached data, `help` or `exit`.')
+    while True:
+        try:
+            line = input('minerctl> ')
+        except KeyboardInterrupt:
+            print()
+            continue
+        except EOFError:
+            print()
+            break
+        try:
+            argv = shlex.split(line)
+        except ValueError as err:
+            print('Invalid input: {}'.format(err))
+            continue
+        if not argv:
+            continue
+        if argv[0] in ('exit', 'quit'):
+            break
+        if argv[0] == 'refresh':
+            sec_handler.clear_cache()
+            print('Cached data dropped')
+            continue
+        if argv[0] == 'help':
+            argv = ['-h']
+
+        start = time.perf_counter()
+        issued = sec_handler.requests_issued
+        try:
+            args = PARSER.parse_args(argv)
+            excluded = [name for name in SHELL_EXCLUDED if vars(args)[name]]
+            if (args.set_mode not in (None, 'set', 'plan', 'apply')
+                    or excluded):
+                print('Only the read options, --commit, set, plan and apply '
+                      'are available in the shell.')
+                continue
+            _run_commands(args, argv, sec_handler)
+        except SystemExit:
+            # argparse and the error handling exit after printing a message
+            pass
+        print('[{:.1f}ms, {} requests]'
+              .format((time.perf_counter() - start) * 1000,
+                      sec_handler.requests_issued - issued))
+
+def _setup_arguments(argv):
+    """
+    Adds the options of the main parser and of the subcommands given in argv.
+    Options of subcommands which are not used are not created, which keeps
+    the startup cheap. The subcommands themselves are always registered, so
+    they still show up in the help.
+
+    :param argv: command line arguments without the program name
+    """
     PARSER.add_argument('-i', '--info', help='show basic version info about '
                         'the CLI tool and the backend', default=False,
                         dest='info', action='store_true')
@@ -144,6 +1447,38 @@ def _setup_arguments():
     PARSER.add_argument('-b', '--backend', help='set backend address and port '
                         '(eg: 127.0.0.1:12345)', dest='backend',
                         metavar='<ip:port>')
+    PARSER.add_argument('--token-lifetime', help='set the number of seconds '
+                        'a signed access token is reused (0 disables the '
+                        'token cache, default: {})'.format(TOKEN_LIFETIME),
+                        dest='token_lifetime', type=int, metavar='<seconds>')
+    PARSER.add_argument('--add-backend', help='add a named backend to the '
+                        'fleet inventory', dest='add_backend', nargs=2,
+                        metavar=('<name>', '<ip:port>'))
+    PARSER.add_argument('--add-group', help='define a group of inventory '
+                        'backends (comma separated names)', dest='add_group',
+                        nargs=2, metavar=('<group>', '<names>'))
+    PARSER.add_argument('--fleet', help='run the read options, plan or apply '
+                        'against every backend of the group (`all` for the '
+                        'whole inventory)',
+                        dest='fleet', metavar='<group>')
+    PARSER.add_argument('--fleet-workers', help='maximum number of backends '
+                        'queried at once (default: {})'.format(FLEET_WORKERS),
+                        dest='fleet_workers', type=_positive_int,
+                        metavar='<number>')
+    PARSER.add_argument('--fleet-timeout', help='time limit per backend in '
+                        'seconds (default: {})'.format(FLEET_TIMEOUT),
+                        dest='fleet_timeout', type=float, metavar='<seconds>')
+    PARSER.add_argument('--canary', help='number of backends a fleet rollout '
+                        'of set or --commit starts with (default: {})'
+                        .format(ROLLOUT_CANARY), dest='canary', type=int,
+                        metavar='<number>')
+    PARSER.add_argument('--wave-growth', help='factor by which every further '
+                        'wave of a rollout grows (default: {})'
+                        .format(ROLLOUT_GROWTH), dest='wave_growth',
+                        type=float, metavar='<factor>')
+    PARSER.add_argument('--max-failures', help='percentage of failed backends '
+                        'which stops a rollout when exceeded (default: 0)',
+                        dest='max_failures', type=float, metavar='<percent>')
     PARSER.add_argument('-a', '--all', help='show all available data',
                         default=False, dest='all', action='store_true')
     PARSER.add_argument('-t', '--temp', help='show temperatures',
@@ -162,11 +1497,127 @@ def _setup_arguments():
                         dest='miners', action='store_true')
     PARSER.add_argument('-s', '--summary', help='show miner summary',
                         dest='summary', action='store_true')
-    PARSER.add_argument('-q', '--query', help='query state of specific miner',
-                    dest='query', metavar='<ID>')
+    PARSER.add_argument('-q', '--query', help='query state of specific '
+                        'miners, accepts lists and ranges, eg 0-63,70',
+                        dest='query', metavar='<ID>')
+    PARSER.add_argument('--output', help='output format of the read options, '
+                        'json and ndjson stream one record per resource and '
+                        'backend (default: text)', dest='output',
+                        choices=('text', 'json', 'ndjson'))
+    PARSER.add_argument('--max-age', help='maximum age in seconds of cached '
+                        'responses of /info, /mode and /pid (0 revalidates '
+                        'them)', dest='max_age', type=int, metavar='<seconds>')
+    PARSER.add_argument('--no-cache', help='neither use nor update the '
+                        'response cache', default=False, dest='no_cache',
+                        action='store_true')
+    PARSER.add_argument('--time-saved', help='report the wall time saved by '
+                        'fetching the resources concurrently', default=False,
+                        dest='time_saved', action='store_true')
+    PARSER.add_argument('--startup-profile', help='print import and setup '
+                        'timings, optionally checked against a budget',
+                        dest='startup_profile', nargs='?', const=0, type=int,
+                        metavar='<budget ms>')
+    PARSER.add_argument('--timings', help='print the timings of every backend '
+                        'request at exit', default=False, dest='timings',
+                        action='store_true')
+    PARSER.add_argument('--profile', help='run under cProfile and write the '
+                        'stats to a file', dest='profile', metavar='<path>')
+    PARSER.add_argument('--no-agent', help='contact the backend directly even '
+                        'if an agent is running', default=False,
+                        dest='no_agent', action='store_true')
+    PARSER.add_argument('--debug', help='show the number of issued and '
+                        'avoided backend requests', default=False,
+                        dest='debug', action='store_true')
     PARSER.add_argument('-c', '--commit', help='persist changes', default=False,
                         dest='commit', action='store_true')
 
+    done = []
+    for subcommand, setup in (('set', _setup_set_arguments),
+                              ('shell', _setup_set_arguments),
+                              ('shell', _setup_desired_state_arguments),
+                              ('plan', _setup_desired_state_arguments),
+                              ('apply', _setup_desired_state_arguments),
+                              ('watch', _setup_watch_arguments),
+                              ('record', _setup_record_arguments),
+                              ('export', _setup_export_arguments),
+                              ('stats', _setup_stats_arguments)):
+        if subcommand in argv and setup not in done:
+            setup()
+            done.append(setup)
+
+def _setup_desired_state_arguments():
+    for parser in (PLAN_PARSER, APPLY_PARSER):
+        parser.add_argument('state_file', help='JSON or INI file with the '
+                            'desired temperature, filter, fan, PID and miner '
+                            'settings', metavar='<file>')
+
+def _setup_record_arguments():
+    RECORD_PARSER.add_argument('-n', '--interval', help='seconds between two '
+                               'samples (default: {})'.format(RECORD_INTERVAL),
+                               dest='record_interval', type=float,
+                               metavar='<seconds>')
+    RECORD_PARSER.add_argument('--count', help='stop after the number of '
+                               'samples', dest='record_count', type=int,
+                               metavar='<number>')
+    RECORD_PARSER.add_argument('--capacity', help='number of samples kept by '
+                               'a new ring buffer (default: 1000000)',
+                               dest='record_capacity', type=_positive_int,
+                               metavar='<number>')
+    RECORD_PARSER.add_argument('--file', help='ring buffer file (default: '
+                               '~/.minerctl/telemetry.ring)', dest='ring_file',
+                               metavar='<path>')
+    RECORD_PARSER.add_argument('--adaptive', help='sample faster while values '
+                               'approach their limits and back off while they '
+                               'are stable, the interval is the shortest one',
+                               dest='adaptive', action='store_true')
+    RECORD_PARSER.add_argument('--budget', help='maximum requests per minute '
+                               'to the backend with --adaptive (default: {})'
+                               .format(POLL_BUDGET), dest='poll_budget',
+                               type=float, metavar='<requests>')
+
+def _setup_export_arguments():
+    EXPORT_PARSER.add_argument('--listen', help='port or address:port to '
+                               'serve /metrics on', dest='export_listen',
+                               required=True, metavar='<[address:]port>')
+    EXPORT_PARSER.add_argument('-n', '--interval', help='minimum seconds '
+                               'between two backend polls (default: {})'
+                               .format(EXPORT_INTERVAL),
+                               dest='export_interval', type=float,
+                               metavar='<seconds>')
+
+def _setup_stats_arguments():
+    STATS_PARSER.add_argument('-w', '--window', help='only use samples of the '
+                              'last duration, eg 30m, 1h, 7d',
+                              dest='stats_window', metavar='<duration>')
+    STATS_PARSER.add_argument('--fields', help='comma separated fields, eg '
+                              'temp_0,rpm (default: all recorded fields)',
+                              dest='stats_fields', metavar='<fields>')
+    STATS_PARSER.add_argument('--file', help='ring buffer file (default: '
+                              '~/.minerctl/telemetry.ring)', dest='ring_file',
+                              metavar='<path>')
+
+def _setup_watch_arguments():
+    WATCH_PARSER.add_argument('watch_resources', help='resources to poll '
+                              '({}; default: temp filter fans)'
+                              .format(', '.join(WATCH_RESOURCES)), nargs='*',
+                              metavar='<resource>')
+    WATCH_PARSER.add_argument('-n', '--interval', help='seconds between two '
+                              'polls (default: {})'.format(WATCH_INTERVAL),
+                              dest='watch_interval', type=float,
+                              metavar='<seconds>')
+    WATCH_PARSER.add_argument('--count', help='stop after the number of '
+                              'polls', dest='watch_count', type=int,
+                              metavar='<number>')
+    WATCH_PARSER.add_argument('--adaptive', help='poll values faster while '
+                              'they approach their limits and back off while '
+                              'they are stable, the interval is the shortest '
+                              'one', dest='adaptive', action='store_true')
+    WATCH_PARSER.add_argument('--budget', help='maximum requests per minute '
+                              'to the backend with --adaptive (default: {})'
+                              .format(POLL_BUDGET), dest='poll_budget',
+                              type=float, metavar='<requests>')
+
+def _setup_set_arguments():
     SET_PARSER.add_argument('--target', help='set target temperature',
                             dest='set_target', metavar='<temperature>')
     SET_PARSER.add_argument('--sensor_id', help='set main sensor id',
@@ -182,8 +1633,16 @@ def _setup_arguments():
     SET_PARSER.add_argument('--max-rpm', help='set maximum fan RPM',
                             dest='set_max_rpm', metavar='<rpm>')
     SET_PARSER.add_argument('--miner', help='set miner state to on, off, '
-                            'register (=on), disable', dest='set_miner', nargs=2,
+                            'register (=on), disable; accepts lists and '
+                            'ranges, eg 0-63,70', dest='set_miner', nargs=2,
                             metavar=('<ID>', '<state>'))
+    SET_PARSER.add_argument('--workers', help='maximum number of parallel '
+                            'miner requests (default: {})'
+                            .format(MINER_WORKERS), dest='set_workers',
+                            type=_positive_int, metavar='<number>')
+    SET_PARSER.add_argument('--stagger', help='delay between two miner '
+                            'requests in milliseconds', dest='set_stagger',
+                            type=int, metavar='<ms>')
     SET_PARSER.add_argument('--proportional', help='set PID proportional value',
                             dest='set_proportional', metavar='<number>')
     SET_PARSER.add_argument('--integral', help='set PID integral value',
@@ -194,144 +1653,94 @@ def _setup_arguments():
                             dest='set_bias', metavar='<number>')
 
 def main():
-    _setup_arguments()
+    _mark('cli module imports')
+    _setup_arguments(sys.argv[1:])
+    _mark('argument setup')
     _prepare_folder()
 
     args = PARSER.parse_args()
-    if len(sys.argv) == 1:
+    if not sys.argv[1:]:
         _error_exit(PARSER)
+    _mark('argument parsing')
+    if args.startup_profile is not None:
+        atexit.register(_print_startup_profile, args.startup_profile)
+    timings = _instrumentation(args)
 
     if args.key:
         _create_config('PKI', 'key_location', args.key)
     if args.backend:
         _create_config('Connection', 'backend_addr', args.backend)
+    if args.token_lifetime is not None:
+        _create_config('PKI', 'token_lifetime', str(args.token_lifetime))
+    if args.add_backend:
+        _create_config(fleet.BACKENDS_SECTION, *args.add_backend)
+    if args.add_group:
+        _create_config(fleet.GROUPS_SECTION, *args.add_group)
 
     # exit program if only the config values have been updated
-    if _only_certain_attributes_given(args, ['key', 'backend']):
+    if _only_certain_attributes_given(args, ['key', 'backend', 'token_lifetime',
+                                             'add_backend', 'add_group']):
         sys.exit(0)
 
+    if args.set_mode == 'stats':
+        _stats(args)
+        return
+
+    if args.set_mode == 'agent':
+        _run_agent()
+        return
+
+    if args.fleet:
+        if not _check_config_file_integrity({'PKI': 'key_location'}):
+            _error_exit(PARSER)
+        _run_fleet(args, _load_config('PKI', 'key_location'), timings)
+        return
+
     if not _check_config_file_integrity({'Connection': 'backend_addr',
                                          'PKI': 'key_location'}):
         _error_exit(PARSER)
 
     backend_addr = _parse_url(_load_config('Connection', 'backend_addr'))
     key_location = _load_config('PKI', 'key_location')
+    _mark('config loading')
 
-    sec_handler = SecureHandler(key_location, backend_addr)
+    # a failed poll is reported and retried (or exported as minerctl_up 0)
+    # instead of ending the polling modes
+    exit_on_error = args.set_mode not in POLLING_MODES
+    sec_handler = None
+    # the agent cannot measure the timings of the requests it forwards and
+    # has no response cache which --no-cache and --max-age could control
+    if not args.no_agent and timings is None and not args.no_cache \
+            and args.max_age is None:
+        from agent import AgentClient
+        sec_handler = AgentClient.connect(AGENT_SOCKET, key_location,
+                                          backend_addr, exit_on_error)
+        _mark('agent connection')
+    if sec_handler is None:
+        from secure_handler import SecureHandler
+        _mark('secure_handler import')
+        # the deadline would end every shell command after it has passed
+        policy = _connection_policy(long_running=args.set_mode in
+                                    POLLING_MODES + ('shell',))
+        sec_handler = SecureHandler(key_location, backend_addr, policy=policy,
+                                    exit_on_error=exit_on_error,
+                                    token_cache=_token_cache(),
+                                    timings=timings,
+                                    response_cache=_response_cache(args))
+    _mark('access token')
 
-    if args.info or args.all:
-        info = sec_handler.get('/info')
-        version = pkg_resources.require('minerctl_cli')[0].version
-        print('Firmware version of microcontroller: {}, '
-              'Version of minerctl_cli: {}'
-              .format(info['firmware_version'], version))
-    if args.temp or args.all:
-        temp = sec_handler.get('/temp')
-        temps = ', '.join([f'Sensor #{key}: {value}°C' \
-                           for key, value in temp['measurements'].items()])
-        print('Measurements: {}'.format(temps))
-        print('Target temperature: {}°C'.format(temp['target']))
-        print('Main sensor id: #{}'.format(temp['sensor_id']))
-        print('External reference temperature: {}°C'.format(temp['external']))
-    if args.filter or args.all:
-        filter = sec_handler.get('/filter')
-        print('Differential pressure: {}mBar'.format(filter['pressure_diff']))
-        print('Differential pressure threshold: {}mBar'
-              .format(filter['threshold']))
-        print('Filter needs cleaning: {}'.format(str(filter['status_ok'])))
-    if args.ventilation or args.all:
-        vent = sec_handler.get('/fans')
-        print('Minimum RPM: {}%, Maximum RPM: {}%, Current RPM: {}%'
-              .format(vent['min_rpm'], vent['max_rpm'], vent['rpm']))
-    if args.operation or args.all:
-        operation = sec_handler.get('/mode')
-        mode = operation.pop('active_mode', None)
-        mode_settings = ', '.join([f'{key}: {value}ms' \
-                           for key, value in operation.items()])
-        print('Active mode: {}, {}'.format(mode, mode_settings))
-    if args.pid or args.all:
-        pid = sec_handler.get('/pid')
-        pid_settings = ', '.join([f'{key}: {value}' \
-                           for key, value in pid.items()])
-        print('PID: {}'.format(pid_settings))
-    if args.miners or args.all:
-        cfg = sec_handler.get('/cfg')
-        cntr = Counter(cfg['miners'])
-        summary = {'on': cntr[True], 'off': cntr[False], 'disabled': cntr[None], 'total': len(cfg['miners'])}
-        summary_text = ', '.join([f'{key}: {value}'\
-                                    for key, value in summary.items()])
-        print('Miner states: {}'.format(summary_text))
-    if args.query:
-        state = sec_handler.get('/miner?id={}'.format(args.query))['running']
-        if state is None:
-            msg = 'disabled'
-        elif state:
-            msg = 'on'
-        elif not state:
-            msg = 'off'
-        print('Miner #{} state: {}'.format(args.query, msg))
-    if args.commit:
-        sec_handler.safe_put(
-            '/commit',
-            {'commit': True})
-    if args.summary:
-        states = sec_handler.get('/cfg')['miners']
-        ids_on = [i for i, x in enumerate(states) if x is True]
-        ids_off = [i for i, x in enumerate(states) if x is False]
-        ids_disabled = [i for i, x in enumerate(states) if x is None]
-        print('Miners turned on: {}'
-              .format(', '.join('#{}'.format(i) for i in ids_on)))
-        print('Miners turned off: {}'
-              .format(', '.join('#{}'.format(i) for i in ids_off)))
-        print('Disabled miners: {}'
-              .format(', '.join('#{}'.format(i) for i in ids_disabled)))
-
-    if args.set_mode:
-        # exit if only `minerctl set` has been entered
-        if len(sys.argv) == 2:
-            _error_exit(SET_PARSER)
+    if args.set_mode == 'watch':
+        _watch(args, sec_handler)
+        return
+    if args.set_mode == 'record':
+        _record(args, sec_handler)
+        return
+    if args.set_mode == 'export':
+        _export(args, sec_handler)
+        return
 
-        if args.set_target:
-            sec_handler.safe_patch(
-                '/temp',
-                {'target': _int(args.set_target, 'Target temperature')})
-        if args.set_sensor_id:
-            sec_handler.safe_patch(
-                '/temp',
-                {'sensor_id': _int(args.set_sensor_id, 'Sensor ID')})
-        if args.set_external:
-            sec_handler.safe_patch(
-                '/temp',
-                {'external': _int(args.set_external, 'External temperature')})
-        if args.set_threshold:
-            sec_handler.safe_patch(
-                '/filter', {'threshold': _int(args.set_threshold, 'Threshold')})
-        if args.set_min_rpm:
-            sec_handler.safe_patch(
-                '/fans', {'min_rpm': _int(args.set_min_rpm, 'Minimum RPM')})
-        if args.set_max_rpm:
-            sec_handler.safe_patch(
-                '/fans', {'max_rpm': _int(args.set_max_rpm, 'Maximum RPM')})
-        if args.set_miner:
-            miner_id = _int(args.set_miner[0], 'Miner ID')
-            if args.set_miner[1] not in('on', 'off', 'register', 'deregister'):
-                print('Invalid miner action!')
-                _error_exit(SET_PARSER)
+    if args.set_mode == 'shell':
+        _shell(sec_handler)
+        return
 
-            sec_handler.safe_patch('/miner?id={}&action={}'
-                                   .format(miner_id, args.set_miner[1]), {})
-        if args.set_proportional:
-            sec_handler.safe_put(
-                '/pid',
-                {'proportional': _int(args.set_proportional,
-                                      'PID Proportional')})
-        if args.set_derivative:
-            sec_handler.safe_put(
-                '/pid',
-                {'derivative': _int(args.set_derivative, 'PID derivative')})
-        if args.set_integral:
-            sec_handler.safe_put(
-                '/pid', {'integral': _int(args.set_integral, 'PID integral')})
-        if args.set_bias:
-            sec_handler.safe_put(
-                '/pid', {'bias': _int(args.set_bias, 'PID bias')})
+    _run_commands(args, sys.argv[1:], sec_handler, timings)
@@ -0,0 +1,207 @@
+import asyncio
+import functools
+from collections import namedtuple
+from secure_handler import (SecureHandler, BackendError, AuthorizationError,
+                            BackendUnavailable, ConnectionPolicy)
+
+__all__ = ['Client', 'AsyncClient', 'BackendError', 'AuthorizationError',
+           'BackendUnavailable', 'ConnectionPolicy', 'Info', 'Temperatures',
+           'Filter', 'Fans', 'Mode', 'Pid', 'Miners']
+
+Info = namedtuple('Info', ['firmware_version'])
+Temperatures = namedtuple('Temperatures', ['measurements', 'target',
+                                           'sensor_id', 'external'])
+Filter = namedtuple('Filter', ['pressure_diff', 'threshold', 'status_ok'])
+Fans = namedtuple('Fans', ['min_rpm', 'max_rpm', 'rpm'])
+# ontime/offtime are only set in gpu mode, restime only in asic mode
+Mode = namedtuple('Mode', ['active_mode', 'ontime', 'offtime', 'restime'])
+Pid = namedtuple('Pid', ['proportional', 'integral', 'derivative', 'bias'])
+MINER_ACTIONS = ('on', 'off', 'register', 'deregister')
+
+
+class Miners(namedtuple('Miners', ['states'])):
+    """
+    States of all miners indexed by miner ID: True (on), False (off) or None
+    (disabled).
+    """
+    __slots__ = ()
+
+    @property
+    def on(self):
+        return [i for i, state in enumerate(self.states) if state is True]
+
+    @property
+    def off(self):
+        return [i for i, state in enumerate(self.states) if state is False]
+
+    @property
+    def disabled(self):
+        return [i for i, state in enumerate(self.states) if state is None]
+
+
+def _from_json(cls, data):
+    """
+    Creates a result tuple from a JSON dict, missing keys are set to None and
+    unknown keys are ignored.
+    """
+    return cls(*(data.get(field) for field in cls._fields))
+
+
+class Client:
+    """
+    Python API of a single backend. Unlike the CLI it never shuts down the
+    process: every failure raises a BackendError, more specifically an
+    AuthorizationError if the token was rejected and BackendUnavailable if
+    the backend could not be reached in time.
+
+    Many clients can share one session (see `fleet.create_session`) and one
+    TokenCache.
+    """
+    def __init__(self, connection, private_key_location, policy=None,
+                 session=None, token_cache=None, cache=False):
+        """
+        :param connection: <ip/domain>:port, optionally prefixed
+        with http:// or https://
+        :param private_key_location: key file location
+        :param policy: ConnectionPolicy with timeouts and retries
+        :param session: requests session to share connection pools
+        :param token_cache: TokenCache to reuse previously minted tokens
+        :param cache: keep read results for the lifetime of the client,
+        otherwise every call returns the current state
+        """
+        if not connection.startswith(('http://', 'https://')):
+            connection = 'http://' + connection
+        self.handler = SecureHandler(private_key_location, connection,
+                                     session=session, policy=policy,
+                                     exit_on_error=False, cache=cache,
+                                     token_cache=token_cache)
+
+    def info(self):
+        """
+        :returns: Info
+        """
+        return _from_json(Info, self.handler.get('/info'))
+
+    def temps(self):
+        """
+        :returns: Temperatures, measurements maps sensor IDs to °C
+        """
+        return _from_json(Temperatures, self.handler.get('/temp'))
+
+    def filter(self):
+        """
+        :returns: Filter, pressures in mBar
+        """
+        return _from_json(Filter, self.handler.get('/filter'))
+
+    def fans(self):
+        """
+        :returns: Fans, RPM values in %
+        """
+        return _from_json(Fans, self.handler.get('/fans'))
+
+    def mode(self):
+        """
+        :returns: Mode, times in ms
+        """
+        return _from_json(Mode, self.handler.get('/mode'))
+
+    def pid(self):
+        """
+        :returns: Pid
+        """
+        return _from_json(Pid, self.handler.get('/pid'))
+
+    def miners(self):
+        """
+        :returns: Miners
+        """
+        return Miners(self.handler.get('/cfg')['miners'])
+
+    def set_temps(self, target=None, sensor_id=None, external=None):
+        """
+        Updates the passed temperature settings with one read-modify-write.
+        """
+        self._update('/temp', 'patch', target=target, sensor_id=sensor_id,
+                     external=external)
+
+    def set_filter(self, threshold=None):
+        self._update('/filter', 'patch', threshold=threshold)
+
+    def set_fans(self, min_rpm=None, max_rpm=None):
+        self._update('/fans', 'patch', min_rpm=min_rpm, max_rpm=max_rpm)
+
+    def set_pid(self, proportional=None, integral=None, derivative=None,
+                bias=None):
+        self._update('/pid', 'put', proportional=proportional,
+                     integral=integral, derivative=derivative, bias=bias)
+
+    def _update(self, resource, method, **values):
+        """
+        Writes the values which are not None, see SecureHandler.safe_patch.
+
+        :param resource: JSON resource
+        :param method: 'patch' or 'put'
+        """
+        data = {key: int(value) for key, value in values.items()
+                if value is not None}
+        if data:
+            getattr(self.handler, 'safe_' + method)(resource, data)
+
+    def set_miner(self, miner_id, action):
+        """
+        :param miner_id: miner ID
+        :param action: 'on', 'off', 'register' or 'deregister'
+        """
+        if action not in MINER_ACTIONS:
+            raise ValueError('Invalid miner action {}'.format(action))
+        self.handler.patch('/miner?id={}&action={}'.format(int(miner_id),
+                                                           action), {})
+
+    def commit(self):
+        """
+        Persists the changes on the backend.
+        """
+        self.handler.put('/commit', {'commit': True})
+
+
+class AsyncClient:
+    """
+    asyncio variant of Client. The blocking requests are run in a thread
+    pool, so many backends can be driven concurrently from one event loop,
+    eg with asyncio.gather.
+    """
+    def __init__(self, connection, private_key_location, executor=None,
+                 **kwargs):
+        """
+        :param connection: <ip/domain>:port, optionally prefixed
+        with http:// or https://
+        :param private_key_location: key file location
+        :param executor: concurrent.futures executor shared by the clients,
+        the default executor of the loop is used if omitted
+        :param kwargs: further arguments of Client
+        """
+        self.client = Client(connection, private_key_location, **kwargs)
+        self.executor = executor
+
+
+def _coroutine(name):
+    """
+    Creates a coroutine method of AsyncClient, which runs the Client method
+    of the same name in the executor.
+    """
+    blocking = getattr(Client, name)
+
+    @functools.wraps(blocking)
+    async def method(self, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(blocking, self.client, *args,
+                                             **kwargs))
+    return method
+
+
+for _name in ('info', 'temps', 'filter', 'fans', 'mode', 'pid', 'miners',
+              'set_temps', 'set_filter', 'set_fans', 'set_pid', 'set_miner',
+              'commit'):
+    setattr(AsyncClient, _name, _coroutine(_name))
@@ -0,0 +1,221 @@
+import json
+import configparser
+from miner_states import (MinerStates, format_ranges, parse_ranges,
+                          state_name)
+
+# section, key, resource, write method
+SETTINGS = (('temp', 'target', '/temp', 'patch'),
+            ('temp', 'sensor_id', '/temp', 'patch'),
+            ('temp', 'external', '/temp', 'patch'),
+            ('filter', 'threshold', '/filter', 'patch'),
+            ('fans', 'min_rpm', '/fans', 'patch'),
+            ('fans', 'max_rpm', '/fans', 'patch'),
+            ('pid', 'proportional', '/pid', 'put'),
+            ('pid', 'integral', '/pid', 'put'),
+            ('pid', 'derivative', '/pid', 'put'),
+            ('pid', 'bias', '/pid', 'put'))
+MINERS_SECTION = 'miners'
+MINER_STATES = {'on': True, 'off': False, 'disabled': None}
+
+
+class DesiredState:
+    """
+    Configuration a backend should have. Only the listed values are managed,
+    everything else is left as it is.
+    """
+    def __init__(self, settings=None, miners=None):
+        """
+        :param settings: dict with resource: {key: int}
+        :param miners: dict with True, False or None: list of (start, stop)
+        tuples of the miners which should be in that state
+        """
+        self.settings = settings or {}
+        self.miners = miners or {}
+
+    @classmethod
+    def from_dict(cls, sections):
+        """
+        :param sections: dict with section: {key: value}, see `load`
+        """
+        known = {(section, key): (resource, method)
+                 for section, key, resource, method in SETTINGS}
+        settings, miners = {}, {}
+        for section, values in sections.items():
+            if not isinstance(values, dict):
+                raise ValueError('Section {} has to contain key value pairs'
+                                 .format(section))
+            for key, value in values.items():
+                if section == MINERS_SECTION:
+                    if key not in MINER_STATES:
+                        raise ValueError('Unknown miner state {}, choose from: '
+                                         '{}'.format(key,
+                                                     ', '.join(MINER_STATES)))
+                    try:
+                        miners[MINER_STATES[key]] = parse_ranges(value)
+                    except ValueError as err:
+                        raise ValueError('miners.{}: {}'.format(key, err))
+                    continue
+                if (section, key) not in known:
+                    raise ValueError('Unknown setting {}.{}, choose from: {}'
+                                     .format(section, key, ', '.join(
+                                         '{}.{}'.format(*setting[:2])
+                                         for setting in SETTINGS)))
+                try:
+                    value = int(value)
+                except (TypeError, ValueError):
+                    raise ValueError('{}.{} has to be an integer'
+                                     .format(section, key))
+                settings.setdefault(known[section, key][0], {})[key] = value
+        return cls(settings, miners)
+
+    @property
+    def resources(self):
+        """
+        :returns: list of the resources which have to be read for a plan
+        """
+        resources = []
+        for _, _, resource, _ in SETTINGS:
+            if resource in self.settings and resource not in resources:
+                resources.append(resource)
+        if self.miners:
+            resources.append('/cfg')
+        return resources
+
+
+def load(location):
+    """
+    Reads a desired state file. JSON files contain an object per section,
+    other files are read as INI, eg:
+
+        [temp]
+        target = 25
+        [pid]
+        bias = 0
+        [miners]
+        on = 0-63
+        disabled = 64-69
+
+    :param location: file path
+    :returns: DesiredState
+    :raises ValueError: if the file is invalid
+    :raises OSError: if the file cannot be read
+    """
+    with open(location) as file:
+        content = file.read()
+    if location.endswith('.json') or content.lstrip().startswith('{'):
+        try:
+            sections = json.loads(content)
+        except ValueError as err:
+            raise ValueError('Invalid JSON: {}'.format(err))
+        if not isinstance(sections, dict):
+            raise ValueError('The desired state has to be a JSON object')
+    else:
+        parser = configparser.ConfigParser()
+        try:
+            parser.read_string(content, location)
+        except configparser.Error as err:
+            raise ValueError(str(err).strip())
+        sections = {name: dict(parser[name]) for name in parser.sections()}
+    return DesiredState.from_dict(sections)
+
+
+def _miner_action(before, after):
+    """
+    :returns: miner action moving a miner from one state to the other
+    """
+    if after is None:
+        return 'deregister'
+    if after:
+        return 'register' if before is None else 'on'
+    return 'off'
+
+
+class Plan:
+    """
+    Minimal set of requests which brings a backend into the desired state.
+    """
+    def __init__(self, changes, miners):
+        """
+        :param changes: dict with resource: (method, {key: (current, desired)})
+        :param miners: list of (start, stop, current state, desired state)
+        """
+        self.changes = changes
+        self.miners = miners
+
+    def __bool__(self):
+        return bool(self.changes or self.miners)
+
+    def writes(self):
+        """
+        :returns: dict with resource: (method, data dict), one write per
+        resource
+        """
+        return {resource: (method, {key: values[1]
+                                    for key, values in changed.items()})
+                for resource, (method, changed) in self.changes.items()}
+
+    def miner_actions(self):
+        """
+        :returns: list of (miner ID, action) tuples
+        """
+        return [(miner_id, _miner_action(before, after))
+                for start, stop, before, after in self.miners
+                for miner_id in range(start, stop)]
+
+    def describe(self):
+        """
+        :returns: list of lines describing the changes
+        """
+        lines = ['{}: {}'.format(resource, ', '.join(
+            '{} {} -> {}'.format(key, current, desired)
+            for key, (current, desired) in changed.items()))
+                 for resource, (_, changed) in self.changes.items()]
+        lines += ['Miners {}: {} -> {}'.format(format_ranges([(start, stop)]),
+                                               state_name(before),
+                                               state_name(after))
+                  for start, stop, before, after in self.miners]
+        return lines
+
+    def summary(self):
+        """
+        :returns: str with the number of requests the plan needs
+        """
+        if not self:
+            return 'No changes, the backend is in the desired state'
+        return '{} resource writes, {} miner actions, 1 commit'.format(
+            len(self.changes), len(self.miner_actions()))
+
+
+def plan(desired, current):
+    """
+    Compares the desired with the current state.
+
+    :param desired: DesiredState
+    :param current: dict with resource: json dict of all the resources in
+    `desired.resources`
+    :returns: Plan
+    :raises ValueError: if the desired state refers to unknown miners
+    """
+    changes = {}
+    methods = {resource: method for _, _, resource, method in SETTINGS}
+    for resource, values in desired.settings.items():
+        changed = {key: (current[resource].get(key), value)
+                   for key, value in values.items()
+                   if current[resource].get(key) != value}
+        if changed:
+            changes[resource] = (methods[resource], changed)
+
+    miners = []
+    if desired.miners:
+        states = current['/cfg']['miners']
+        wanted = list(states)
+        for state, ranges in desired.miners.items():
+            for start, stop in ranges:
+                if stop > len(states):
+                    raise ValueError('Miner #{} does not exist, the backend '
+                                     'has {} miners'
+                                     .format(stop - 1, len(states)))
+                wanted[start:stop] = [state] * (stop - start)
+        miners = MinerStates.from_list(states).diff(
+            MinerStates.from_list(wanted))
+    return Plan(changes, miners)
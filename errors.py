@@ -0,0 +1,28 @@
+# kept free of imports, so the errors can be caught without loading
+# requests, eg by calls forwarded to the agent
+
+
+class BackendError(Exception):
+    """
+    Raised instead of shutting down the program if the handler was created
+    with `exit_on_error=False`.
+    """
+
+
+class AuthorizationError(BackendError):
+    """
+    Raised if the backend rejected the access token.
+    """
+
+
+class BackendUnavailable(BackendError):
+    """
+    Raised if the backend could not be reached in time or kept failing.
+    """
+
+
+class CircuitOpenError(BackendUnavailable):
+    """
+    Raised if a request was not sent because the circuit breaker of the
+    backend is open.
+    """
@@ -0,0 +1,214 @@
+import sys
+import time
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from miner_states import STATES, MinerStates
+
+RESOURCES = ['/temp', '/filter', '/fans', '/pid', '/mode', '/cfg']
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class _Family:
+    """
+    Collects the samples of one metric family of the text exposition format.
+    """
+    def __init__(self, name, help_text, kind='gauge'):
+        self.lines = ['# HELP {} {}'.format(name, help_text),
+                      '# TYPE {} {}'.format(name, kind)]
+        self.name = name
+
+    def add(self, value, **labels):
+        """
+        :param value: number, booleans are exported as 0/1 and None as NaN
+        :param labels: label name: value
+        """
+        label_text = ','.join('{}="{}"'.format(key, str(label)
+                                               .replace('\\', '\\\\')
+                                               .replace('"', '\\"'))
+                              for key, label in sorted(labels.items()))
+        self.lines.append('{}{} {}'.format(
+            self.name, '{' + label_text + '}' if label_text else '',
+            'NaN' if value is None else float(value)))
+        return self
+
+
+def render(data, up, refreshed, duration, failures):
+    """
+    Renders the metrics page.
+
+    :param data: dict with resource: json dict of the last successful poll,
+    empty if there was none
+    :param up: True if the last poll succeeded
+    :param refreshed: unix time of the last successful poll or None
+    :param duration: seconds the last poll took
+    :param failures: number of failed polls since the start
+    :returns: page as bytes
+    """
+    families = [
+        _Family('minerctl_up', 'Whether the last poll of the backend '
+                'succeeded.').add(up),
+        _Family('minerctl_refresh_failures_total', 'Number of failed polls.',
+                'counter').add(failures),
+        _Family('minerctl_refresh_duration_seconds', 'Duration of the last '
+                'poll.').add(duration)]
+    if refreshed is not None:
+        families.append(_Family('minerctl_last_refresh_timestamp_seconds',
+                                'Unix time of the last successful poll.')
+                        .add(refreshed))
+    if data:
+        temp, filter, fans = data['/temp'], data['/filter'], data['/fans']
+        sensors = _Family('minerctl_temperature_celsius', 'Measured '
+                          'temperature per sensor.')
+        for sensor, value in sorted(temp['measurements'].items()):
+            sensors.add(value, sensor=sensor)
+        rpm = _Family('minerctl_fan_rpm_percent', 'Fan speed and its limits.')
+        for kind in ('rpm', 'min_rpm', 'max_rpm'):
+            rpm.add(fans[kind], kind=kind)
+        pid = _Family('minerctl_pid', 'Parameters of the PID controller.')
+        for term, value in sorted(data['/pid'].items()):
+            pid.add(value, term=term)
+        mode = data['/mode']
+        timings = _Family('minerctl_mode_time_milliseconds', 'Timings of the '
+                          'active mining mode.')
+        for setting, value in sorted(mode.items()):
+            if setting != 'active_mode':
+                timings.add(value, setting=setting)
+        miners = MinerStates.from_list(data['/cfg']['miners']).summary()
+        states = _Family('minerctl_miners', 'Number of miners per state.')
+        for _, state in STATES:
+            states.add(miners[state], state=state)
+        families += [
+            sensors,
+            _Family('minerctl_target_temperature_celsius', 'Target '
+                    'temperature.').add(temp['target']),
+            _Family('minerctl_external_temperature_celsius', 'External '
+                    'reference temperature.').add(temp['external']),
+            _Family('minerctl_filter_pressure_diff_mbar', 'Differential '
+                    'pressure of the filter.').add(filter['pressure_diff']),
+            _Family('minerctl_filter_threshold_mbar', 'Differential pressure '
+                    'threshold.').add(filter['threshold']),
+            _Family('minerctl_filter_status_ok', 'Filter status flag reported '
+                    'by the backend.').add(filter['status_ok']),
+            rpm, pid,
+            _Family('minerctl_mode_info', 'Active mining mode.')
+            .add(1, mode=mode['active_mode']),
+            timings, states]
+    return ('\n'.join(line for family in families for line in family.lines)
+            + '\n').encode('utf-8')
+
+
+class Exporter:
+    """
+    Polls the backend on a background thread and keeps the rendered metrics
+    page, so scrapes never contact the backend: any number of scrapers costs
+    one poll per interval.
+    """
+    def __init__(self, fetch, interval):
+        """
+        :param fetch: callable returning a dict with resource: json dict of
+        all the RESOURCES, raising BackendError on failures
+        :param interval: seconds between two polls
+        """
+        self.fetch = fetch
+        self.interval = interval
+        self.data = {}
+        self.up = False
+        self.refreshed = None
+        self.duration = 0.0
+        self.failures = 0
+        self.scrapes = 0
+        self.scrapes_lock = threading.Lock()
+        self.page = render({}, False, None, 0.0, 0)
+        self._stop = threading.Event()
+
+    def refresh(self):
+        """
+        Polls the backend once and renders the page. Any failure, not only a
+        BackendError, marks the backend as down instead of ending the
+        refresher thread, which would freeze the page at its last state.
+        """
+        from errors import BackendError
+
+        start = time.perf_counter()
+        try:
+            data = self.fetch()
+            refreshed = time.time()
+            duration = time.perf_counter() - start
+            page = render(data, True, refreshed, duration, self.failures)
+        except Exception as err:
+            self.up = False
+            self.failures += 1
+            if isinstance(err, BackendError):
+                print('Poll failed: {}'.format(err), flush=True)
+            else:
+                print('Poll failed: {}: {}'.format(type(err).__name__, err),
+                      flush=True)
+            self.duration = time.perf_counter() - start
+            # the last successful poll is kept, only `up` changes
+            self.page = render(self.data, self.up, self.refreshed,
+                               self.duration, self.failures)
+            return
+        self.data = data
+        self.up = True
+        self.refreshed = refreshed
+        self.duration = duration
+        # replacing the reference is atomic, scrapes never see partial pages
+        self.page = page
+
+    def run(self):
+        """
+        Refreshes in a loop until `stop` is called, a slow poll delays the
+        next one instead of overlapping it.
+        """
+        while not self._stop.is_set():
+            start = time.monotonic()
+            self.refresh()
+            self._stop.wait(max(self.interval - (time.monotonic() - start), 0))
+
+    def stop(self):
+        self._stop.set()
+
+
+def serve(exporter, address, port):
+    """
+    Serves the metrics page on /metrics until the process is interrupted.
+
+    :param exporter: Exporter, its refresher thread is started here
+    :param address: bind address, '' for all interfaces
+    :param port: TCP port
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/metrics', '/'):
+                self.send_error(404)
+                return
+            page = exporter.page
+            with exporter.scrapes_lock:
+                exporter.scrapes += 1
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(page)))
+            self.end_headers()
+            self.wfile.write(page)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    server.daemon_threads = True
+    refresher = threading.Thread(target=exporter.run, daemon=True)
+    refresher.start()
+    # stop cleanly if terminated by a service manager
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print('Serving metrics on http://{}:{}/metrics, polling every {}s'
+          .format(address or '0.0.0.0', server.server_address[1],
+                  exporter.interval), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        exporter.stop()
+        server.server_close()
+        print('Exporter stopped after {} scrapes'.format(exporter.scrapes))
@@ -0,0 +1,125 @@
+import time
+import configparser
+
+# requests and the handler are imported lazily, so that reading the inventory
+# does not slow down the startup of the CLI
+BACKENDS_SECTION = 'Backends'
+GROUPS_SECTION = 'Groups'
+ALL_GROUP = 'all'
+
+
+def load_group(config_file, group):
+    """
+    Resolves a group of the backend inventory. The inventory consists of a
+    [Backends] section (name = ip:port) and a [Groups] section
+    (group = name, name, ...) in the main config file. The implicit group
+    `all` contains every backend.
+
+    :param config_file: path of the main config file
+    :param group: group name
+    :returns: list of (name, ip:port) tuples in inventory order, None if the
+    group or one of its members is unknown
+    """
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    if not config.has_section(BACKENDS_SECTION):
+        return None
+    backends = config[BACKENDS_SECTION]
+    if group == ALL_GROUP:
+        return list(backends.items())
+    if not config.has_option(GROUPS_SECTION, group):
+        return None
+    names = [name.strip() for name in config[GROUPS_SECTION][group].split(',')
+             if name.strip()]
+    if any(name not in backends for name in names):
+        return None
+    return [(name, backends[name]) for name in names]
+
+
+def create_session(backend_count, workers, timed=False, policy=None):
+    """
+    Creates one requests session whose connection pools are shared by all
+    the handlers of a fleet run.
+
+    :param backend_count: number of hosts that will be contacted
+    :param workers: maximum number of parallel requests per host
+    :param timed: measure the connect times for instrumentation.Timings
+    :param policy: ConnectionPolicy with the TLS settings, defaults are used
+    if omitted
+    :returns: requests.Session
+    """
+    from secure_handler import ConnectionPolicy
+    import transport
+
+    return transport.create_session(policy or ConnectionPolicy(),
+                                    pool_connections=backend_count,
+                                    pool_maxsize=workers, timed=timed)
+
+
+class FleetResult:
+    """
+    Outcome of running a function against a single backend of the fleet.
+    """
+    def __init__(self, name, connection, data=None, error=None, duration=0.0):
+        """
+        :param name: backend name of the inventory
+        :param connection: http://<ip/domain>:port
+        :param data: return value of the executed function
+        :param error: error message if the function failed
+        :param duration: wall time in seconds
+        """
+        self.name = name
+        self.connection = connection
+        self.data = data
+        self.error = error
+        self.duration = duration
+
+
+def run(backends, private_key_location, token_cache, func, policy=None,
+        workers=16, timings=None, session=None, response_cache=None):
+    """
+    Executes `func(handler)` for every backend with bounded concurrency. All
+    handlers share one session, errors of a single backend are collected
+    instead of stopping the whole run.
+
+    :param backends: list of (name, connection) tuples
+    :param private_key_location: key file location
+    :param token_cache: TokenCache shared by the handlers or None
+    :param func: callable taking a SecureHandler
+    :param policy: ConnectionPolicy of the handlers, its deadline limits the
+    time spent on a single backend
+    :param workers: maximum number of backends contacted at once
+    :param timings: instrumentation.Timings shared by the handlers or None
+    :param session: requests session to reuse, eg between several runs,
+    created if omitted
+    :param response_cache: ResponseCache shared by the handlers or None
+    :returns: list of FleetResult objects in the order of `backends`
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from secure_handler import SecureHandler, BackendError
+
+    if session is None:
+        session = create_session(len(backends), workers,
+                                 timed=timings is not None, policy=policy)
+
+    def execute(name, connection):
+        start = time.perf_counter()
+        try:
+            handler = SecureHandler(private_key_location, connection,
+                                    session=session, policy=policy,
+                                    exit_on_error=False,
+                                    token_cache=token_cache,
+                                    timings=timings,
+                                    response_cache=response_cache)
+            data = func(handler)
+        except BackendError as err:
+            return FleetResult(name, connection, error=str(err),
+                               duration=time.perf_counter() - start)
+        return FleetResult(name, connection, data=data,
+                           duration=time.perf_counter() - start)
+
+    with ThreadPoolExecutor(max_workers=max(min(workers, len(backends)),
+                                            1)) as pool:
+        futures = [pool.submit(execute, name, connection)
+                   for name, connection in backends]
+        return [future.result() for future in futures]
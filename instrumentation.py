@@ -0,0 +1,184 @@
+import json
+import time
+import threading
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from transport import TLSAdapter
+
+_CONNECT = threading.local()
+# SSL contexts of the timed sessions, whose handshakes Timings reports
+_TLS_CONTEXTS = []
+
+
+class TimedHTTPConnection(HTTPConnection):
+    """
+    HTTP connection which stores the duration of establishing the connection
+    in a thread-local, where `Timings` picks it up.
+    """
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _CONNECT.duration = time.perf_counter() - start
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    """
+    HTTPS variant of TimedHTTPConnection, includes the TLS handshake.
+    """
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _CONNECT.duration = time.perf_counter() - start
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(TLSAdapter):
+    """
+    TLSAdapter whose connection pools measure the connect time.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        _TLS_CONTEXTS.append(self.ssl_context)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool, 'https': TimedHTTPSConnectionPool}
+
+
+class RequestRecord:
+    """
+    Timings of a single request.
+    """
+    def __init__(self, connection, method, resource, status, size, connect,
+                 ttfb, total):
+        """
+        :param connection: http://<ip/domain>:port
+        :param method: HTTP method
+        :param resource: JSON resource
+        :param status: HTTP status code or None if the request failed
+        :param size: number of body bytes
+        :param connect: seconds spent establishing a new connection, 0 if a
+        pooled connection was reused
+        :param ttfb: seconds until the response headers were received
+        :param total: seconds until the body was read
+        """
+        self.connection = connection
+        self.method = method
+        self.resource = resource
+        self.status = status
+        self.size = size
+        self.connect = connect
+        self.ttfb = ttfb
+        self.total = total
+
+
+class Timings:
+    """
+    Collects request timings and the durations of other phases of a run (eg
+    key loading, signing, JSON decoding and printing). Thread-safe, so it can
+    be shared by all the handlers and worker threads of a run.
+    """
+    def __init__(self):
+        self.requests = []
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def begin():
+        """
+        Resets the connect time of the calling thread and marks the start of
+        a request.
+
+        :returns: start timestamp for `end`
+        """
+        _CONNECT.duration = 0.0
+        return time.perf_counter()
+
+    def end(self, start, connection, method, resource, resp=None):
+        """
+        Records a finished request, must be called by the thread which called
+        `begin`.
+
+        :param start: timestamp returned by `begin`
+        :param connection: http://<ip/domain>:port
+        :param method: HTTP method
+        :param resource: JSON resource
+        :param resp: requests.Response or None if the request failed
+        """
+        total = time.perf_counter() - start
+        record = RequestRecord(connection, method, resource,
+                               resp.status_code if resp is not None else None,
+                               len(resp.content) if resp is not None else 0,
+                               getattr(_CONNECT, 'duration', 0.0),
+                               resp.elapsed.total_seconds()
+                               if resp is not None else total, total)
+        with self._lock:
+            self.requests.append(record)
+
+    def phase(self, name, duration):
+        """
+        Adds the duration to a phase, phases may be recorded several times.
+
+        :param name: phase description, eg 'json decode'
+        :param duration: seconds
+        """
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + duration
+
+    @staticmethod
+    def tls_handshakes():
+        """
+        :returns: (TLS handshakes, resumed sessions) of the timed sessions
+        """
+        return (sum(context.handshakes for context in _TLS_CONTEXTS),
+                sum(context.resumed for context in _TLS_CONTEXTS))
+
+    def print_summary(self):
+        """
+        Prints a table of all the requests followed by the phase totals. The
+        backend is shown as well if several backends have been contacted.
+        """
+        backends = len({record.connection for record in self.requests}) > 1
+        row = '  {:<7}{:<28}{:>7}{:>9}{:>10}{:>10}{:>10}'
+        if backends:
+            row += '  {}'
+        print('Request timings:')
+        print(row.format('method', 'resource', 'status', 'bytes', 'connect',
+                         'ttfb', 'total', 'backend'))
+        for record in self.requests:
+            print(row.format(record.method, record.resource[:27],
+                             record.status or 'error', record.size,
+                             '{:.1f}ms'.format(record.connect * 1000),
+                             '{:.1f}ms'.format(record.ttfb * 1000),
+                             '{:.1f}ms'.format(record.total * 1000),
+                             record.connection))
+        print('  {} requests, {} bytes, {:.1f}ms request time'
+              .format(len(self.requests),
+                      sum(record.size for record in self.requests),
+                      sum(record.total for record in self.requests) * 1000))
+        handshakes, resumed = self.tls_handshakes()
+        if handshakes:
+            print('  {} TLS handshakes, {} resumed sessions'
+                  .format(handshakes, resumed))
+        if self.phases:
+            print('Phases: {}'.format(', '.join(
+                '{} {:.1f}ms'.format(name, duration * 1000)
+                for name, duration in self.phases.items())))
+
+    def as_json(self):
+        """
+        :returns: JSON str containing all the requests and phases
+        """
+        handshakes, resumed = self.tls_handshakes()
+        return json.dumps({
+            'requests': [dict(vars(record)) for record in self.requests],
+            'phases': self.phases,
+            'tls': {'handshakes': handshakes, 'resumed': resumed}})
@@ -0,0 +1,176 @@
+STATES = ((True, 'on'), (False, 'off'), (None, 'disabled'))
+# state of miners which only exist in one of two compared snapshots
+MISSING = 'missing'
+
+
+def state_name(state):
+    """
+    :param state: True, False or None as returned by the backend, or MISSING
+    :returns: on, off, disabled or missing
+    """
+    if state is MISSING:
+        return MISSING
+    if state is None:
+        return 'disabled'
+    return 'on' if state else 'off'
+
+
+def format_ranges(ranges):
+    """
+    :param ranges: list of (start, stop) tuples, stop is exclusive
+    :returns: compressed ID list, eg '#0-#127, #130'
+    """
+    return ', '.join('#{}'.format(start) if stop - start == 1
+                     else '#{}-#{}'.format(start, stop - 1)
+                     for start, stop in ranges)
+
+
+def parse_ranges(spec, name='Miner ID'):
+    """
+    Parses a list of IDs and ID ranges, eg "0-63,70,80-99".
+
+    :param spec: comma separated IDs or ranges
+    :param name: will be inserted into the error messages
+    :returns: list of (start, stop) tuples in the given order, see
+    `format_ranges`
+    :raises ValueError: if an ID is not a non-negative integer or a range is
+    reversed
+    """
+    ranges = []
+    for part in str(spec).split(','):
+        part = part.strip()
+        if part.startswith('-'):
+            raise ValueError('{} {} is invalid!'.format(name, part))
+        start, separator, end = part.partition('-')
+        try:
+            start = int(start)
+            end = int(end) if separator else start
+        except ValueError:
+            raise ValueError('{} has to be an integer!'.format(name))
+        if start > end:
+            raise ValueError('{} range {} is invalid!'.format(name, part))
+        ranges.append((start, end + 1))
+    return ranges
+
+
+def id_ranges(ids):
+    """
+    :param ids: iterable of miner IDs
+    :returns: list of (start, stop) tuples of the sorted IDs, see
+    `format_ranges`
+    """
+    ranges = []
+    for miner_id in sorted(set(ids)):
+        if ranges and ranges[-1][1] == miner_id:
+            ranges[-1] = (ranges[-1][0], miner_id + 1)
+        else:
+            ranges.append((miner_id, miner_id + 1))
+    return ranges
+
+
+class MinerStates:
+    """
+    Run-length encoded snapshot of the miner states of one backend. Miners are
+    usually switched in blocks, so a container of thousands of miners is
+    described by a handful of runs, which are cheap to keep, to aggregate and
+    to compare.
+    """
+    def __init__(self, runs, total):
+        """
+        :param runs: list of (start, stop, state) tuples covering every miner
+        ID in ascending order, stop is exclusive
+        :param total: number of miners
+        """
+        self.runs = runs
+        self.total = total
+        self.counts = {state: 0 for state, _ in STATES}
+        for start, stop, state in runs:
+            self.counts[state] = self.counts.get(state, 0) + stop - start
+
+    @classmethod
+    def from_list(cls, states):
+        """
+        Encodes the `miners` list of `/cfg` in a single pass.
+
+        :param states: list of True, False or None indexed by miner ID
+        """
+        runs = []
+        start = 0
+        for index, state in enumerate(states):
+            if index and state is not states[start]:
+                runs.append((start, index, states[start]))
+                start = index
+        if states:
+            runs.append((start, len(states), states[start]))
+        return cls(runs, len(states))
+
+    def ranges(self, state):
+        """
+        :param state: True, False or None
+        :returns: list of (start, stop) tuples of the miners in that state
+        """
+        return [(start, stop) for start, stop, value in self.runs
+                if value is state]
+
+    def format(self, state):
+        """
+        :param state: True, False or None
+        :returns: compressed ID list of the miners in that state
+        """
+        return format_ranges(self.ranges(state))
+
+    def summary(self):
+        """
+        :returns: dict with on/off/disabled/total: count
+        """
+        summary = {name: self.counts[state] for state, name in STATES}
+        summary['total'] = self.total
+        return summary
+
+    def diff(self, other):
+        """
+        Compares two snapshots run by run, without expanding them.
+
+        :param other: newer MinerStates of the same backend
+        :returns: list of (start, stop, old state, new state) tuples of the
+        changed ranges, miners missing in one of the snapshots are reported
+        with the state MISSING
+        """
+        old, new = list(self.runs), list(other.runs)
+        if self.total < other.total:
+            old.append((self.total, other.total, MISSING))
+        elif other.total < self.total:
+            new.append((other.total, self.total, MISSING))
+        changes = []
+        position = i = j = 0
+        while i < len(old) and j < len(new):
+            stop = min(old[i][1], new[j][1])
+            before, after = old[i][2], new[j][2]
+            if before is not after:
+                if (changes and changes[-1][1] == position
+                        and changes[-1][2] is before
+                        and changes[-1][3] is after):
+                    changes[-1] = (changes[-1][0], stop, before, after)
+                else:
+                    changes.append((position, stop, before, after))
+            position = stop
+            if old[i][1] == stop:
+                i += 1
+            if new[j][1] == stop:
+                j += 1
+        return changes
+
+
+def aggregate(snapshots):
+    """
+    Sums the states of several backends, eg of a fleet.
+
+    :param snapshots: iterable of MinerStates
+    :returns: dict with on/off/disabled/total: count
+    """
+    totals = {name: 0 for _, name in STATES}
+    totals['total'] = 0
+    for snapshot in snapshots:
+        for key, value in snapshot.summary().items():
+            totals[key] += value
+    return totals
@@ -0,0 +1,59 @@
+import sys
+import json
+import threading
+
+
+class RecordWriter:
+    """
+    Streams fetched resources as machine readable records, one per resource
+    and backend. Every record is flushed immediately, so consumers can process
+    the output while the remaining requests are still running.
+
+    `ndjson` writes one JSON object per line, `json` writes a JSON array whose
+    elements are written one by one.
+    """
+    def __init__(self, fmt, stream=None):
+        """
+        :param fmt: 'json' or 'ndjson'
+        :param stream: file object, defaults to stdout
+        """
+        self.fmt = fmt
+        self.stream = stream or sys.stdout
+        self.count = 0
+        self._lock = threading.Lock()
+        if fmt == 'json':
+            self._emit('[')
+
+    def _emit(self, text):
+        self.stream.write(text)
+        self.stream.flush()
+
+    def write(self, backend, resource, data=None, error=None):
+        """
+        Writes a record, may be called by several threads.
+
+        :param backend: http://<ip/domain>:port
+        :param resource: resource path, None for errors affecting the whole
+        backend
+        :param data: json dict returned by the backend
+        :param error: error message instead of data
+        """
+        record = {'backend': backend, 'resource': resource}
+        if error is not None:
+            record['error'] = error
+        else:
+            record['data'] = data
+        line = json.dumps(record, separators=(',', ':'))
+        with self._lock:
+            if self.fmt == 'json':
+                self._emit(('\n' if not self.count else ',\n') + line)
+            else:
+                self._emit(line + '\n')
+            self.count += 1
+
+    def close(self):
+        """
+        Terminates the JSON array, the stream itself is not closed.
+        """
+        if self.fmt == 'json':
+            self._emit('\n]\n' if self.count else ']\n')
@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import threading
+
+# seconds a stored response is used without contacting the backend; only
+# these slowly changing resources are stored
+DEFAULT_TTLS = {'/info': 3600, '/mode': 300, '/pid': 300}
+DEFAULT_MAX_ENTRIES = 256
+# a commit may change every resource of the backend
+COMMIT_RESOURCE = '/commit'
+
+
+class ResponseCache:
+    """
+    Keeps GET responses of slowly changing resources in an SQLite file, so
+    they survive between CLI calls. Entries are stored per backend and
+    resource, expire after the TTL of their resource and the least recently
+    used ones are evicted once the size limit is reached. Expired entries are
+    still used to revalidate the resource with a conditional request.
+
+    Snapshots of written resources are kept separately together with their
+    ETag. They never expire, as writes based on them are sent with an
+    `If-Match` precondition. The backend has to check it, which is recorded
+    per backend, see `preconditions_checked`.
+    """
+    def __init__(self, location, ttls=None, max_age=None,
+                 max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        :param location: path of the database file, only readable by the owner
+        :param ttls: dict with resource: seconds, defaults to DEFAULT_TTLS
+        :param max_age: seconds overriding every TTL, eg 0 to revalidate all
+        the entries
+        :param max_entries: number of responses kept
+        """
+        self.location = location
+        self.ttls = DEFAULT_TTLS if ttls is None else ttls
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        """
+        :returns: sqlite3 connection, opened on first use
+        """
+        # sqlite3 is only imported once a cacheable resource is requested
+        import sqlite3
+
+        if self._db is None:
+            fd = os.open(self.location, os.O_RDWR | os.O_CREAT, 0o600)
+            os.close(fd)
+            self._db = sqlite3.connect(self.location, timeout=5,
+                                       check_same_thread=False)
+            # losing the latest entries on a crash is fine for a cache
+            self._db.execute('PRAGMA synchronous = OFF')
+            self._db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                             'backend TEXT, resource TEXT, body TEXT, '
+                             'etag TEXT, stored REAL, used REAL, '
+                             'PRIMARY KEY (backend, resource))')
+            self._db.execute('CREATE TABLE IF NOT EXISTS snapshots ('
+                             'backend TEXT, resource TEXT, body TEXT, '
+                             'etag TEXT, used REAL, '
+                             'PRIMARY KEY (backend, resource))')
+            self._db.execute('CREATE TABLE IF NOT EXISTS preconditions ('
+                             'backend TEXT PRIMARY KEY, checked INTEGER)')
+        return self._db
+
+    def _execute(self, *statements):
+        """
+        Runs the statements in one transaction. Database errors are ignored,
+        the cache is an optimization only.
+
+        :param statements: (sql, parameters) tuples
+        :returns: rows of the last statement, empty on errors
+        """
+        import sqlite3
+
+        with self._lock:
+            try:
+                db = self._connection()
+                with db:
+                    rows = []
+                    for sql, parameters in statements:
+                        rows = db.execute(sql, parameters).fetchall()
+                    return rows
+            except (sqlite3.Error, OSError):
+                return []
+
+    def cacheable(self, resource):
+        return resource in self.ttls
+
+    def load(self, backend, resource):
+        """
+        Looks up a stored response and marks it as recently used.
+
+        :param backend: http://<ip/domain>:port
+        :param resource: JSON resource
+        :returns: (json dict, ETag or None, True if expired) or None
+        """
+        if not self.cacheable(resource):
+            return None
+        rows = self._execute(
+            ('UPDATE responses SET used = ? WHERE backend = ? AND '
+             'resource = ?', (time.time(), backend, resource)),
+            ('SELECT body, etag, stored FROM responses WHERE backend = ? AND '
+             'resource = ?', (backend, resource)))
+        if not rows:
+            return None
+        body, etag, stored = rows[0]
+        ttl = self.ttls[resource] if self.max_age is None else self.max_age
+        return json.loads(body), etag, time.time() - stored >= ttl
+
+    def store(self, backend, resource, body, etag=None):
+        """
+        Saves a response and evicts the least recently used entries above the
+        size limit.
+
+        :param backend: http://<ip/domain>:port
+        :param resource: JSON resource
+        :param body: json dict
+        :param etag: ETag header of the response
+        """
+        if not self.cacheable(resource):
+            return
+        now = time.time()
+        self._execute(
+            ('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+             (backend, resource, json.dumps(body), etag, now, now)),
+            ('DELETE FROM responses WHERE rowid NOT IN (SELECT rowid FROM '
+             'responses ORDER BY used DESC LIMIT ?)', (self.max_entries,)))
+
+    def invalidate(self, backend, resource):
+        """
+        Drops the entries affected by a write. A commit drops all the entries
+        of the backend.
+
+        :param backend: http://<ip/domain>:port
+        :param resource: JSON resource which has been written
+        """
+        path = resource.split('?')[0]
+        if path == COMMIT_RESOURCE:
+            self._execute(('DELETE FROM responses WHERE backend = ?',
+                           (backend,)))
+        elif self.cacheable(path):
+            self._execute(('DELETE FROM responses WHERE backend = ? AND '
+                           'resource = ?', (backend, path)))
+
+    def load_snapshot(self, backend, resource):
+        """
+        :param backend: http://<ip/domain>:port
+        :param resource: JSON resource
+        :returns: (json dict, ETag) of the last write or None
+        """
+        rows = self._execute(
+            ('UPDATE snapshots SET used = ? WHERE backend = ? AND '
+             'resource = ?', (time.time(), backend, resource)),
+            ('SELECT body, etag FROM snapshots WHERE backend = ? AND '
+             'resource = ?', (backend, resource)))
+        if not rows:
+            return None
+        return json.loads(rows[0][0]), rows[0][1]
+
+    def store_snapshot(self, backend, resource, body, etag):
+        """
+        Saves the state of a resource after a write, or drops it if the
+        backend did not send an ETag.
+
+        :param backend: http://<ip/domain>:port
+        :param resource: JSON resource
+        :param body: json dict
+        :param etag: ETag header of the response or None
+        """
+        if etag is None:
+            self._execute(('DELETE FROM snapshots WHERE backend = ? AND '
+                           'resource = ?', (backend, resource)))
+            return
+        self._execute(
+            ('INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?)',
+             (backend, resource, json.dumps(body), etag, time.time())),
+            ('DELETE FROM snapshots WHERE rowid NOT IN (SELECT rowid FROM '
+             'snapshots ORDER BY used DESC LIMIT ?)', (self.max_entries,)))
+
+    def preconditions_checked(self, backend):
+        """
+        :param backend: http://<ip/domain>:port
+        :returns: True if the backend rejects writes with a failed `If-Match`
+        precondition, False if it ignores it, None if unknown
+        """
+        rows = self._execute(('SELECT checked FROM preconditions WHERE '
+                              'backend = ?', (backend,)))
+        if not rows:
+            return None
+        return bool(rows[0][0])
+
+    def store_preconditions_checked(self, backend, checked):
+        """
+        :param backend: http://<ip/domain>:port
+        :param checked: whether the backend checks `If-Match` preconditions
+        """
+        self._execute(('INSERT OR REPLACE INTO preconditions VALUES (?, ?)',
+                       (backend, int(checked))))
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,67 @@
+def wave_sizes(count, canary=1, growth=2):
+    """
+    :param count: number of backends
+    :param canary: size of the first wave
+    :param growth: factor by which every further wave grows
+    :returns: list of wave sizes, eg [1, 2, 4, 3] for 10 backends
+    """
+    sizes = []
+    size = max(canary, 1)
+    while count > 0:
+        sizes.append(min(size, count))
+        count -= sizes[-1]
+        size = max(int(size * growth), size + 1)
+    return sizes
+
+
+class Rollout:
+    """
+    Splits a group of backends into waves of increasing size, starting with
+    a canary wave, and stops once the share of failed backends exceeds the
+    threshold, so a bad change only reaches a few backends.
+    """
+    def __init__(self, backends, canary=1, growth=2, max_failures=0.0):
+        """
+        :param backends: list of (name, connection) tuples
+        :param canary: number of backends in the first wave
+        :param growth: factor by which every further wave grows
+        :param max_failures: share of failed backends (0 to 1) which is
+        tolerated before the rollout is stopped
+        """
+        self.backends = backends
+        self.sizes = wave_sizes(len(backends), canary, growth)
+        self.max_failures = max_failures
+        self.results = []
+        self.failed = 0
+        self.stopped = False
+
+    def waves(self):
+        """
+        Yields the backends of the next wave until all are done or the
+        rollout is stopped. The results of a wave have to be passed to
+        `record` before the next one is requested.
+        """
+        start = 0
+        for size in self.sizes:
+            if self.stopped:
+                return
+            yield self.backends[start:start + size]
+            start += size
+
+    def record(self, results):
+        """
+        :param results: list of fleet.FleetResult objects of a wave
+        :returns: True if the rollout continues
+        """
+        self.results += results
+        self.failed += sum(1 for result in results if result.error)
+        if self.failed > self.max_failures * len(self.results):
+            self.stopped = True
+        return not self.stopped
+
+    @property
+    def skipped(self):
+        """
+        :returns: number of backends which have not been contacted
+        """
+        return len(self.backends) - len(self.results)
@@ -0,0 +1,170 @@
+import time
+
+# resource: (measured key, key of the limit it must not reach)
+LIMITS = {'/temp': ('measurements', 'target'),
+          '/filter': ('pressure_diff', 'threshold'),
+          '/fans': ('rpm', 'max_rpm')}
+# share of the limit below which a metric is polled at the fastest interval
+NEAR_LIMIT = 0.1
+# share of the estimated time until the limit is reached between two polls
+LEAD = 0.25
+# factor by which the interval of an unchanged resource grows
+BACKOFF = 2
+
+
+def level(resource, data):
+    """
+    :param resource: resource path
+    :param data: json dict of the resource
+    :returns: (value, limit) tuple, the highest sensor for several
+    measurements, or None if the resource has no limit
+    """
+    if resource not in LIMITS or not isinstance(data, dict):
+        return None
+    value, limit = (data.get(key) for key in LIMITS[resource])
+    if isinstance(value, dict):
+        value = max((measurement for measurement in value.values()
+                     if isinstance(measurement, (int, float))), default=None)
+    if not isinstance(value, (int, float)) or not limit:
+        return None
+    return value, limit
+
+
+class _Schedule:
+    def __init__(self, interval):
+        self.interval = interval
+        self.polled = None
+        self.value = None
+        self.updated = None
+        self.data = None
+
+
+class Scheduler:
+    """
+    Decides which resources of a backend are polled next. A metric which
+    approaches its limit (eg the filter pressure its threshold) is polled
+    more often the faster it moves, resources which stay the same are polled
+    less and less often. All intervals are stretched evenly if they would
+    exceed the request budget of the backend.
+    """
+    def __init__(self, resources, min_interval, max_interval, budget=None,
+                 clock=time.monotonic):
+        """
+        :param resources: list of resource paths
+        :param min_interval: shortest seconds between two polls of a resource
+        :param max_interval: longest seconds between two polls of a resource
+        :param budget: maximum requests per second to the backend or None
+        :param clock: callable returning the current time in seconds
+        """
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.budget = budget
+        self.clock = clock
+        self.schedules = {resource: _Schedule(min_interval)
+                          for resource in resources}
+        self.requests = 0
+        self.started = None
+
+    def _clamp(self, interval):
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def stretch(self):
+        """
+        :returns: factor applied to every interval to stay within the budget
+        """
+        if not self.budget:
+            return 1
+        rate = sum(1 / max(schedule.interval, 1e-6)
+                   for schedule in self.schedules.values())
+        return max(rate / self.budget, 1)
+
+    def _next_poll(self, schedule):
+        if schedule.polled is None:
+            return float('-inf')
+        return schedule.polled + schedule.interval * self.stretch()
+
+    def delay(self):
+        """
+        :returns: seconds until the next resource is due
+        """
+        now = self.clock()
+        return max(min(self._next_poll(schedule)
+                       for schedule in self.schedules.values()) - now, 0)
+
+    def due(self):
+        """
+        Returns the resources which are due and counts them as requested.
+
+        :returns: list of resource paths
+        """
+        now = self.clock()
+        if self.started is None:
+            self.started = now
+        resources = [resource for resource, schedule in self.schedules.items()
+                     if self._next_poll(schedule) <= now]
+        for resource in resources:
+            self.schedules[resource].polled = now
+        self.requests += len(resources)
+        return resources
+
+    def update(self, resource, data):
+        """
+        Adapts the interval of the resource to its latest value.
+
+        :param resource: resource path
+        :param data: json dict of the resource
+        """
+        schedule = self.schedules[resource]
+        now = self.clock()
+        current = level(resource, data)
+        if current is None:
+            if schedule.data is not None and data != schedule.data:
+                interval = schedule.interval / BACKOFF
+            else:
+                interval = schedule.interval * BACKOFF
+        else:
+            value, limit = current
+            headroom = (limit - value) / abs(limit)
+            # only a movement towards the limit counts, relative to the limit
+            speed = 0
+            if schedule.value is not None and now > schedule.updated:
+                speed = ((value - schedule.value) / abs(limit)
+                         / (now - schedule.updated))
+            if headroom <= NEAR_LIMIT:
+                interval = self.min_interval
+            elif speed > 0:
+                interval = headroom / speed * LEAD
+            else:
+                interval = schedule.interval * BACKOFF
+            schedule.value = value
+        schedule.interval = self._clamp(interval)
+        schedule.data = data
+        schedule.updated = now
+
+    def intervals(self):
+        """
+        :returns: dict with resource: seconds between its polls, including
+        the budget stretch
+        """
+        stretch = self.stretch()
+        return {resource: schedule.interval * stretch
+                for resource, schedule in self.schedules.items()}
+
+    def rate(self):
+        """
+        :returns: effective requests per second since the first poll, None
+        before time has passed
+        """
+        if self.started is None or self.clock() <= self.started:
+            return None
+        return self.requests / (self.clock() - self.started)
+
+    def fixed_requests(self):
+        """
+        :returns: number of requests polling every resource at the shortest
+        interval would have needed so far, None without a shortest interval
+        """
+        if self.started is None or not self.min_interval:
+            return None
+        polls = int((self.clock() - self.started) / self.min_interval) + 1
+        return polls * len(self.schedules)
@@ -1,43 +1,267 @@
 import sys
+import copy
 import time
+import random
 import getpass
-import jwt
-import requests
-from requests.exceptions import ConnectionError
+import threading
+import contextlib
+from requests.exceptions import ConnectionError, SSLError, Timeout
+import transport
+# re-exported, the errors are part of the interface of the handler
+from errors import (BackendError, AuthorizationError, BackendUnavailable,
+                    CircuitOpenError)
+
+IDEMPOTENT_METHODS = ('GET', 'PUT')
+# If-Match value of the first write to a backend which could be based on a
+# state of a previous program run, it tells whether the backend checks
+# preconditions before such a state is used
+PRECONDITION_PROBE = '"minerctl-precondition-probe"'
+
+
+class ConnectionPolicy:
+    """
+    Timeouts, retries, circuit breaker and transport settings of a
+    SecureHandler.
+    """
+    def __init__(self, connect_timeout=5, read_timeout=30, retries=3,
+                 backoff=0.2, max_backoff=5, deadline=None,
+                 breaker_threshold=5, breaker_cooldown=30, pool_maxsize=10,
+                 ca_file=None, fingerprint=None):
+        """
+        :param connect_timeout: seconds to wait for a connection
+        :param read_timeout: seconds to wait for the response
+        :param retries: number of retries of idempotent requests (GET, PUT)
+        :param backoff: base delay in seconds, doubled with every retry
+        :param max_backoff: upper limit of a single delay in seconds
+        :param deadline: seconds all the requests of a handler may take in
+        total, None for no limit
+        :param breaker_threshold: consecutive failures after which requests to
+        the backend fail fast, 0 disables the circuit breaker
+        :param breaker_cooldown: seconds until a failing backend is tried again
+        :param pool_maxsize: connections kept open per backend
+        :param ca_file: CA bundle or certificate file which HTTPS backends are
+        verified against, the system CAs are used if omitted
+        :param fingerprint: hex SHA-256 fingerprint the certificate of HTTPS
+        backends has to match, replaces the CA check unless `ca_file` is set
+        """
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.pool_maxsize = pool_maxsize
+        self.ca_file = ca_file
+        self.fingerprint = fingerprint
+
+
+class CircuitBreaker:
+    """
+    Counts the consecutive failures of a backend. Once the threshold is
+    reached the breaker opens and requests are rejected until the cooldown
+    has passed. Then a single trial request is let through, which either
+    closes the breaker again or keeps it open for another cooldown.
+    """
+    def __init__(self, threshold, cooldown):
+        """
+        :param threshold: consecutive failures which open the breaker, 0
+        disables it
+        :param cooldown: seconds the breaker stays open
+        """
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        :returns: True if a request may be sent to the backend
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if not self._trial and \
+                    time.monotonic() - self.opened_at >= self.cooldown:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or (self.threshold and
+                               self.failures >= self.threshold):
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+
+_BREAKERS = {}
+_BREAKERS_LOCK = threading.Lock()
+
+
+def circuit_breaker(connection, policy):
+    """
+    Returns the circuit breaker of a backend, which is shared by all the
+    handlers of the process that contact this backend.
+
+    :param connection: http://<ip/domain>:port
+    :param policy: ConnectionPolicy used if the breaker is created
+    :returns: CircuitBreaker
+    """
+    with _BREAKERS_LOCK:
+        if connection not in _BREAKERS:
+            _BREAKERS[connection] = CircuitBreaker(policy.breaker_threshold,
+                                                   policy.breaker_cooldown)
+        return _BREAKERS[connection]
 
 
 class SecureHandler:
     """
     Small Wrapper for requests which automatically handles JWT token authorization.
     """
-    def __init__(self, private_key_location, connection):
+    def __init__(self, private_key_location, connection, session=None,
+                 policy=None, exit_on_error=True, cache=True,
+                 token_cache=None, timings=None, response_cache=None):
         """
-        Initializing the wrapper and reading the private key file. If it is not
-        found the program is stopped and exitcode 1 is thrown.
+        Initializing the wrapper and creating the access token, which is
+        taken from the token cache if a valid one is available.
 
         :param private_key_location: key file location
         :param connection: http://<ip/domain>:port
+        :param session: requests session to share connection pools between
+        several handlers, a new one is created if omitted
+        :param policy: ConnectionPolicy with the timeouts, retries and the
+        deadline of the handler, the defaults are used if omitted
+        :param exit_on_error: shut down the program on errors, otherwise a
+        BackendError is raised
+        :param cache: keep GET results for the lifetime of the handler so
+        every resource is only read once, see `get`
+        :param token_cache: TokenCache to reuse previously minted tokens
+        :param timings: instrumentation.Timings which records every request
+        and the time spent on key loading, signing and JSON decoding
+        :param response_cache: ResponseCache keeping slowly changing
+        resources between program runs
+        """
+        self.exit_on_error = exit_on_error
+        # per thread request counts and error handling, see `raising`
+        self._thread_local = threading.local()
+        self.timings = timings
+        access_token = None
+        if token_cache is not None:
+            access_token = token_cache.load(private_key_location, connection)
+        if access_token is None:
+            access_token = self._create_access_token(private_key_location)
+            if token_cache is not None:
+                token_cache.store(private_key_location, connection,
+                                  access_token)
+        self.header = {'Authorization': 'Bearer {}'.format(access_token)}
+        self.connection = connection
+        self.policy = policy or ConnectionPolicy()
+        self.breaker = circuit_breaker(connection, self.policy)
+        self.deadline = None
+        if self.policy.deadline:
+            self.deadline = time.monotonic() + self.policy.deadline
+        if session is None:
+            session = transport.create_session(self.policy,
+                                               timed=timings is not None)
+        self.verify = transport.verification(self.policy)
+        self.session = session
+        self.cache = {} if cache else None
+        self.response_cache = response_cache
+        self.etags = {}
+        # resource: (json dict, ETag) of the latest known state, used as base
+        # of conditional writes
+        self.snapshots = {}
+        self.requests_issued = 0
+        self.requests_avoided = 0
+        self._lock = threading.Lock()
+
+    def _create_access_token(self, private_key_location):
+        """
+        Reads the private key file and signs a new access token. If the file
+        is not found the program is stopped and exitcode 1 is thrown.
+
+        :param private_key_location: key file location
+        :returns: token str
         """
+        start = time.perf_counter()
         try:
             with open(private_key_location, 'rb') as file:
                 private_key = file.read()
         except FileNotFoundError:
-            print('The specified key file does not exist.')
-            sys.exit(1)
+            self._fail('The specified key file does not exist.')
+        self._phase('key load', start)
+
+        start = time.perf_counter()
+        # jwt pulls in cryptography, which is only needed for signing
+        import jwt
 
         tmstmp = time.strftime("%Y%m%d-%H%M%S")
-        access_token = jwt.encode({'jti': tmstmp, 'identity': getpass.getuser(),
-                                   'type': 'access', 'fresh': False},
-                                  private_key,
-                                  algorithm='RS256').decode("utf-8")
-        self.header = {'Authorization': 'Bearer {}'.format(access_token)}
-        self.connection = connection
-        self.session = requests.Session()
-        self.adapter = requests.adapters.HTTPAdapter(max_retries=10)
-        self.session.mount('http://', self.adapter)
+        try:
+            access_token = jwt.encode({'jti': tmstmp,
+                                       'identity': getpass.getuser(),
+                                       'type': 'access', 'fresh': False},
+                                      private_key,
+                                      algorithm='RS256')
+        except ValueError:
+            self._fail('The specified key file does not contain a valid '
+                       'private key.')
+        self._phase('jwt sign', start)
+        # PyJWT < 2 returns bytes
+        if isinstance(access_token, bytes):
+            access_token = access_token.decode('utf-8')
+        return access_token
+
+    def _phase(self, name, start):
+        """
+        Records the time since `start` as phase of the timings, if enabled.
+
+        :param name: phase description
+        :param start: time.perf_counter() timestamp
+        """
+        if self.timings is not None:
+            self.timings.phase(name, time.perf_counter() - start)
+
+    def _fail(self, *lines, error=BackendError):
+        """
+        Prints the error message and shuts down the program, or raises a
+        BackendError containing the message if `exit_on_error` is disabled.
+
+        :param lines: message lines
+        :param error: BackendError subclass to be raised
+        """
+        if not self.exit_on_error or getattr(self._thread_local, 'raising',
+                                             False):
+            raise error(' '.join(lines))
+        for line in lines:
+            print(line)
+        sys.exit(1)
 
-    @staticmethod
-    def _check_authorization_success(resp):
+    @contextlib.contextmanager
+    def raising(self):
+        """
+        Raises BackendErrors instead of shutting down the program for the
+        requests of the calling thread, eg of a worker whose caller reports
+        the errors. Other threads using the handler are not affected.
+        """
+        previous = getattr(self._thread_local, 'raising', False)
+        self._thread_local.raising = True
+        try:
+            yield self
+        finally:
+            self._thread_local.raising = previous
+
+    def _check_authorization_success(self, resp):
         """
         Checks wether a resp looks like it was created by flask-jwt-extended
         and therefore represents a failed authorization attempt.
@@ -45,35 +269,282 @@ class SecureHandler:
         :param resp: json dict
         """
         if 'msg' in resp:
-            print('JWT token authorization unsuccessfull. '
-                  'Please check with your administrator whether your '
-                  'public key was stored in the backend config.')
-            print('Error: {}'.format(resp['msg']))
-            sys.exit(1)
+            self._fail('JWT token authorization unsuccessfull. '
+                       'Please check with your administrator whether your '
+                       'public key was stored in the backend config.',
+                       'Error: {}'.format(resp['msg']),
+                       error=AuthorizationError)
 
-    @staticmethod
-    def _connection_error():
+    def _connection_error(self):
         """
         Prints an error message and shuts down the program.
         """
-        print('Connection to backend could not be established. '
-              'Check your settings and try again.')
-        sys.exit(1)
+        self._fail('Connection to backend could not be established. '
+                   'Check your settings and try again.',
+                   error=BackendUnavailable)
+
+    def _remaining(self):
+        """
+        :returns: seconds left until the deadline, None if there is none
+        """
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
 
-    def get(self, resource):
+    def _request(self, method, resource, headers=None, data=None):
+        """
+        Sends a request with the timeouts of the connection policy. Connection
+        errors, timeouts and 5xx responses of idempotent requests (GET, PUT)
+        are retried with exponential backoff and full jitter, as long as the
+        deadline permits. Every failure is reported to the circuit breaker of
+        the backend, which fails fast while it is open.
+
+        :param method: HTTP method, eg 'GET'
+        :param resource: JSON resource to be contacted
+        :param headers: dict, defaults to the authorization header
+        :param data: dict sent as form data
+        :returns: requests.Response with a status code below 500
+        """
+        policy = self.policy
+        attempts = 1 + (policy.retries if method in IDEMPOTENT_METHODS else 0)
+        resp = tls_error = None
+        for attempt in range(attempts):
+            if not self.breaker.allow():
+                if attempt:
+                    # opened by the failures so far, which are reported below
+                    break
+                self._fail('Backend {} failed {} times in a row and is not '
+                           'contacted for {}s.'
+                           .format(self.connection, self.breaker.failures,
+                                   policy.breaker_cooldown),
+                           error=CircuitOpenError)
+            remaining = self._remaining()
+            if remaining is not None and remaining <= 0:
+                self._fail('The deadline of {}s for contacting the backend '
+                           'has been exceeded.'.format(policy.deadline),
+                           error=BackendUnavailable)
+            timeout = (policy.connect_timeout, policy.read_timeout)
+            if remaining is not None:
+                timeout = tuple(remaining if value is None
+                                else min(value, remaining)
+                                for value in timeout)
+            self._count()
+            if self.timings is not None:
+                start = self.timings.begin()
+            try:
+                resp = self.session.request(method, self.connection + resource,
+                                            headers=headers or self.header,
+                                            data=data, timeout=timeout,
+                                            verify=self.verify)
+            except SSLError as err:
+                resp, tls_error = None, err
+            except (ConnectionError, Timeout):
+                resp = None
+            if self.timings is not None:
+                self.timings.end(start, self.connection, method, resource,
+                                 resp)
+            if tls_error is not None:
+                # retrying does not help against a certificate mismatch
+                self.breaker.record_failure()
+                self._fail('TLS connection to {} failed: {}'
+                           .format(self.connection, tls_error))
+            if resp is not None and resp.status_code < 500:
+                self.breaker.record_success()
+                return resp
+            self.breaker.record_failure()
+            if attempt + 1 < attempts:
+                delay = random.uniform(0, min(policy.max_backoff,
+                                              policy.backoff * 2 ** attempt))
+                remaining = self._remaining()
+                time.sleep(delay if remaining is None
+                           else max(min(delay, remaining), 0))
+        if resp is None:
+            self._connection_error()
+        self._fail('Backend responded with status {} to {} {}.'
+                   .format(resp.status_code, method, resource),
+                   error=BackendUnavailable)
+
+    def _json(self, resp, method, resource):
+        """
+        Decodes the JSON body of a response and checks for failed
+        authorization attempts and client errors.
+
+        :param resp: requests.Response
+        :param method: HTTP method, for the error message
+        :param resource: JSON resource, for the error message
+        :returns: json dict
+        """
+        start = time.perf_counter()
+        try:
+            body = resp.json()
+        except ValueError:
+            self._fail('Backend sent an invalid response to {} {}.'
+                       .format(method, resource))
+        self._phase('json decode', start)
+        self._check_authorization_success(body)
+        if resp.status_code >= 400:
+            self._fail('Backend responded with status {} to {} {}: {}'
+                       .format(resp.status_code, method, resource,
+                               body.get('message', body)))
+        return body
+
+    def _count(self, avoided=False):
+        """
+        Increments the debug counters of issued and avoided requests.
+
+        :param avoided: True if the request was answered from the cache
+        """
+        with self._lock:
+            if avoided:
+                self.requests_avoided += 1
+            else:
+                self.requests_issued += 1
+        counts = self.thread_counts()
+        self._thread_local.counts = (counts[0] + (not avoided),
+                                     counts[1] + avoided)
+
+    def thread_counts(self):
+        """
+        :returns: (issued, avoided) requests of the calling thread, eg of a
+        request forwarded to the agent
+        """
+        return getattr(self._thread_local, 'counts', (0, 0))
+
+    def _update_cache(self, resource, data):
+        """
+        Applies a successful write to the cached resources. Writes to a cached
+        resource are merged into it, writes to parametrized resources (eg
+        `/miner?id=1&action=on`) invalidate every entry of the same path as
+        well as `/cfg`, which contains the miner states.
+
+        :param resource: JSON resource that has been written
+        :param data: dict
+        """
+        if self.cache is None:
+            return
+        with self._lock:
+            if resource in self.cache:
+                self.cache[resource].update(copy.deepcopy(data))
+            elif '?' in resource:
+                path = resource.split('?')[0]
+                for cached in list(self.cache):
+                    if cached.split('?')[0] in (path, '/cfg'):
+                        del self.cache[cached]
+                        self.etags.pop(cached, None)
+
+    def clear_cache(self):
+        """
+        Drops all cached GET results.
+        """
+        if self.cache is not None:
+            with self._lock:
+                self.cache.clear()
+                self.etags.clear()
+
+    def _remember(self, resource, body, etag):
+        """
+        Keeps a GET result in the cache of the handler, if enabled.
+        """
+        if self.cache is not None:
+            with self._lock:
+                self.cache[resource] = copy.deepcopy(body)
+                self.etags[resource] = etag
+
+    def _keep_snapshot(self, resource, body, etag, persist=False):
+        """
+        Keeps the state of a resource as base of later writes. Without an ETag
+        the state cannot be used and is dropped instead.
+
+        :param persist: store it in the response cache, if the handler has one
+        """
+        with self._lock:
+            if etag:
+                self.snapshots[resource] = (copy.deepcopy(body), etag)
+            else:
+                self.snapshots.pop(resource, None)
+        if persist and self.response_cache is not None:
+            self.response_cache.store_snapshot(self.connection, resource, body,
+                                               etag or None)
+
+    def _snapshot(self, resource):
+        """
+        :returns: tuple of (json dict, ETag) of the resource known from
+        previous requests or program runs or None, and whether the backend
+        has to be probed before a state of a previous run can be used
+        """
+        with self._lock:
+            snapshot = self.snapshots.get(resource)
+        probe = False
+        if snapshot is None and self.response_cache is not None:
+            snapshot = self.response_cache.load_snapshot(self.connection,
+                                                         resource)
+            if snapshot is not None:
+                # a backend ignoring If-Match would accept an outdated state
+                checked = self.response_cache.preconditions_checked(
+                    self.connection)
+                probe = checked is None
+                if not checked:
+                    snapshot = None
+        if snapshot is None:
+            return None, probe
+        return (copy.deepcopy(snapshot[0]), snapshot[1]), probe
+
+    def get(self, resource, fresh=False, persistent=True):
         """
         GETs the resource. If an error is thrown the program is shut down.
+        See `_request` for timeouts and retries.
+        Results are cached, so repeated GETs of the same resource are answered
+        without contacting the backend.
+
+        Slowly changing resources are also answered from the response cache
+        until their TTL has passed, if the handler has one.
+
+        A fresh GET of a cached resource is sent as conditional request if the
+        backend provided an ETag, an unchanged resource is then not transferred
+        again.
 
         :param resource: JSON resource to be consumed
+        :param fresh: bypass the caches and fetch the current state
+        :param persistent: use unexpired responses of the response cache
         :returns: json dict
         """
-        try:
-            resp = self.session.get(self.connection + resource,
-                                    headers=self.header).json()
-            self._check_authorization_success(resp)
-            return resp
-        except ConnectionError:
-            self._connection_error()
+        cached, etag = None, None
+        if self.cache is not None:
+            with self._lock:
+                cached = self.cache.get(resource)
+                etag = self.etags.get(resource)
+            if cached is not None and not fresh:
+                self._count(avoided=True)
+                return copy.deepcopy(cached)
+        stored = None
+        if cached is None and self.response_cache is not None:
+            stored = self.response_cache.load(self.connection, resource)
+            if stored is not None:
+                cached, etag, expired = stored
+                if persistent and not fresh and not expired:
+                    # not kept in the handler cache, where it would become
+                    # the base of writes without having been validated
+                    self._count(avoided=True)
+                    return cached
+        headers = self.header
+        if cached is not None and etag:
+            headers = dict(self.header, **{'If-None-Match': etag})
+        raw_resp = self._request('GET', resource, headers=headers)
+        if raw_resp.status_code == 304:
+            if stored is not None:
+                # revalidated, the entry is valid for another TTL
+                self.response_cache.store(self.connection, resource, cached,
+                                          etag)
+                self._remember(resource, cached, etag)
+            self._keep_snapshot(resource, cached, etag)
+            return copy.deepcopy(cached)
+        resp = self._json(raw_resp, 'GET', resource)
+        self._remember(resource, resp, raw_resp.headers.get('ETag'))
+        self._keep_snapshot(resource, resp, raw_resp.headers.get('ETag'))
+        if self.response_cache is not None:
+            self.response_cache.store(self.connection, resource, resp,
+                                      raw_resp.headers.get('ETag'))
+        return resp
 
     def put(self, resource, data):
         """
@@ -82,60 +553,119 @@ class SecureHandler:
         :param resource: JSON resource to be contacted
         :param data: dict
         """
-        try:
-            resp = self.session.put(self.connection + resource, data=data,
-                                    headers=self.header).json()
-            self._check_authorization_success(resp)
-            return resp
-        except ConnectionError:
-            self._connection_error()
+        resp = self._json(self._request('PUT', resource, data=data), 'PUT',
+                          resource)
+        self._written(resource, data)
+        return resp
 
-    def safe_put(self, resource, data):
+    def patch(self, resource, data):
         """
-        GETs the data before PUTing and updates the values of the returned
-        JSON dict. This is done in order to avoid resetting any values that have
-        not been passed.
+        PATCHes the resource. If an error is thrown the program is shut down.
 
         :param resource: JSON resource to be contacted
         :param data: dict
         """
-        try:
-            curr_data = self.get(resource)
-            for key, value in data.items():
-                curr_data[key] = value
+        resp = self._json(self._request('PATCH', resource, data=data), 'PATCH',
+                          resource)
+        self._written(resource, data)
+        return resp
 
-            self.put(resource, curr_data)
-        except ConnectionError:
-            self._connection_error()
+    def _written(self, resource, data):
+        """
+        Updates the caches after a successful write.
+        """
+        self._update_cache(resource, data)
+        with self._lock:
+            self.snapshots.pop(resource, None)
+        if self.response_cache is not None:
+            self.response_cache.invalidate(self.connection, resource)
 
-    def patch(self, resource, data):
+    def _conditional_write(self, method, resource, data):
         """
-        PATCHes the resource. If an error is thrown the program is shut down.
+        Merges the data into the last known state of the resource and writes
+        it with an `If-Match` precondition, so changes made by somebody else
+        in the meantime are never overwritten. The state is taken from
+        previous requests or program runs if possible, which makes the write a
+        single round trip. If the resource has changed since, it is read again
+        once and the write is retried.
 
+        Without a known state, or if the backend does not send ETags, the
+        resource is read before writing. States of previous program runs are
+        only used if the backend checks the precondition, which the first
+        write with such a state finds out with PRECONDITION_PROBE.
+
+        :param method: 'PUT' or 'PATCH'
         :param resource: JSON resource to be contacted
         :param data: dict
+        :returns: json dict
         """
-        try:
-            resp = self.session.patch(self.connection + resource, data=data,
-                                      headers=self.header).json()
-            self._check_authorization_success(resp)
-        except ConnectionError:
-            self._connection_error()
+        snapshot, probe = self._snapshot(resource)
+        if snapshot is not None:
+            self._count(avoided=True)
+        conflicts = 0
+        while True:
+            if snapshot is None:
+                # body and ETag have to come from the same validated
+                # response, a cached body may be older than its ETag
+                current = self.get(resource, fresh=True, persistent=False)
+                with self._lock:
+                    snapshot = self.snapshots.get(resource)
+                if snapshot is None:
+                    # the backend does not send ETags
+                    snapshot = current, None
+                else:
+                    snapshot = copy.deepcopy(snapshot[0]), snapshot[1]
+            body, etag = snapshot
+            body.update(data)
+            # the body has just been read, so a backend ignoring the never
+            # matching precondition of the probe writes the current state
+            probe = probe and etag
+            headers = self.header
+            if etag:
+                headers = dict(self.header, **{
+                    'If-Match': PRECONDITION_PROBE if probe else etag})
+            raw_resp = self._request(method, resource, headers=headers,
+                                     data=body)
+            if probe:
+                probe = False
+                checked = raw_resp.status_code == 412
+                self.response_cache.store_preconditions_checked(
+                    self.connection, checked)
+                if checked:
+                    # sent again with the actual ETag
+                    continue
+            if raw_resp.status_code != 412:
+                break
+            conflicts += 1
+            if conflicts == 2:
+                self._fail('{} has been changed by somebody else while '
+                           'writing, please try again.'.format(resource))
+            snapshot = None
+        resp = self._json(raw_resp, method, resource)
+        self._written(resource, data)
+        # a backend which sends ETags responds with the new state
+        etag = raw_resp.headers.get('ETag')
+        self._keep_snapshot(resource, resp if etag else body, etag,
+                            persist=True)
+        return resp
 
-    def safe_patch(self, resource, data):
+    def safe_put(self, resource, data):
         """
-        GETs the data before patching and updates the values of the returned
-        JSON dict. This is done in order to avoid resetting any values that have
-        not been passed.
+        PUTs the data merged into the current state of the resource, in order
+        to avoid resetting any values that have not been passed. See
+        `_conditional_write`.
 
         :param resource: JSON resource to be contacted
         :param data: dict
         """
-        try:
-            curr_data = self.get(resource)
-            for key, value in data.items():
-                curr_data[key] = value
+        return self._conditional_write('PUT', resource, data)
 
-            self.patch(resource, curr_data)
-        except ConnectionError:
-            self._connection_error()
+    def safe_patch(self, resource, data):
+        """
+        PATCHes the data merged into the current state of the resource, see
+        `safe_put`.
+
+        :param resource: JSON resource to be contacted
+        :param data: dict
+        """
+        return self._conditional_write('PATCH', resource, data)
@@ -3,7 +3,11 @@ from setuptools import setup
 setup(
     name='minerctl_cli',
     version='1.0',
-    py_modules=['cli'],
+    py_modules=['cli', 'secure_handler', 'fleet', 'token_cache', 'telemetry',
+                'instrumentation', 'agent', 'client',
+                'output', 'exporter', 'response_cache', 'miner_states',
+                'desired_state', 'rollout', 'transport', 'scheduler',
+                'errors'],
     install_requires=[
         'PyJWT==1.6.4',
         'requests==2.19.1',
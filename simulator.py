@@ -0,0 +1,274 @@
+import sys
+import gzip
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import jwt
+
+
+class BackendState:
+    """
+    In-memory stand-in for the microcontroller state served by the backend.
+    """
+    def __init__(self, miners=100, mode='gpu'):
+        """
+        :param miners: number of miner slots
+        :param mode: 'gpu' or 'asic'
+        """
+        self.lock = threading.Lock()
+        self.resources = {
+            '/info': {'firmware_version': '1.0-sim'},
+            '/temp': {'measurements': {'0': 24.5, '1': 25.0, '2': 26.1},
+                      'target': 25, 'sensor_id': 0, 'external': 22},
+            '/filter': {'pressure_diff': 410, 'threshold': 800,
+                        'status_ok': True},
+            '/fans': {'min_rpm': 20, 'max_rpm': 80, 'rpm': 45},
+            '/pid': {'proportional': 1, 'integral': 1, 'derivative': 1,
+                     'bias': 0},
+        }
+        if mode == 'gpu':
+            self.resources['/mode'] = {'active_mode': 'gpu', 'ontime': 500,
+                                       'offtime': 500}
+        else:
+            self.resources['/mode'] = {'active_mode': 'asic', 'restime': 500}
+        self.miners = [random.choice((True, False, None))
+                       for _ in range(miners)]
+        self.versions = {}
+        self.requests = 0
+        self.committed = 0
+
+    def etag(self, resource):
+        """
+        Computes a weak content hash of the resource for ETag headers.
+        """
+        body = json.dumps(self.snapshot(resource), sort_keys=True)
+        return '"{}"'.format(hashlib.sha1(body.encode()).hexdigest()[:16])
+
+    def snapshot(self, resource):
+        """
+        :returns: JSON-serializable copy of the resource
+        """
+        if resource == '/cfg':
+            return {'miners': list(self.miners)}
+        return dict(self.resources[resource])
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    """
+    Serves the backend endpoints consumed by the CLI and checks the JWT token
+    of every request like flask-jwt-extended does.
+    """
+    protocol_version = 'HTTP/1.1'
+    # smaller bodies are not worth compressing
+    gzip_min_size = 512
+    writable = {'/temp': ('target', 'sensor_id', 'external'),
+                '/filter': ('threshold',),
+                '/fans': ('min_rpm', 'max_rpm'),
+                '/pid': ('proportional', 'integral', 'derivative', 'bias')}
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body=None, etag=None):
+        payload = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        if (len(payload) >= self.gzip_min_size and
+                'gzip' in self.headers.get('Accept-Encoding', '')):
+            payload = gzip.compress(payload)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_form(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length).decode() if length else ''
+        return {key: values[-1] for key, values in parse_qs(raw).items()}
+
+    def _authorized(self):
+        header = self.headers.get('Authorization', '')
+        if not header.startswith('Bearer '):
+            self._send(401, {'msg': 'Missing Authorization Header'})
+            return False
+        try:
+            claims = jwt.decode(header[len('Bearer '):],
+                                self.server.public_key,
+                                algorithms=['RS256'])
+        except jwt.InvalidTokenError as err:
+            self._send(422, {'msg': str(err)})
+            return False
+        if 'identity' not in claims:
+            self._send(422, {'msg': 'Missing claim: identity'})
+            return False
+        return True
+
+    def _prepare(self):
+        """
+        Shared request preamble: counting, latency/failure injection and
+        authorization.
+
+        :returns: (path, query dict) or None if the request was answered
+        """
+        state = self.server.state
+        with state.lock:
+            state.requests += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.failure_rate and \
+                random.random() < self.server.failure_rate:
+            self._send(503, {'message': 'Injected failure'})
+            return None
+        if not self._authorized():
+            return None
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        return url.path, query
+
+    def do_GET(self):
+        prepared = self._prepare()
+        if prepared is None:
+            return
+        path, query = prepared
+        state = self.server.state
+        with state.lock:
+            if path == '/commit':
+                self._send(200, {'commit': False})
+                return
+            if path == '/miner':
+                miner_id = int(query.get('id', -1))
+                if not 0 <= miner_id < len(state.miners):
+                    self._send(404, {'message': 'Unknown miner'})
+                    return
+                self._send(200, {'running': state.miners[miner_id]})
+                return
+            if path != '/cfg' and path not in state.resources:
+                self._send(404, {'message': 'Unknown resource'})
+                return
+            etag = state.etag(path)
+            if self.headers.get('If-None-Match') == etag:
+                self._send(304, etag=etag)
+                return
+            self._send(200, state.snapshot(path), etag=etag)
+
+    def _write(self):
+        prepared = self._prepare()
+        if prepared is None:
+            return
+        path, query = prepared
+        state = self.server.state
+        form = self._read_form()
+        with state.lock:
+            if path == '/commit':
+                state.committed += 1
+                self._send(200, {'commit': True})
+                return
+            if path == '/miner':
+                miner_id = int(query.get('id', -1))
+                action = query.get('action')
+                if not 0 <= miner_id < len(state.miners):
+                    self._send(404, {'message': 'Unknown miner'})
+                    return
+                state.miners[miner_id] = {'on': True, 'register': True,
+                                          'off': False,
+                                          'deregister': None}[action]
+                self._send(200, {'running': state.miners[miner_id]})
+                return
+            if path not in self.writable:
+                self._send(405, {'message': 'Method not allowed'})
+                return
+            match = self.headers.get('If-Match')
+            if match and self.server.check_preconditions and \
+                    match != state.etag(path):
+                self._send(412, {'message': 'Precondition failed'})
+                return
+            for key in self.writable[path]:
+                if key in form:
+                    state.resources[path][key] = int(form[key])
+            self._send(200, state.snapshot(path), etag=state.etag(path))
+
+    do_PUT = _write
+    do_PATCH = _write
+
+
+def serve(public_key_location, port=12345, miners=100, mode='gpu',
+          latency=0.0, failure_rate=0.0, verbose=False, certfile=None,
+          keyfile=None, check_preconditions=True):
+    """
+    Creates (but does not start) the simulated backend server.
+
+    :param public_key_location: public key file used to verify the tokens
+    :param port: port on 127.0.0.1, 0 picks a free one
+    :param miners: number of miner slots
+    :param mode: 'gpu' or 'asic'
+    :param latency: seconds added to every request
+    :param failure_rate: share of requests answered with 503 (0 to 1)
+    :param verbose: log every request to stderr
+    :param certfile: PEM certificate, serves HTTPS if given
+    :param keyfile: PEM private key of the certificate
+    :param check_preconditions: reject writes with an outdated If-Match
+    header, disabled to simulate a backend ignoring it
+    :returns: ThreadingHTTPServer, call serve_forever() on it
+    """
+    with open(public_key_location, 'rb') as file:
+        public_key = file.read()
+    server = ThreadingHTTPServer(('127.0.0.1', port), SimulatorHandler)
+    server.daemon_threads = True
+    if certfile:
+        import ssl
+
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    server.public_key = public_key
+    server.state = BackendState(miners, mode)
+    server.latency = latency
+    server.failure_rate = failure_rate
+    server.verbose = verbose
+    server.check_preconditions = check_preconditions
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='simulated minerctl backend '
+                                     'for tests and benchmarks')
+    parser.add_argument('--public-key', help='public key file of the CLI '
+                        'key pair', required=True, metavar='<path>')
+    parser.add_argument('--port', help='listening port (default: 12345)',
+                        type=int, default=12345)
+    parser.add_argument('--miners', help='number of miners (default: 100)',
+                        type=int, default=100)
+    parser.add_argument('--mode', help='mining mode (default: gpu)',
+                        choices=('gpu', 'asic'), default='gpu')
+    parser.add_argument('--latency', help='seconds added to every request',
+                        type=float, default=0.0)
+    parser.add_argument('--failure-rate', help='share of requests answered '
+                        'with 503, eg 0.1', type=float, default=0.0)
+    parser.add_argument('--verbose', help='log every request',
+                        action='store_true')
+    parser.add_argument('--certfile', help='PEM certificate, serves HTTPS',
+                        metavar='<path>')
+    parser.add_argument('--keyfile', help='PEM private key of the '
+                        'certificate', metavar='<path>')
+    parser.add_argument('--ignore-if-match', help='accept writes with an '
+                        'outdated If-Match header', action='store_true')
+    args = parser.parse_args()
+    server = serve(args.public_key, args.port, args.miners, args.mode,
+                   args.latency, args.failure_rate, args.verbose,
+                   args.certfile, args.keyfile, not args.ignore_if_match)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
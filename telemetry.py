@@ -0,0 +1,251 @@
+import os
+import math
+import mmap
+import struct
+from array import array
+from miner_states import MinerStates
+
+SENSOR_SLOTS = 8
+# column name, array typecode; every column is stored contiguously, so a
+# single metric can be scanned without touching the others
+FIELDS = ((('time', 'd'),) +
+          tuple(('temp_{}'.format(i), 'f') for i in range(SENSOR_SLOTS)) +
+          (('target', 'f'), ('pressure_diff', 'f'), ('threshold', 'f'),
+           ('rpm', 'f'), ('miners_on', 'I'), ('miners_off', 'I'),
+           ('miners_disabled', 'I')))
+MAGIC = b'MCTLRING'
+VERSION = 1
+# magic, version, field count, capacity, number of samples ever written
+HEADER = struct.Struct('<8sIIQQ')
+HEADER_SIZE = 64
+HISTOGRAM_BINS = 1024
+DEFAULT_CAPACITY = 1000000
+
+
+class RingBufferError(Exception):
+    """
+    Raised if the ring buffer file cannot be used.
+    """
+
+
+def sample_from_resources(temp, filter, fans, cfg, timestamp):
+    """
+    Converts the resources returned by the backend into a ring buffer sample.
+
+    :param temp: json dict of /temp
+    :param filter: json dict of /filter
+    :param fans: json dict of /fans
+    :param cfg: json dict of /cfg
+    :param timestamp: unix time of the sample
+    :returns: dict with field: value, missing sensors and sensors without a
+    measurement (None) are NaN
+    """
+    sample = {'temp_{}'.format(i): math.nan for i in range(SENSOR_SLOTS)}
+    for key, value in temp['measurements'].items():
+        if 0 <= int(key) < SENSOR_SLOTS and value is not None:
+            sample['temp_{}'.format(int(key))] = value
+    miners = MinerStates.from_list(cfg['miners']).summary()
+    sample.update({'time': timestamp, 'target': temp['target'],
+                   'pressure_diff': filter['pressure_diff'],
+                   'threshold': filter['threshold'], 'rpm': fans['rpm'],
+                   'miners_on': miners['on'], 'miners_off': miners['off'],
+                   'miners_disabled': miners['disabled']})
+    return sample
+
+
+class RingBuffer:
+    """
+    Fixed-size, memory-mapped ring buffer of telemetry samples. The file
+    consists of a small header followed by one typed column per field. Once
+    the capacity is reached the oldest samples are overwritten.
+    """
+    def __init__(self, location, capacity=None, writable=False):
+        """
+        Opens the ring buffer file, which is created if it does not exist and
+        the buffer is opened for writing.
+
+        :param location: file path
+        :param capacity: number of samples of a new file (default:
+        DEFAULT_CAPACITY), must match the capacity of an existing file if given
+        :param writable: open the file for appending samples
+        """
+        if not os.path.exists(location):
+            if not writable:
+                raise RingBufferError('No samples have been recorded yet.')
+            self._create(location, capacity or DEFAULT_CAPACITY)
+        self._file = open(location, 'r+b' if writable else 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0,
+                              access=mmap.ACCESS_WRITE if writable
+                              else mmap.ACCESS_READ)
+        magic, version, field_count, self.capacity, _ = \
+            HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION or field_count != len(FIELDS):
+            self.close()
+            raise RingBufferError('{} is not a compatible ring buffer file.'
+                                  .format(location))
+        if capacity and capacity != self.capacity:
+            self.close()
+            raise RingBufferError('The ring buffer has a capacity of {} '
+                                  'samples, remove {} to change it.'
+                                  .format(self.capacity, location))
+        self.columns = {}
+        offset = HEADER_SIZE
+        for name, typecode in FIELDS:
+            size = self.capacity * array(typecode).itemsize
+            self.columns[name] = memoryview(self._map)[offset:offset + size] \
+                .cast(typecode)
+            offset += _align(size)
+
+    @staticmethod
+    def _create(location, capacity):
+        """
+        Creates a new, empty ring buffer file.
+
+        :param location: file path
+        :param capacity: number of samples
+        """
+        size = HEADER_SIZE + sum(_align(capacity * array(typecode).itemsize)
+                                 for _, typecode in FIELDS)
+        with open(location, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, VERSION, len(FIELDS), capacity, 0))
+            file.truncate(size)
+
+    @property
+    def written(self):
+        """
+        :returns: number of samples ever appended
+        """
+        return HEADER.unpack_from(self._map)[4]
+
+    def __len__(self):
+        return min(self.written, self.capacity)
+
+    def append(self, sample):
+        """
+        Stores a sample. The sample counter in the header is only updated
+        after all the columns have been written.
+
+        :param sample: dict with field: value, see `sample_from_resources`
+        """
+        written = self.written
+        index = written % self.capacity
+        for name, _ in FIELDS:
+            self.columns[name][index] = sample[name]
+        struct.pack_into('<Q', self._map, HEADER.size - 8, written + 1)
+
+    def _segments(self, since=None):
+        """
+        Translates the samples not older than `since` into ranges of column
+        indices, oldest first. The timestamps are ordered in logical order,
+        so the start of the window is found with a binary search.
+
+        :param since: unix time or None for all samples
+        :returns: list of (start, stop) index tuples
+        """
+        count = len(self)
+        oldest = self.written % self.capacity if self.written > \
+            self.capacity else 0
+        times = self.columns['time']
+        low, high = 0, count
+        while since is not None and low < high:
+            middle = (low + high) // 2
+            if times[(oldest + middle) % self.capacity] < since:
+                low = middle + 1
+            else:
+                high = middle
+        start = oldest + low
+        stop = oldest + count
+        if stop <= self.capacity:
+            return [(start, stop)] if start < stop else []
+        if start >= self.capacity:
+            return [(start - self.capacity, stop - self.capacity)]
+        return [(start, self.capacity), (0, stop - self.capacity)]
+
+    def _values(self, name, segments):
+        """
+        Iterates over the values of a column in the given index ranges, NaN
+        values are skipped.
+        """
+        column = self.columns[name]
+        for start, stop in segments:
+            for value in column[start:stop]:
+                if value == value:
+                    yield value
+
+    def stats(self, name, since=None, percentiles=(50, 90, 99)):
+        """
+        Computes summary statistics of a field straight from the mapped
+        columns. Percentiles are exact: a histogram pass finds the bin of
+        every requested rank and only the values of these bins are sorted.
+
+        :param name: field name
+        :param since: unix time of the window start or None for all samples
+        :param percentiles: requested percentiles
+        :returns: dict with count, min, max, mean and one entry per
+        percentile (eg 'p90'), None if there are no values
+        """
+        segments = self._segments(since)
+        count, total = 0, 0.0
+        minimum, maximum = math.inf, -math.inf
+        for value in self._values(name, segments):
+            count += 1
+            total += value
+            if value < minimum:
+                minimum = value
+            if value > maximum:
+                maximum = value
+        if not count:
+            return None
+        result = {'count': count, 'min': minimum, 'max': maximum,
+                  'mean': total / count}
+        ranks = {p: min(max(math.ceil(p / 100 * count) - 1, 0), count - 1)
+                 for p in percentiles}
+        if minimum == maximum:
+            result.update({'p{}'.format(p): minimum for p in percentiles})
+            return result
+
+        width = (maximum - minimum) / HISTOGRAM_BINS
+        histogram = array('Q', bytes(8 * HISTOGRAM_BINS))
+        for value in self._values(name, segments):
+            histogram[min(int((value - minimum) / width),
+                          HISTOGRAM_BINS - 1)] += 1
+        # bin of every rank and the rank within that bin
+        targets = {}
+        for p, rank in ranks.items():
+            seen = 0
+            for index, amount in enumerate(histogram):
+                if seen + amount > rank:
+                    targets[p] = (index, rank - seen)
+                    break
+                seen += amount
+        members = {index: array('d') for index, _ in targets.values()}
+        for value in self._values(name, segments):
+            index = min(int((value - minimum) / width), HISTOGRAM_BINS - 1)
+            if index in members:
+                members[index].append(value)
+        for p, (index, offset) in targets.items():
+            result['p{}'.format(p)] = sorted(members[index])[offset]
+        return result
+
+    def close(self):
+        """
+        Releases the column views and unmaps the file.
+        """
+        for column in getattr(self, 'columns', {}).values():
+            column.release()
+        self.columns = {}
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _align(size):
+    """
+    :returns: size rounded up to a multiple of 8 bytes
+    """
+    return (size + 7) // 8 * 8
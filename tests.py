@@ -1,6 +1,11 @@
+import os
 import pytest
+import contextlib
 import subprocess
 import random
+import re
+import signal
+import sys
 
 
 def _test(*args):
@@ -21,9 +26,111 @@ def test_no_arg_help():
     assert result.returncode == 1
     assert _in(result.stdout, 'help', 'usage: minerctl')
 
-@pytest.fixture(scope="module")
-def setup():
-    _test('-b', '127.0.0.1:12345', '-k', 'testing/jwtRS256.key')
+@pytest.fixture(scope="session", autouse=True)
+def backend(tmp_path_factory):
+    """
+    Starts a simulated backend on a free port with a new key pair and
+    configures minerctl for it in a temporary home directory, so the tests
+    neither need a real backend nor touch the configuration of the user.
+
+    :returns: address of the backend, eg 127.0.0.1:40123
+    """
+    import threading
+    import benchmark
+    import simulator
+
+    home = str(tmp_path_factory.mktemp('home'))
+    private_key, public_key = benchmark._create_key_pair(home)
+    # 101 miners, the tests pick random IDs from 0 to 100
+    server = simulator.serve(public_key, port=0, miners=101)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    address = '127.0.0.1:{}'.format(server.server_address[1])
+    previous_home = os.environ.get('HOME')
+    os.environ['HOME'] = home
+    try:
+        _test('-b', address, '-k', private_key)
+        yield address
+    finally:
+        server.shutdown()
+        server.server_close()
+        if previous_home is None:
+            del os.environ['HOME']
+        else:
+            os.environ['HOME'] = previous_home
+
+@pytest.fixture(scope="session")
+def https_backend(backend, tmp_path_factory):
+    """
+    Starts a simulated HTTPS backend with a new self-signed certificate for
+    127.0.0.1, accepting the tokens of the `backend` key pair.
+
+    :returns: (address, certificate path, SHA-256 fingerprint)
+    """
+    import datetime
+    import ipaddress
+    import threading
+    import simulator
+    from cryptography import x509
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    folder = str(tmp_path_factory.mktemp('tls'))
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048,
+                                   backend=default_backend())
+    name = x509.Name([x509.NameAttribute(x509.NameOID.COMMON_NAME,
+                                         '127.0.0.1')])
+    now = datetime.datetime.utcnow()
+    cert = x509.CertificateBuilder().subject_name(name).issuer_name(name) \
+        .public_key(key.public_key()).serial_number(x509.random_serial_number()) \
+        .not_valid_before(now - datetime.timedelta(days=1)) \
+        .not_valid_after(now + datetime.timedelta(days=1)) \
+        .add_extension(x509.SubjectAlternativeName(
+            [x509.IPAddress(ipaddress.ip_address('127.0.0.1'))]), False) \
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), True) \
+        .sign(key, hashes.SHA256(), default_backend())
+    cert_file = os.path.join(folder, 'tls.crt')
+    key_file = os.path.join(folder, 'tls.key')
+    with open(cert_file, 'wb') as file:
+        file.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_file, 'wb') as file:
+        file.write(key.private_bytes(serialization.Encoding.PEM,
+                                     serialization.PrivateFormat.PKCS8,
+                                     serialization.NoEncryption()))
+    public_key = os.path.join(os.path.expanduser('~'), 'jwtRS256.key.pub')
+    server = simulator.serve(public_key, port=0, certfile=cert_file,
+                             keyfile=key_file)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield ('127.0.0.1:{}'.format(server.server_address[1]), cert_file,
+               cert.fingerprint(hashes.SHA256()).hex())
+    finally:
+        server.shutdown()
+        server.server_close()
+
+@contextlib.contextmanager
+def _config(section, **options):
+    """
+    Sets options of the config file, the previous config is restored
+    afterwards (including backends set with `-b` in the meantime).
+    """
+    import configparser
+    config_file = os.path.join(os.path.expanduser('~'), '.minerctl',
+                               'config.ini')
+    with open(config_file) as file:
+        original = file.read()
+    config = configparser.ConfigParser()
+    config.read_string(original)
+    if not config.has_section(section):
+        config.add_section(section)
+    config[section].update(options)
+    with open(config_file, 'w') as file:
+        config.write(file)
+    try:
+        yield
+    finally:
+        with open(config_file, 'w') as file:
+            file.write(original)
 
 def test_temp():
     for param in ('-t', '--temp'):
@@ -91,6 +198,13 @@ def test_summary():
                    'Disabled miners')
         assert not _in(result.stdout, 'None')
 
+def test_summary_ranges():
+    assert _test('set', '--miner', '0-9', 'on').returncode == 0
+    result = _test('-s')
+    assert result.returncode == 0
+    match = re.search(r'Miners turned on: #0-#(\d+)', result.stdout)
+    assert match and int(match.group(1)) >= 9
+
 def test_query():
     for param in ('-q', '--query'):
         rand_id = str(random.randint(0, 100))
@@ -194,6 +308,12 @@ def test_set_miner_unsupported_action():
     assert _in(result.stdout, 'help', 'usage: minerctl',
                'Invalid miner action!')
 
+def test_set_miner_invalid_workers():
+    result = _test('set', '--miner', '0-3', 'on', '--workers', '-1')
+    assert result.returncode == 2
+    result = _test('--fleet', 'all', '--fleet-workers', '0', '-t')
+    assert result.returncode == 2
+
 def test_set_proportional():
     rand = str(random.randint(0, 10))
     _test('set', '--proportional', rand)
@@ -233,3 +353,566 @@ def test_set_bias():
         assert _in(result.stdout, 'bias: {}'.format(rand),
                    'integral', 'derivative', 'proportional')
         assert not _in(result.stdout, 'None')
+
+def test_time_saved():
+    result = _test('-t', '-f', '-v', '--time-saved')
+    assert result.returncode == 0
+    assert _in(result.stdout, 'Measurements', 'Differential pressure',
+               'Current RPM', 'Fetched 3 resources', 'saved')
+    assert not _in(result.stdout, 'None')
+
+def test_fleet(backend):
+    _test('--add-backend', 'local', backend)
+    _test('--add-group', 'testing', 'local')
+    result = _test('--fleet', 'testing', '-t', '-m')
+    assert result.returncode == 0
+    assert _in(result.stdout, '== local', 'Measurements', 'Miner states',
+               'Fleet testing: 1 backends, 1 ok, 0 failed', 'total')
+    assert not _in(result.stdout, 'None')
+
+def test_fleet_rollout(backend):
+    _test('--add-backend', 'local', backend)
+    _test('--add-backend', 'unreachable', '127.0.0.1:1')
+    _test('--add-group', 'rollout', 'local,local,unreachable,local')
+    target = str(random.randint(0, 50))
+    result = _test('--fleet', 'rollout', 'set', '--target', target)
+    assert result.returncode == 1
+    assert _in(result.stdout, 'Wave 1 (canary): 1 backends',
+               'ok, write', 'verified', 'Wave 2: 2 backends',
+               'Rollout stopped', '1 backends not contacted',
+               'Rollout to rollout: 2 updated, 1 failed, 1 skipped')
+    assert not _in(result.stdout, 'Wave 3')
+    result = _test('-t')
+    assert _in(result.stdout, 'Target temperature: {}'.format(target))
+
+def test_fleet_unknown_group():
+    result = _test('--fleet', 'HELLO', '-t')
+    assert result.returncode == 1
+    assert _in(result.stdout, 'Could not find group HELLO')
+
+def test_debug_request_counter():
+    result = _test('--debug', '-t', 'set', '--target', '25')
+    assert result.returncode == 0
+    assert _in(result.stdout, 'Requests issued: 2, requests avoided: 1')
+
+def test_set_coalesced():
+    target, sensor_id, external = (str(random.randint(0, 50)),
+                                   str(random.randint(0, 3)),
+                                   str(random.randint(0, 50)))
+    result = _test('--no-cache', 'set', '--target', target, '--sensor_id',
+                   sensor_id, '--external', external)
+    assert result.returncode == 0
+    assert _in(result.stdout, 'Updated /temp in 2 round trips')
+    result = _test('-t')
+    assert _in(result.stdout, 'Target temperature: {}'.format(target),
+               'Main sensor id: #{}'.format(sensor_id),
+               'External reference temperature: {}'.format(external))
+
+def test_set_conditional():
+    cache_file = os.path.join(os.path.expanduser('~'), '.minerctl',
+                              'responses.sqlite')
+    if os.path.exists(cache_file):
+        os.remove(cache_file)
+    result = _test('set', '--target', str(random.randint(0, 50)))
+    assert _in(result.stdout, 'Updated /temp in 2 round trips')
+    # the first write based on a stored state finds out whether the backend
+    # checks If-Match
+    result = _test('set', '--target', str(random.randint(0, 50)))
+    assert _in(result.stdout, 'Updated /temp in 3 round trips')
+    result = _test('set', '--target', str(random.randint(0, 50)))
+    assert _in(result.stdout, 'Updated /temp in 1 round trips')
+    # a change by somebody else is detected and preserved
+    external = str(random.randint(0, 50))
+    _test('--no-cache', 'set', '--external', external)
+    target = str(random.randint(0, 50))
+    result = _test('set', '--target', target)
+    assert result.returncode == 0
+    assert _in(result.stdout, 'Updated /temp in 3 round trips')
+    result = _test('-t')
+    assert _in(result.stdout, 'Target temperature: {}'.format(target),
+               'External reference temperature: {}'.format(external))
+
+def test_set_ignored_precondition(backend):
+    import threading
+    import simulator
+    # the state of a previous run must not be used as write base if the
+    # backend does not check If-Match
+    public_key = os.path.join(os.path.expanduser('~'), 'jwtRS256.key.pub')
+    server = simulator.serve(public_key, port=0, check_preconditions=False)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    _test('-b', '127.0.0.1:{}'.format(server.server_address[1]))
+    try:
+        _test('set', '--target', str(random.randint(0, 50)))
+        external = str(random.randint(0, 50))
+        _test('--no-cache', 'set', '--external', external)
+        result = _test('set', '--target', str(random.randint(0, 50)))
+        assert _in(result.stdout, 'Updated /temp in 2 round trips')
+        result = _test('-t')
+    finally:
+        _test('-b', backend)
+        server.shutdown()
+        server.server_close()
+    assert _in(result.stdout,
+               'External reference temperature: {}'.format(external))
+
+def test_set_after_cached_read():
+    # without a write snapshot the write base has to be read fresh, not
+    # taken from the response cache
+    cache_file = os.path.join(os.path.expanduser('~'), '.minerctl',
+                              'responses.sqlite')
+    if os.path.exists(cache_file):
+        os.remove(cache_file)
+    _test('-p')
+    proportional = str(random.randint(0, 50))
+    _test('--no-cache', 'set', '--proportional', proportional)
+    bias = str(random.randint(0, 50))
+    result = _test('-p', 'set', '--bias', bias)
+    assert result.returncode == 0
+    result = _test('--no-cache', '-p')
+    assert _in(result.stdout, 'proportional: {},'.format(proportional),
+               'bias: {}'.format(bias))
+
+def test_plan_apply(tmpdir):
+    target = str(random.randint(0, 50))
+    state_file = tmpdir.join('state.ini')
+    state_file.write('[temp]\ntarget = {}\n[pid]\nbias = 3\n'
+                     '[miners]\non = 0-4\n'.format(target))
+    result = _test('apply', str(state_file))
+    assert result.returncode == 0
+    assert _in(result.stdout, 'miner actions, 1 commit') or _in(
+        result.stdout, 'No changes')
+    result = _test('plan', str(state_file))
+    assert result.returncode == 0
+    assert _in(result.stdout, 'No changes, the backend is in the desired '
+               'state')
+    result = _test('-t', '-s')
+    assert _in(result.stdout, 'Target temperature: {}'.format(target),
+               'Miners turned on: #0-#')
+
+def test_plan_fleet(tmpdir, backend):
+    state_file = tmpdir.join('state.json')
+    state_file.write('{"fans": {"max_rpm": 1000}, '
+                     '"miners": {"off": "0-9"}}')
+    _test('--add-backend', 'local', backend)
+    _test('--add-group', 'testing', 'local')
+    result = _test('--fleet', 'testing', 'plan', str(state_file))
+    assert result.returncode == 0
+    assert _in(result.stdout, '== local', '/fans: max_rpm',
+               '-> 1000', 'Fleet testing: 1 backends, 1 to change')
+
+def test_plan_invalid_file(tmpdir):
+    state_file = tmpdir.join('state.json')
+    state_file.write('{"temp": {"HELLO": 1}}')
+    result = _test('plan', str(state_file))
+    assert result.returncode == 1
+    assert _in(result.stdout, 'Unknown setting temp.HELLO')
+    # the same ID ranges as on the command line
+    state_file.write('{"miners": {"on": "5-2"}}')
+    result = _test('plan', str(state_file))
+    assert result.returncode == 1
+    assert _in(result.stdout, 'miners.on: Miner ID range 5-2 is invalid!')
+
+def test_https_address(backend):
+    _test('-b', 'https://' + backend)
+    try:
+        # the test backend does not speak TLS
+        result = _test('--no-agent', '-t')
+    finally:
+        _test('-b', backend)
+    assert result.returncode == 1
+    assert _in(result.stdout, 'TLS connection to https://' + backend)
+
+def test_https_ca_file(https_backend):
+    address, cert_file, _ = https_backend
+    with _config('TLS', ca_file=cert_file):
+        _test('-b', 'https://' + address)
+        result = _test('--no-agent', '-t', '-f', '--timings')
+    assert result.returncode == 0
+    assert _in(result.stdout, 'Measurements', 'Differential pressure',
+               'TLS handshakes', 'resumed sessions')
+
+def test_https_fingerprint(https_backend):
+    address, _, fingerprint = https_backend
+    with _config('TLS', fingerprint=fingerprint):
+        _test('-b', 'https://' + address)
+        result = _test('--no-agent', '-t')
+    assert result.returncode == 0
+    assert _in(result.stdout, 'Measurements')
+    # a different certificate is rejected
+    with _config('TLS', fingerprint='00' * 32):
+        _test('-b', 'https://' + address)
+        result = _test('--no-agent', '-t')
+    assert result.returncode == 1
+
+def test_unreachable_reported_once(backend):
+    _test('-b', '127.0.0.1:1')
+    try:
+        result = _test('--no-agent', '-a')
+    finally:
+        _test('-b', backend)
+    assert result.returncode == 1
+    assert result.stdout.count('could not be established') == 1
+    assert not _in(result.stdout, 'in a row')
+
+def test_token_cache():
+    _test('--token-lifetime', '60')
+    for _ in range(2):
+        result = _test('-t')
+        assert result.returncode == 0
+        assert _in(result.stdout, 'Measurements')
+    token_file = os.path.join(os.path.expanduser('~'), '.minerctl',
+                              'tokens.json')
+    assert os.stat(token_file).st_mode & 0o777 == 0o600
+
+def test_startup_profile():
+    result = _test('-t', '--startup-profile')
+    assert result.returncode == 0
+    assert _in(result.stdout, 'Measurements', 'Startup profile',
+               'cli module imports', 'secure_handler import', 'total')
+
+def test_set_miner_range():
+    start = random.randint(0, 90)
+    spec = '{}-{},{}'.format(start, start + 4, start + 9)
+    result = _test('set', '--miner', spec, 'off', '--workers', '2',
+                   '--stagger', '5')
+    assert result.returncode == 0
+    assert _in(result.stdout, 'Sent off to 6 miners', '0 failed',
+               *('Miner #{}: off'.format(i) for i in range(start, start + 5)))
+    for miner_id in (start, start + 9):
+        result = _test('-q', str(miner_id))
+        assert _in(result.stdout, 'Miner #{} state: off'.format(miner_id))
+
+def test_set_miner_invalid_range():
+    result = _test('set', '--miner', '5-2', 'on')
+    assert result.returncode == 1
+    assert _in(result.stdout, 'Miner ID range 5-2 is invalid!')
+
+def test_set_miner_negative_id():
+    result = _test('set', '--miner', '-3', 'on')
+    assert result.returncode == 1
+    assert _in(result.stdout, 'Miner ID -3 is invalid!')
+
+def test_query_list():
+    for spec, count in (('0-2,5', 4), ('0-19', 20)):
+        result = _test('-q', spec)
+        assert result.returncode == 0
+        assert result.stdout.count('state:') == count
+        assert _in(result.stdout, 'Miner #0 state:', 'Miner #2 state:')
+        assert not _in(result.stdout, 'None')
+
+def test_watch():
+    result = _test('watch', '-n', '0.1', '--count', '2', 'temp', 'fans')
+    assert result.returncode == 0
+    assert _in(result.stdout, 'poll #1', 'poll #2', 'Target temperature',
+               'Current RPM', 'ms')
+    assert not _in(result.stdout, 'None', 'failed')
+
+def test_watch_adaptive():
+    result = _test('watch', '-n', '0.1', '--count', '6', '--adaptive',
+                   '--budget', '6000', 'temp', 'filter')
+    assert result.returncode == 0
+    assert _in(result.stdout, 'poll #1 (/temp, /filter)', 'poll #6',
+               'Effective request rate:', 'requests/min', 'budget 6000/min',
+               'Intervals: /temp')
+    assert not _in(result.stdout, 'failed')
+
+def test_record_adaptive(tmpdir):
+    ring_file = str(tmpdir.join('telemetry.ring'))
+    result = _test('record', '-n', '0.1', '--count', '4', '--adaptive',
+                   '--file', ring_file)
+    assert result.returncode == 0
+    assert _in(result.stdout, 'sample #1 recorded', 'sample #4 recorded',
+               'Effective request rate:', '/cfg')
+
+def test_scheduler():
+    import scheduler
+    now = [0.0]
+    schedule = scheduler.Scheduler(['/filter', '/mode'], 1, 16,
+                                   clock=lambda: now[0])
+    assert schedule.due() == ['/filter', '/mode']
+    schedule.update('/filter', {'pressure_diff': 400, 'threshold': 800})
+    schedule.update('/mode', {'active_mode': 'gpu'})
+    # without a movement towards the limit both back off
+    assert schedule.intervals() == {'/filter': 2, '/mode': 2}
+    assert schedule.due() == []
+    now[0] += 2
+    assert schedule.due() == ['/filter', '/mode']
+    # 45% headroom left, moving by 2.5% of the limit per second: a quarter
+    # of the 18s until the limit is reached
+    schedule.update('/filter', {'pressure_diff': 440, 'threshold': 800})
+    assert schedule.intervals()['/filter'] == 4.5
+    # near the limit the shortest interval is used
+    now[0] += 1
+    schedule.update('/filter', {'pressure_diff': 750, 'threshold': 800})
+    assert schedule.intervals()['/filter'] == 1
+    # unchanged resources back off up to the longest interval
+    for _ in range(4):
+        now[0] += 1
+        schedule.update('/mode', {'active_mode': 'gpu'})
+    assert schedule.intervals()['/mode'] == 16
+
+def test_poll_loop_adaptive(monkeypatch):
+    import cli
+    import scheduler
+    now = [0.0]
+
+    def sleep(seconds):
+        # wakes up before the resource is due
+        now[0] += 0.4
+    monkeypatch.setattr(cli.time, 'sleep', sleep)
+    schedule = scheduler.Scheduler(['/filter'], 1, 1, clock=lambda: now[0])
+    polled = []
+    cli._poll_loop(1, 3, lambda number: polled.append(schedule.due()),
+                   schedule)
+    # every counted poll requests a resource
+    assert polled == [['/filter']] * 3
+
+def test_scheduler_budget():
+    import scheduler
+    now = [0.0]
+    schedule = scheduler.Scheduler(['/temp', '/filter', '/fans', '/mode'], 1,
+                                   16, budget=2, clock=lambda: now[0])
+    # 4 resources every second exceed 2 requests per second
+    assert schedule.stretch() == 2
+    assert set(schedule.intervals().values()) == {2}
+    schedule.due()
+    now[0] += 1
+    assert schedule.delay() == 1
+    assert schedule.due() == []
+    now[0] += 1
+    assert len(schedule.due()) == 4
+    assert schedule.rate() == 4
+
+def test_record_and_stats():
+    result = _test('record', '-n', '0', '--count', '3')
+    assert result.returncode == 0
+    assert _in(result.stdout, 'sample #1 recorded', 'sample #3 recorded')
+    result = _test('stats', '-w', '1h', '--fields', 'pressure_diff,rpm')
+    assert result.returncode == 0
+    assert _in(result.stdout, 'samples stored', 'p99', 'pressure_diff', 'rpm')
+    assert not _in(result.stdout, 'temp_0')
+
+def test_record_invalid_capacity(tmpdir):
+    result = _test('record', '--capacity', '-5', '--count', '1', '--file',
+                   str(tmpdir.join('telemetry.ring')))
+    assert result.returncode == 2
+
+def test_sample_missing_measurement():
+    import math
+    import telemetry
+    sample = telemetry.sample_from_resources(
+        {'measurements': {'0': 24.5, '1': None}, 'target': 25},
+        {'pressure_diff': 410, 'threshold': 800}, {'rpm': 45},
+        {'miners': [True, False, None]}, 0)
+    assert sample['temp_0'] == 24.5
+    assert math.isnan(sample['temp_1'])
+
+def test_stats_invalid_window():
+    result = _test('stats', '-w', 'HELLO')
+    assert result.returncode == 1
+    assert _in(result.stdout, 'HELLO is not a valid duration')
+
+def test_timings():
+    result = _test('-t', '-f', '--timings')
+    assert result.returncode == 0
+    assert _in(result.stdout, 'Request timings:', 'GET', '/temp', '/filter',
+               'json decode', '2 requests')
+
+def test_metrics_json():
+    result = subprocess.run(['minerctl', '-t'], universal_newlines=True,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            env=dict(os.environ, MINERCTL_METRICS='json'))
+    assert result.returncode == 0
+    assert _in(result.stderr, '"requests"', '"ttfb"', '"/temp"')
+    assert not _in(result.stdout, 'Request timings:')
+
+def test_profile(tmpdir):
+    location = str(tmpdir.join('minerctl.prof'))
+    result = _test('-t', '--profile', location)
+    assert result.returncode == 0
+    assert os.path.getsize(location) > 0
+
+def test_agent():
+    agent = subprocess.Popen(['minerctl', 'agent'], universal_newlines=True,
+                             stdout=subprocess.PIPE)
+    try:
+        assert _in(agent.stdout.readline(), 'Agent listening on')
+        for _ in range(2):
+            result = _test('-t', '-f', '--debug')
+            assert result.returncode == 0
+            assert _in(result.stdout, 'Measurements', 'Differential pressure',
+                       'Requests issued: 2')
+        result = _test('-t', '--no-agent', '--debug')
+        assert result.returncode == 0
+        # the agent has no response cache to bypass
+        result = _test('-t', '--no-cache')
+        assert result.returncode == 0
+        # forwarded calls only need the standard library
+        result = subprocess.run(
+            [sys.executable, '-c', 'import sys, cli; '
+             'sys.argv = ["minerctl", "-t"]; cli.main(); '
+             'print("requests loaded:", "requests" in sys.modules)'],
+            universal_newlines=True, stdout=subprocess.PIPE)
+        assert _in(result.stdout, 'Measurements', 'requests loaded: False')
+    finally:
+        agent.terminate()
+    assert _in(agent.communicate()[0], 'Agent stopped after 5 requests')
+
+def test_agent_round_trips():
+    agent = subprocess.Popen(['minerctl', 'agent'], universal_newlines=True,
+                             stdout=subprocess.PIPE)
+    try:
+        assert _in(agent.stdout.readline(), 'Agent listening on')
+        # the new agent knows no state of /temp, so it reads before writing
+        result = _test('set', '--external', str(random.randint(0, 50)))
+        assert _in(result.stdout, 'Updated /temp in 2 round trips')
+    finally:
+        agent.terminate()
+        agent.communicate()
+
+def test_agent_stalled():
+    agent = subprocess.Popen(['minerctl', 'agent'], universal_newlines=True,
+                             stdout=subprocess.PIPE)
+    try:
+        assert _in(agent.stdout.readline(), 'Agent listening on')
+        agent.send_signal(signal.SIGSTOP)
+        try:
+            result = subprocess.run(['minerctl', '-t'],
+                                    universal_newlines=True,
+                                    stdout=subprocess.PIPE, timeout=10)
+        finally:
+            agent.send_signal(signal.SIGCONT)
+        assert result.returncode == 0
+        assert _in(result.stdout, 'Measurements')
+    finally:
+        agent.terminate()
+        agent.communicate()
+
+def test_shell():
+    result = subprocess.run(['minerctl', 'shell'], universal_newlines=True,
+                            stdout=subprocess.PIPE,
+                            input='-t\n-t\nrefresh\n-t\nset --target 25\n'
+                                  '--fleet all -t\nexit\n')
+    assert result.returncode == 0
+    assert result.stdout.count('Target temperature') == 3
+    assert result.stdout.count('1 requests]') == 3
+    assert _in(result.stdout, '0 requests]', 'Cached data dropped',
+               'Updated /temp', 'Only the read options')
+
+def test_shell_deadline():
+    import time
+    with _config('Connection', deadline='1'):
+        shell = subprocess.Popen(['minerctl', '--no-agent', 'shell'],
+                                 universal_newlines=True,
+                                 stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        shell.stdin.write('-t\n')
+        shell.stdin.flush()
+        time.sleep(1.5)
+        output = shell.communicate('refresh\n-t\nexit\n')[0]
+    assert shell.returncode == 0
+    assert output.count('Target temperature') == 2
+    assert not _in(output, 'deadline')
+
+def test_client():
+    import asyncio
+    import configparser
+    from client import Client, AsyncClient, BackendError, BackendUnavailable
+    config = configparser.ConfigParser()
+    config.read(os.path.expanduser('~/.minerctl/config.ini'))
+    key = config['PKI']['key_location']
+    client = Client(config['Connection']['backend_addr'], key)
+    assert client.temps().target is not None
+    assert len(client.miners().states) > 0
+    with pytest.raises(BackendUnavailable):
+        Client('127.0.0.1:1', key).temps()
+    # the plain HTTP backend fails the TLS handshake of an https:// address
+    address = config['Connection']['backend_addr'].split('://')[-1]
+    client = Client('https://' + address, key)
+    assert client.handler.connection == 'https://' + address
+    with pytest.raises(BackendError, match='TLS connection'):
+        client.temps()
+
+    async def fetch():
+        clients = [AsyncClient(config['Connection']['backend_addr'], key)
+                   for _ in range(4)]
+        return await asyncio.gather(*(c.fans() for c in clients))
+    loop = asyncio.new_event_loop()
+    try:
+        assert all(fans.rpm is not None
+                   for fans in loop.run_until_complete(fetch()))
+    finally:
+        loop.close()
+
+def test_output_ndjson():
+    import json
+    result = _test('-t', '-f', '--output', 'ndjson')
+    assert result.returncode == 0
+    records = [json.loads(line) for line in result.stdout.splitlines()]
+    assert sorted(record['resource'] for record in records) == ['/filter',
+                                                                '/temp']
+    assert all('target' in record['data'] for record in records
+               if record['resource'] == '/temp')
+    assert not _in(result.stdout, 'Measurements')
+
+def test_output_json():
+    import json
+    result = _test('-a', '--output', 'json')
+    assert result.returncode == 0
+    assert len(json.loads(result.stdout)) == 7
+
+def test_output_json_unreachable(backend):
+    import json
+    _test('-b', '127.0.0.1:1')
+    try:
+        result = _test('--no-agent', '-t', '-f', '--output', 'json')
+    finally:
+        _test('-b', backend)
+    assert result.returncode == 1
+    records = json.loads(result.stdout)
+    assert len(records) == 1
+    assert _in(records[0]['error'], 'could not be established')
+
+def test_export():
+    import time
+    import urllib.request
+    # port 0 picks a free port, which is printed on startup
+    exporter = subprocess.Popen(['minerctl', 'export', '--listen',
+                                 '127.0.0.1:0', '-n', '60'],
+                                universal_newlines=True,
+                                stdout=subprocess.PIPE)
+    try:
+        line = exporter.stdout.readline()
+        assert _in(line, 'Serving metrics')
+        url = re.search(r'http://\S+/metrics', line).group(0)
+        time.sleep(1)
+        for _ in range(3):
+            with urllib.request.urlopen(url) as resp:
+                page = resp.read().decode('utf-8')
+            assert _in(page, 'minerctl_up 1.0', 'minerctl_temperature_celsius{',
+                       'minerctl_miners{state="on"}', '# TYPE minerctl_pid gauge')
+    finally:
+        exporter.terminate()
+    assert _in(exporter.communicate()[0], 'Exporter stopped after 3 scrapes')
+
+def test_export_unexpected_error():
+    import exporter
+
+    def fetch():
+        raise RuntimeError('unexpected')
+    metrics = exporter.Exporter(fetch, 60)
+    metrics.refresh()
+    metrics.refresh()
+    page = metrics.page.decode('utf-8')
+    assert _in(page, 'minerctl_up 0.0', 'minerctl_refresh_failures_total 2.0')
+
+def test_response_cache():
+    _test('-i', '-o', '-p')
+    result = _test('-i', '-o', '-p', '--debug')
+    assert _in(result.stdout, 'Requests issued: 0, requests avoided: 3')
+    result = _test('-i', '-o', '-p', '--debug', '--no-cache')
+    assert _in(result.stdout, 'Requests issued: 3, requests avoided: 0')
+    value = str(random.randint(0, 10))
+    assert _test('set', '--bias', value).returncode == 0
+    result = _test('-p', '--debug')
+    assert _in(result.stdout, 'bias: {}'.format(value),
+               'Requests issued: 1, requests avoided: 0')
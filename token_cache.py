@@ -0,0 +1,108 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+
+class TokenCache:
+    """
+    Keeps minted access tokens on disk, so that short-lived CLI calls can skip
+    reading the private key and signing a new token. Entries are stored per
+    key file and backend and are discarded once their lifetime has passed or
+    the key file has been modified.
+    """
+    def __init__(self, location, lifetime):
+        """
+        :param location: path of the cache file, only readable by the owner
+        :param lifetime: number of seconds a token is reused
+        """
+        self.location = location
+        self.lifetime = lifetime
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _entry_key(private_key_location, connection):
+        """
+        :returns: hex digest identifying the key file/backend combination
+        """
+        ident = '{}|{}'.format(os.path.realpath(private_key_location),
+                               connection)
+        return hashlib.sha256(ident.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _fingerprint(private_key_location):
+        """
+        :returns: list describing the current version of the key file or None
+        if it does not exist
+        """
+        try:
+            stat = os.stat(private_key_location)
+        except FileNotFoundError:
+            return None
+        return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+    def _read(self):
+        """
+        :returns: dict with all the cache entries, empty if the cache file is
+        missing or corrupted
+        """
+        try:
+            with open(self.location, 'r') as file:
+                entries = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def load(self, private_key_location, connection):
+        """
+        Looks up a still valid token.
+
+        :param private_key_location: key file location
+        :param connection: http://<ip/domain>:port
+        :returns: token str or None
+        """
+        entry = self._read().get(self._entry_key(private_key_location,
+                                                 connection))
+        if not entry or time.time() - entry['created'] >= self.lifetime:
+            return None
+        if entry['fingerprint'] != self._fingerprint(private_key_location):
+            return None
+        return entry['token']
+
+    def store(self, private_key_location, connection, token):
+        """
+        Saves the token and drops all the expired entries.
+
+        :param private_key_location: key file location
+        :param connection: http://<ip/domain>:port
+        :param token: access token str
+        """
+        with self._lock:
+            now = time.time()
+            entries = {key: entry for key, entry in self._read().items()
+                       if now - entry.get('created', 0) < self.lifetime}
+            entries[self._entry_key(private_key_location, connection)] = {
+                'token': token, 'created': now,
+                'fingerprint': self._fingerprint(private_key_location)}
+            self._write(entries)
+
+    def _write(self, entries):
+        """
+        Replaces the cache file atomically, it is created with 0600
+        permissions.
+
+        :param entries: dict with all the cache entries
+        """
+        tmp_location = '{}.{}.tmp'.format(self.location, os.getpid())
+        try:
+            fd = os.open(tmp_location, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                         0o600)
+            with os.fdopen(fd, 'w') as file:
+                json.dump(entries, file)
+            os.chmod(tmp_location, 0o600)
+            os.replace(tmp_location, self.location)
+        except OSError:
+            # the cache is an optimization only, a failed write is not fatal
+            if os.path.exists(tmp_location):
+                os.remove(tmp_location)
@@ -0,0 +1,133 @@
+import ssl
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class _TicketSocket(ssl.SSLSocket):
+    """
+    SSLSocket which hands its session to the context once the first data has
+    been read. With TLS 1.3 the session tickets are only sent after the
+    handshake, the session is not resumable before.
+    """
+    def read(self, *args, **kwargs):
+        data = super().read(*args, **kwargs)
+        key = getattr(self, '_session_key', None)
+        if key is not None:
+            self._session_key = None
+            self.context._store_session(key, self.session)
+        return data
+
+
+class SessionReusingContext(ssl.SSLContext):
+    """
+    SSLContext which resumes the TLS session of the latest connection to the
+    same server, so further connections (eg the parallel connections of a
+    fan-out or a reconnect after an idle timeout) skip the full handshake.
+    """
+    sslsocket_class = _TicketSocket
+
+    def __init__(self, *args, **kwargs):
+        # the protocol is consumed by SSLContext.__new__
+        self._sessions = {}
+        self._session_lock = threading.Lock()
+        self.handshakes = 0
+        self.resumed = 0
+
+    def _store_session(self, key, session):
+        if session is not None:
+            with self._session_lock:
+                self._sessions[key] = session
+
+    def wrap_socket(self, sock, server_side=False, do_handshake_on_connect=True,
+                    suppress_ragged_eofs=True, server_hostname=None,
+                    session=None):
+        key = (server_hostname,) + tuple(sock.getpeername()[:2])
+        if session is None and not server_side:
+            with self._session_lock:
+                session = self._sessions.get(key)
+        ssl_sock = super().wrap_socket(
+            sock, server_side=server_side,
+            do_handshake_on_connect=do_handshake_on_connect,
+            suppress_ragged_eofs=suppress_ragged_eofs,
+            server_hostname=server_hostname, session=session)
+        with self._session_lock:
+            self.handshakes += 1
+            if ssl_sock.session_reused:
+                self.resumed += 1
+        ssl_sock._session_key = key
+        return ssl_sock
+
+
+def create_ssl_context():
+    """
+    :returns: SessionReusingContext with the settings urllib3 would use, the
+    certificate checks are configured by urllib3 per connection
+    """
+    context = SessionReusingContext(ssl.PROTOCOL_TLS_CLIENT)
+    # urllib3 verifies the host name itself, after the optional pinning
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    context.options |= ssl.OP_NO_COMPRESSION
+    return context
+
+
+class TLSAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose HTTPS pools share one session resuming SSLContext and
+    optionally pin the SHA-256 fingerprint of the backend certificate.
+    """
+    def __init__(self, fingerprint=None, **kwargs):
+        """
+        :param fingerprint: hex SHA-256 fingerprint of the expected server
+        certificate or None
+        :param kwargs: HTTPAdapter arguments, eg pool sizes
+        """
+        # set before HTTPAdapter.__init__ creates the pool manager
+        self.ssl_context = create_ssl_context()
+        self.fingerprint = fingerprint
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['ssl_context'] = self.ssl_context
+        if self.fingerprint:
+            kwargs['assert_fingerprint'] = self.fingerprint
+        super().init_poolmanager(*args, **kwargs)
+
+
+def create_session(policy, pool_connections=10, pool_maxsize=None,
+                   timed=False):
+    """
+    Creates a requests session for http:// and https:// backends. Responses
+    may be compressed with gzip or deflate, requests decodes them.
+
+    :param policy: ConnectionPolicy with the pool size and the TLS settings
+    :param pool_connections: number of hosts whose pools are kept
+    :param pool_maxsize: connections kept per host, defaults to the one of
+    the policy
+    :param timed: measure the connect times for instrumentation.Timings
+    :returns: requests.Session
+    """
+    adapter_cls = TLSAdapter
+    if timed:
+        from instrumentation import TimedHTTPAdapter as adapter_cls
+
+    # retries are handled by SecureHandler, which applies backoff
+    adapter = adapter_cls(fingerprint=policy.fingerprint,
+                          pool_connections=pool_connections,
+                          pool_maxsize=pool_maxsize or policy.pool_maxsize,
+                          max_retries=0)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def verification(policy):
+    """
+    :param policy: ConnectionPolicy with the TLS settings
+    :returns: `verify` argument of the requests, passed per request as
+    REQUESTS_CA_BUNDLE would override the one of the session
+    """
+    # a pinned certificate is usually self-signed and replaces the CA check
+    return policy.ca_file or not policy.fingerprint